@@ -0,0 +1,595 @@
+"""PDF到Anki问答题工具的性能基准测试
+
+生成合成PDF（文字密集、图片密集、超大幅面），测量页面渲染、缩放、区域截图、图片编码
+和端到端制卡的耗时。AnkiConnect由本地模拟服务器代替，可以设置延迟和错误注入。
+结果写入JSON文件，可以用--compare与之前的结果比较，发现性能退化。
+
+    python benchmark.py --output results.json
+    python benchmark.py --latency-ms 50 --error-rate 0.1 --compare results.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import fitz
+import PIL
+from PIL import Image
+
+from main import (
+    AnkiConnectClient, CapturePolicy, CardOutbox, ImageEncodingSettings, PageRenderCache,
+    capture_dpi, encode_image, media_filename, render_and_encode_clip, render_clip, render_page, render_tile,
+)
+
+
+# 编码格式与界面中的选项一致
+ENCODING_PRESETS = {
+    "PNG": ImageEncodingSettings("PNG", 85, 0),
+    "PNG(256色)": ImageEncodingSettings("PNG", 85, 256),
+    "WebP": ImageEncodingSettings("WEBP", 85, 0),
+    "JPEG": ImageEncodingSettings("JPEG", 85, 0),
+}
+
+# 启动时间目标：从启动Python进程到窗口首次绘制完成（没有图形界面时为导入main模块）
+STARTUP_TARGET_MS = 1000
+# 启动时不应导入的较慢模块，它们应在窗口显示后才导入
+HEAVY_MODULES = ("fitz", "pymupdf", "requests", "PIL.Image", "PIL.ImageTk")
+
+# 在子进程中执行，测量导入和首次绘制的耗时
+STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+result = {"import_ms": (time.perf_counter() - started) * 1000}
+result["heavy_modules_at_import"] = [m for m in %r if m in sys.modules]
+try:
+    root = main.tk.Tk()
+except main.tk.TclError as e:
+    result["first_paint_skipped"] = str(e)
+else:
+    app = main.PDFAnkiTool(root)
+    root.update()
+    result["first_paint_ms"] = (time.perf_counter() - started) * 1000
+    result["heavy_modules_at_paint"] = [m for m in %r if m in sys.modules]
+    root.destroy()
+print(json.dumps(result))
+""" % (HEAVY_MODULES, HEAVY_MODULES)
+
+LOREM = (
+    "The Fourier transform decomposes a function into its constituent frequencies. "
+    "傅里叶变换将函数分解为不同频率的分量。卷积定理指出时域卷积对应频域乘积。 "
+)
+
+
+# ---------------------------------------------------------------------------
+# 合成PDF
+# ---------------------------------------------------------------------------
+
+def make_text_pdf(path, pages=20, seed=1):
+    """文字密集的PDF：每页多段小字号文字和少量矢量图形"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for page_index in range(pages):
+        page = doc.new_page(width=595, height=842)
+        y = 50
+        while y < 790:
+            lines = rng.randint(3, 8)
+            box = fitz.Rect(50, y, 545, y + lines * 12)
+            page.insert_textbox(box, LOREM * lines, fontsize=9, fontname="china-s")
+            y = box.y1 + 14
+        page.draw_rect(fitz.Rect(50, 20, 545, 40), color=(0, 0, 0.6), width=0.8)
+        page.insert_text((60, 34), f"Chapter {page_index + 1}", fontsize=12)
+    doc.save(path)
+    doc.close()
+
+
+def make_image_pdf(path, pages=10, seed=2):
+    """图片密集的PDF：每页嵌入多张照片式的位图"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=595, height=842)
+        for row in range(3):
+            for col in range(2):
+                # 渐变加噪声，压缩特性接近扫描件和照片
+                size = (400, 300)
+                gradient = Image.linear_gradient("L").resize(size)
+                noise = Image.effect_noise(size, rng.uniform(20, 60))
+                img = Image.merge("RGB", (gradient, noise, gradient.rotate(90).resize(size)))
+                data = encode_image(img, ImageEncodingSettings("JPEG", 85, 0))[0]
+                rect = fitz.Rect(40 + col * 265, 40 + row * 260, 290 + col * 265, 230 + row * 260)
+                page.insert_image(rect, stream=data)
+        page.insert_text((50, 820), "Figure caption " * 6, fontsize=8)
+    doc.save(path)
+    doc.close()
+
+
+def make_huge_pdf(path, seed=3):
+    """超大幅面的PDF：A0海报，布满细线和小字，模拟电路图或工程图纸"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    page = doc.new_page(width=2384, height=3370)
+    shape = page.new_shape()
+    for _ in range(4000):
+        x, y = rng.uniform(0, 2384), rng.uniform(0, 3370)
+        shape.draw_line((x, y), (x + rng.uniform(-60, 60), y + rng.uniform(-60, 60)))
+    shape.finish(color=(0.1, 0.1, 0.1), width=0.4)
+    shape.commit()
+    for row in range(0, 3370, 40):
+        page.insert_text((20, row + 20), f"R{row} C12 U7 net_{row:04d} " * 20, fontsize=6)
+    doc.save(path)
+    doc.close()
+
+
+# ---------------------------------------------------------------------------
+# 本地AnkiConnect模拟服务器
+# ---------------------------------------------------------------------------
+
+class MockAnkiConnect:
+    """实现制卡所需接口的AnkiConnect模拟服务器
+
+    latency_ms为每个请求的附加延迟；error_rate为请求返回暂时性错误的比例，
+    用于测量发送队列的重试开销。lost_rate为请求已执行但响应丢失（返回暂时性错误）的比例，
+    用于检查发送队列重发前按ID标签查重，不会重复添加卡片。
+    添加的笔记及其标签保存在内存中，findNotes支持按标签查询，removeTags删除标签。
+    """
+
+    def __init__(self, port=8765, latency_ms=0.0, error_rate=0.0, lost_rate=0.0, seed=0):
+        self.port = port
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.lost_rate = lost_rate
+        self.requests = {}
+        self.errors = 0
+        self.lost = 0
+        self.notes = {}  # 笔记ID -> 标签列表
+        self.id_tags = []  # 添加笔记时带有的卡片ID标签，用于统计重复添加
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    def start(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                out = json.dumps(mock.handle(body)).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(out)))
+                self.end_headers()
+                self.wfile.write(out)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="mock-anki", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = {}
+            self.errors = 0
+            self.lost = 0
+            self.notes = {}
+            self.id_tags = []
+
+    def duplicate_notes(self):
+        """按添加时的卡片ID标签统计重复添加的笔记数"""
+        with self._lock:
+            return len(self.id_tags) - len(set(self.id_tags))
+
+    def leftover_id_tags(self):
+        """统计确认后没有删除的卡片ID标签数"""
+        with self._lock:
+            return sum(
+                tag.startswith(CardOutbox.ID_TAG_PREFIX) for tags in self.notes.values() for tag in tags
+            )
+
+    def handle(self, body):
+        """处理一次请求，返回AnkiConnect格式的响应"""
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        action = body.get("action")
+        with self._lock:
+            self.requests[action] = self.requests.get(action, 0) + 1
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            lost = not failed and self._rng.random() < self.lost_rate
+            if lost:
+                self.lost += 1
+        if failed:
+            return {"result": None, "error": "collection is not available"}
+        result = self.result(action, body.get("params", {}))
+        if lost:
+            return {"result": None, "error": "collection is not available"}
+        return {"result": result, "error": None}
+
+    def result(self, action, params):
+        if action == "version":
+            return 6
+        if action == "modelNames":
+            return ["问答题", "Basic"]
+        if action == "modelFieldNames":
+            return ["正面", "背面"]
+        if action == "getMediaFilesNames":
+            return []
+        if action == "findNotes":
+            # 只支持发送队列使用的"tag:<标签>"查询
+            query = params.get("query", "").strip('"')
+            if not query.startswith("tag:"):
+                return []
+            tag = query[len("tag:"):].lower()
+            with self._lock:
+                return [note_id for note_id, tags in self.notes.items() if tag in (t.lower() for t in tags)]
+        if action == "storeMediaFile":
+            return params["filename"]
+        if action == "addNote":
+            tags = list(params["note"].get("tags", []))
+            with self._lock:
+                note_id = len(self.notes) + 1
+                self.notes[note_id] = tags
+                self.id_tags.extend(tag for tag in tags if tag.startswith(CardOutbox.ID_TAG_PREFIX))
+                return note_id
+        if action == "removeTags":
+            removed = set(params["tags"].lower().split())
+            with self._lock:
+                for note_id in params["notes"]:
+                    if note_id in self.notes:
+                        self.notes[note_id] = [tag for tag in self.notes[note_id] if tag.lower() not in removed]
+            return None
+        if action == "multi":
+            return [
+                {"result": self.result(item["action"], item.get("params", {})), "error": None}
+                for item in params["actions"]
+            ]
+        return None
+
+
+# ---------------------------------------------------------------------------
+# 测量
+# ---------------------------------------------------------------------------
+
+def measure(func, repeat=5):
+    """多次执行func，返回耗时统计（毫秒），第一次执行作为预热不计入"""
+    func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {
+        "min_ms": min(samples),
+        "median_ms": statistics.median(samples),
+        "mean_ms": statistics.mean(samples),
+        "repeat": repeat,
+    }
+
+
+def bench_render(docs, repeat):
+    """整页渲染：各文档在100%和200%下渲染前几页"""
+    results = {}
+    for name, doc in docs.items():
+        for scale in (1.0, 2.0):
+            pages = [doc[i] for i in range(min(3, len(doc)))]
+            results[f"{name}@{int(scale * 100)}%"] = measure(
+                lambda: [render_page(page, scale) for page in pages], repeat
+            )
+    return results
+
+
+def bench_zoom(docs, repeat, viewport=(1200, 800)):
+    """缩放：连续缩放时整页渲染的耗时，以及超大页面只渲染视口图块的耗时"""
+    results = {}
+    page = docs["text"][0]
+    scales = [1.0 * 1.2 ** step for step in range(-3, 7)]
+    results["text.zoom_sequence"] = measure(lambda: [render_page(page, s) for s in scales], repeat)
+
+    # 缩放档位命中内存缓存时的开销
+    cache = PageRenderCache()
+    for s in scales:
+        cache.put(cache.make_key("text", 0, s), render_page(page, s))
+    results["text.zoom_sequence_cached"] = measure(
+        lambda: [cache.get(cache.make_key("text", 0, s)) for s in scales], repeat
+    )
+
+    huge = docs["huge"][0]
+    for scale in (1.0, 3.0):
+        results[f"huge.full@{int(scale * 100)}%"] = measure(lambda: render_page(huge, scale), max(1, repeat // 2))
+        columns = -(-viewport[0] // 512)
+        rows = -(-viewport[1] // 512)
+        results[f"huge.viewport_tiles@{int(scale * 100)}%"] = measure(
+            lambda: [render_tile(huge, scale, c, r) for c in range(columns) for r in range(rows)], repeat
+        )
+    return results
+
+
+def bench_capture(docs, repeat):
+    """区域截图：半页区域在不同DPI下的渲染耗时，以及超大区域按截图策略渲染的耗时"""
+    results = {}
+    for name in ("text", "image"):
+        page = docs[name][0]
+        clip = fitz.Rect(40, 40, 555, 440)
+        for dpi in (150, 300, 600):
+            results[f"{name}@{dpi}dpi"] = measure(lambda: render_clip(page, clip, dpi), repeat)
+    # 整张A0页面：按截图策略自动降低DPI并分条带渲染
+    huge = docs["huge"][0]
+    dpi = capture_dpi(huge.rect, CapturePolicy())
+    results[f"huge.full_page@{dpi}dpi"] = measure(lambda: render_clip(huge, huge.rect, dpi), repeat)
+    return results
+
+
+def bench_encode(docs, repeat):
+    """图片编码：各编码格式的耗时和输出大小"""
+    results = {}
+    for name in ("text", "image"):
+        img = render_clip(docs[name][0], fitz.Rect(40, 40, 555, 440), 300)
+        for preset, settings in ENCODING_PRESETS.items():
+            stats = measure(lambda: encode_image(img, settings), repeat)
+            stats["bytes"] = len(encode_image(img, settings)[0])
+            results[f"{name}.{preset}"] = stats
+    return results
+
+
+def bench_end_to_end(pdf_path, mock, workdir, cards=40, dpi=300, settings=None, timeout=120):
+    """端到端制卡：截图、编码、写入发送队列，直到全部同步到模拟的AnkiConnect
+
+    与界面相同，截图在spawn方式启动的进程池中渲染和编码，计时包括工作进程的启动。
+    """
+    settings = settings or ENCODING_PRESETS["PNG"]
+    mock.reset_counters()
+    client = AnkiConnectClient(url=mock.url, metadata_path=None)
+    outbox = CardOutbox(client, directory=os.path.join(workdir, "outbox"), base_delay=0.05, max_delay=1.0)
+    with fitz.open(pdf_path) as doc:
+        page_count = len(doc)
+    rng = random.Random(4)
+
+    started = time.perf_counter()
+    render_pool = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn"))
+    outbox.start()
+    futures = []
+    for index in range(cards):
+        y = rng.uniform(40, 600)
+        futures.append(render_pool.submit(
+            render_and_encode_clip, pdf_path, index % page_count, (50, y, 545, y + 200), dpi, settings
+        ))
+    media_bytes = 0
+    for index, future in enumerate(futures):
+        img_data, extension = future.result()
+        media_bytes += len(img_data)
+        outbox.put(f"问题{index}", media_filename(img_data, extension), img_data)
+    captured = time.perf_counter() - started
+
+    deadline = time.perf_counter() + timeout
+    while outbox.pending_count() and time.perf_counter() < deadline:
+        time.sleep(0.005)
+    total = time.perf_counter() - started
+    pending = outbox.pending_count()
+
+    outbox.stop()
+    render_pool.shutdown()
+    client.shutdown()
+    return {
+        "cards": cards,
+        "capture_s": captured,
+        "total_s": total,
+        "cards_per_s": cards / total if total else 0.0,
+        "media_bytes": media_bytes,
+        "unsynced": pending,
+        "anki_requests": dict(mock.requests),
+        "injected_errors": mock.errors,
+        "lost_responses": mock.lost,
+        "notes_added": len(mock.notes),
+        "duplicate_notes": mock.duplicate_notes(),
+        "leftover_id_tags": mock.leftover_id_tags(),
+    }
+
+
+def bench_startup(repeat=3, target_ms=STARTUP_TARGET_MS):
+    """启动时间：在独立的进程中测量，包括Python解释器启动；配置目录指向临时目录，不影响用户数据"""
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    home = tempfile.mkdtemp(prefix="pdfanki-bench-home-")
+    env = dict(os.environ, HOME=home, USERPROFILE=home)
+    env["PYTHONPATH"] = package_dir + os.pathsep + env.get("PYTHONPATH", "")
+    runs = []
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            output = subprocess.run(
+                [sys.executable, "-c", STARTUP_PROBE], cwd=package_dir, env=env,
+                capture_output=True, text=True, check=True
+            ).stdout
+            probe = json.loads(output.strip().splitlines()[-1])
+            probe["process_ms"] = (time.perf_counter() - started) * 1000
+            runs.append(probe)
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+
+    result = {
+        "import_ms": statistics.median(run["import_ms"] for run in runs),
+        "process_ms": statistics.median(run["process_ms"] for run in runs),
+        "heavy_modules_at_import": runs[-1]["heavy_modules_at_import"],
+        "target_ms": target_ms,
+        "repeat": repeat,
+    }
+    if "first_paint_ms" in runs[-1]:
+        result["first_paint_ms"] = statistics.median(run["first_paint_ms"] for run in runs)
+        result["heavy_modules_at_paint"] = runs[-1]["heavy_modules_at_paint"]
+        measured = result["first_paint_ms"]
+    else:
+        result["first_paint_skipped"] = runs[-1]["first_paint_skipped"]
+        measured = result["import_ms"]
+    result["meets_target"] = measured <= target_ms and not result["heavy_modules_at_import"]
+    return result
+
+
+# ---------------------------------------------------------------------------
+# 结果比较
+# ---------------------------------------------------------------------------
+
+def flatten(results, prefix=""):
+    """把嵌套结果展开为{路径: 数值}，只保留耗时指标"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "/"))
+        elif key in ("median_ms", "total_s", "import_ms", "first_paint_ms") and isinstance(value, (int, float)):
+            flat[path] = value
+    return flat
+
+
+def compare(current, baseline, threshold=0.15):
+    """与之前的结果比较，返回变慢超过threshold的指标列表"""
+    now = flatten(current["results"])
+    before = flatten(baseline["results"])
+    regressions = []
+    for path in sorted(now):
+        if path not in before or not before[path]:
+            continue
+        ratio = now[path] / before[path]
+        mark = ""
+        if ratio > 1 + threshold:
+            mark = "  <-- 变慢"
+            regressions.append((path, ratio))
+        print(f"{path:60s} {before[path]:10.2f} -> {now[path]:10.2f}  x{ratio:.2f}{mark}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="PDF到Anki问答题工具性能基准测试")
+    parser.add_argument("--output", default="benchmark_results.json", help="结果文件（JSON）")
+    parser.add_argument("--compare", metavar="BASELINE", help="与之前的结果文件比较")
+    parser.add_argument("--threshold", type=float, default=0.15, help="判定为变慢的比例（默认0.15）")
+    parser.add_argument("--repeat", type=int, default=5, help="每项测量的重复次数")
+    parser.add_argument("--cards", type=int, default=40, help="端到端测试的卡片数")
+    parser.add_argument("--port", type=int, default=8765, help="模拟AnkiConnect的端口（Anki正在运行时请换一个）")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="模拟AnkiConnect每个请求的延迟")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟AnkiConnect返回暂时性错误的比例")
+    parser.add_argument("--lost-rate", type=float, default=0.0,
+                        help="模拟AnkiConnect已执行请求但响应丢失的比例，用于检查重发时不会重复添加")
+    parser.add_argument("--startup-target-ms", type=float, default=STARTUP_TARGET_MS,
+                        help="启动时间目标，超出时退出码为1")
+    parser.add_argument("--only", nargs="+",
+                        choices=["startup", "render", "zoom", "capture", "encode", "end_to_end"],
+                        help="只运行指定的测试")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    selected = set(args.only or ["startup", "render", "zoom", "capture", "encode", "end_to_end"])
+    workdir = tempfile.mkdtemp(prefix="pdfanki-bench-")
+    mock = None
+    try:
+        paths = {name: os.path.join(workdir, f"{name}.pdf") for name in ("text", "image", "huge")}
+        make_text_pdf(paths["text"])
+        make_image_pdf(paths["image"])
+        make_huge_pdf(paths["huge"])
+        docs = {name: fitz.open(path) for name, path in paths.items()}
+
+        results = {}
+        if "startup" in selected:
+            print("运行: startup")
+            results["startup"] = bench_startup(target_ms=args.startup_target_ms)
+        steps = [
+            ("render", lambda: bench_render(docs, args.repeat)),
+            ("zoom", lambda: bench_zoom(docs, args.repeat)),
+            ("capture", lambda: bench_capture(docs, args.repeat)),
+            ("encode", lambda: bench_encode(docs, args.repeat)),
+        ]
+        for name, step in steps:
+            if name in selected:
+                print(f"运行: {name}")
+                results[name] = step()
+
+        if "end_to_end" in selected:
+            print("运行: end_to_end")
+            try:
+                mock = MockAnkiConnect(args.port, args.latency_ms, args.error_rate, args.lost_rate).start()
+            except OSError as e:
+                print(f"无法在端口{args.port}启动模拟AnkiConnect（{e}），请用--port指定其他端口")
+                return 2
+            results["end_to_end"] = {
+                "text": bench_end_to_end(paths["text"], mock, workdir, cards=args.cards),
+                "image": bench_end_to_end(paths["image"], mock, workdir, cards=args.cards),
+            }
+
+        for doc in docs.values():
+            doc.close()
+    finally:
+        if mock is not None:
+            mock.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "pymupdf": fitz.VersionBind,
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "latency_ms": args.latency_ms,
+            "error_rate": args.error_rate,
+            "lost_rate": args.lost_rate,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到 {args.output}")
+
+    status = 0
+    for name, run in results.get("end_to_end", {}).items():
+        if run["duplicate_notes"] or run["unsynced"]:
+            print(f"端到端({name}): 重复添加{run['duplicate_notes']}张，未同步{run['unsynced']}张")
+            status = 1
+    startup = results.get("startup")
+    if startup is not None:
+        measured = startup.get("first_paint_ms", startup["import_ms"])
+        print(f"启动时间: {measured:.0f}ms（目标{startup['target_ms']:.0f}ms）")
+        if startup["heavy_modules_at_import"]:
+            print(f"启动时导入了较慢的模块: {', '.join(startup['heavy_modules_at_import'])}")
+        if not startup["meets_target"]:
+            status = 1
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)}项指标变慢超过{int(args.threshold * 100)}%")
+            return 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
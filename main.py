@@ -1,15 +1,2337 @@
 import tkinter as tk
 from tkinter import filedialog, simpledialog, messagebox
-import fitz  # PyMuPDF库，用于处理PDF
-import requests
+import importlib
+import importlib.util
 import io
-from PIL import Image, ImageTk
 import os
+import sys
+import csv
+import argparse
 import uuid
 import json
+import base64
+import hashlib
+import itertools
+import gzip
+import re
+import threading
+import multiprocessing
+import time
+import random
+import sqlite3
+import zipfile
+import shutil
+import atexit
+from collections import OrderedDict, defaultdict, deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, as_completed, FIRST_COMPLETED
+
+
+class LazyModule:
+    """模块代理，首次访问属性时才真正导入
+
+    PyMuPDF、requests和Pillow的导入耗时明显，推迟到第一次使用（或后台预热）时再导入，窗口可以先显示出来。
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "已导入" if self._module is not None else "未导入"
+        return f"<LazyModule {self._name} ({state})>"
+
+
+fitz = LazyModule("fitz")  # PyMuPDF库，用于处理PDF
+requests = LazyModule("requests")
+Image = LazyModule("PIL.Image")
+ImageTk = LazyModule("PIL.ImageTk")
+
+
+def warm_up_imports():
+    """在后台线程中预先导入较慢的模块，用户第一次打开PDF或添加卡片时不必等待"""
+    def worker():
+        for module in (fitz, Image, ImageTk, requests):
+            try:
+                module._load()
+            except Exception:
+                # 导入失败时在真正使用的地方报错
+                pass
+    
+    thread = threading.Thread(target=worker, name="warm-up-imports", daemon=True)
+    thread.start()
+    return thread
+
+
+# 本工具的配置和缓存目录
+CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".py-pdf-anki")
+ANKI_METADATA_PATH = os.path.join(CONFIG_DIR, "anki_metadata.json")
+OUTBOX_DIR = os.path.join(CONFIG_DIR, "outbox")
+
+TEXT_INDEX_DIR = os.path.join(CONFIG_DIR, "text_index")
+THUMBNAIL_DIR = os.path.join(CONFIG_DIR, "thumbnails")
+RENDER_CACHE_DIR = os.path.join(CONFIG_DIR, "render_cache")
+
+# 上传到Anki的图片文件名前缀，文件名其余部分为图片内容的哈希
+MEDIA_NAME_PREFIX = "pdfanki_"
+
+
+def media_filename(img_data, extension):
+    """根据图片内容生成文件名，相同内容的图片得到相同的文件名"""
+    digest = hashlib.sha256(img_data).hexdigest()[:24]
+    return f"{MEDIA_NAME_PREFIX}{digest}.{extension}"
+
+
+class _NullSpan:
+    """埋点关闭时使用的空span，不做任何记录"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """一个计时区间，退出时把耗时交给Tracer记录"""
+
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer._record_span(self.name, self.start, time.perf_counter(), self.args)
+        return False
+
+
+class Tracer:
+    """性能埋点：记录各阶段耗时和缓存、队列指标，可导出为JSON Lines或Chrome trace格式
+    
+    默认关闭，关闭时span()直接返回空span；通过环境变量PDFANKI_TRACE或命令行参数--trace开启，
+    文件扩展名为.json时导出Chrome trace（可在chrome://tracing或Perfetto中打开），否则导出JSON Lines。
+    """
+
+    def __init__(self, max_events=200000, history=200):
+        self.enabled = False
+        self.path = None
+        self._origin = time.perf_counter()
+        self._events = deque(maxlen=max_events)
+        self._durations = defaultdict(lambda: deque(maxlen=history))  # 名称 -> 最近的耗时（毫秒）
+        self._lock = threading.Lock()
+
+    def enable(self, path=None):
+        """开启埋点，path不为空时在程序退出时导出"""
+        if path and self.path is None:
+            atexit.register(self.export)
+        self.path = path or self.path
+        self.enabled = True
+
+    def span(self, name, **args):
+        """返回计时上下文管理器：with tracer.span("render"): ..."""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, args)
+
+    def _record_span(self, name, start, end, args):
+        event = {
+            "name": name, "ph": "X",
+            "ts": round((start - self._origin) * 1e6), "dur": round((end - start) * 1e6),
+            "pid": os.getpid(), "tid": threading.get_ident(),
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self._events.append(event)
+            self._durations[name].append((end - start) * 1000)
+
+    def counter(self, name, **values):
+        """记录一组指标的当前值，例如缓存命中数、队列长度"""
+        if not self.enabled:
+            return
+        event = {
+            "name": name, "ph": "C",
+            "ts": round((time.perf_counter() - self._origin) * 1e6),
+            "pid": os.getpid(), "tid": threading.get_ident(), "args": values,
+        }
+        with self._lock:
+            self._events.append(event)
+
+    def drain(self):
+        """取出并清空已记录的事件，返回(时间原点, 事件列表)；工作进程用它把记录交给主进程"""
+        with self._lock:
+            events = list(self._events)
+            self._events.clear()
+        return self._origin, events
+
+    def merge(self, origin, events):
+        """合并其他进程记录的事件，时间戳换算到本进程的时间原点
+        
+        perf_counter在同一台机器的各进程间使用同一个单调时钟，只需平移两个进程时间原点的差。
+        """
+        offset = round((origin - self._origin) * 1e6)
+        with self._lock:
+            for event in events:
+                event["ts"] += offset
+                self._events.append(event)
+                if event["ph"] == "X":
+                    self._durations[event["name"]].append(event["dur"] / 1000)
+
+    def summary(self):
+        """返回各span最近耗时的统计（毫秒）"""
+        with self._lock:
+            items = [(name, sorted(samples)) for name, samples in self._durations.items() if samples]
+        return {
+            name: {
+                "count": len(ordered),
+                "mean": sum(ordered) / len(ordered),
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            }
+            for name, ordered in items
+        }
+
+    def export(self, path=None):
+        """导出记录的事件，返回写入的路径"""
+        path = path or self.path
+        if not path:
+            return None
+        with self._lock:
+            events = list(self._events)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            if path.lower().endswith(".json"):
+                json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+            else:
+                for event in events:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, path)
+        return path
+
+
+# 全局埋点对象，各模块共用
+tracer = Tracer()
+# spawn方式启动的工作进程会重新导入本模块，只在主进程中开启，避免退出时覆盖主进程导出的记录
+if os.environ.get("PDFANKI_TRACE") and multiprocessing.parent_process() is None:
+    tracer.enable(os.environ["PDFANKI_TRACE"])
+
+
+# MuPDF内部资源缓存（字体、解码后的图片等）的上限，超出时清空
+MUPDF_STORE_LIMIT = 64 * 1024 * 1024
+# 截图流水线中同时驻留内存的光栅图像上限
+CAPTURE_RASTER_LIMIT = 512 * 1024 * 1024
+# 截图的默认像素上限和卡片上的目标尺寸（长边像素数），选区过大时自动降低DPI
+CAPTURE_MAX_PIXELS = 16 * 1000 * 1000
+CAPTURE_TARGET_SIZE = 2400
+# 自动降低DPI时的下限，像素上限优先于该下限
+CAPTURE_MIN_DPI = 72
+# 输出超过该像素数的截图按水平条带分块渲染后拼接，峰值内存约为最终图像加一个条带
+CAPTURE_BAND_PIXELS = 4 * 1000 * 1000
+# 页数或文件大小超过以下阈值时，界面使用大文档模式（更小的缓存和预取范围）
+LARGE_DOCUMENT_PAGES = 1000
+LARGE_DOCUMENT_BYTES = 200 * 1024 * 1024
+
+
+# 部分PyMuPDF版本无法查询资源缓存大小，此时每渲染若干次清空一次
+MUPDF_STORE_SHRINK_INTERVAL = 32
+_store_release_calls = itertools.count(1)
+
+
+def release_mupdf_store(limit=MUPDF_STORE_LIMIT):
+    """MuPDF资源缓存超出上限时将其清空，避免遍历大文档时内存持续增长"""
+    size = fitz.TOOLS.store_size()
+    if size is None:
+        if limit == 0 or next(_store_release_calls) % MUPDF_STORE_SHRINK_INTERVAL == 0:
+            fitz.TOOLS.store_shrink(100)
+    elif size > limit:
+        fitz.TOOLS.store_shrink(100)
+
+
+def iter_pages(pdf_path, page_indices=None, store_limit=MUPDF_STORE_LIMIT):
+    """逐页遍历文档的生成器，每页处理完后立即释放该页占用的资源
+    
+    调用方不应在下一次迭代之后继续持有上一页的page对象。
+    """
+    doc = fitz.open(pdf_path)
+    try:
+        indices = range(len(doc)) if page_indices is None else page_indices
+        for index in indices:
+            page = doc[index]
+            yield index, page
+            del page
+            release_mupdf_store(store_limit)
+    finally:
+        doc.close()
+        release_mupdf_store(store_limit)
+
+
+class RasterBudget:
+    """限制同时驻留内存的光栅图像总字节数，超出时阻塞等待其他图像释放"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._condition = threading.Condition()
+
+    @staticmethod
+    def estimate(clip, dpi):
+        """估算按指定DPI渲染裁剪区域得到的RGB图像大小"""
+        zoom = dpi / 72
+        return max(1, int(clip.width * zoom)) * max(1, int(clip.height * zoom)) * 3
+
+    def try_acquire(self, nbytes):
+        """尝试占用预算，超出时返回False；没有任何占用时总是允许，避免单张大图永远无法处理"""
+        with self._condition:
+            if self.used_bytes and self.used_bytes + nbytes > self.max_bytes:
+                return False
+            self.used_bytes += nbytes
+            return True
+
+    def acquire(self, nbytes):
+        """占用预算，超出时等待"""
+        with self._condition:
+            while self.used_bytes and self.used_bytes + nbytes > self.max_bytes:
+                self._condition.wait()
+            self.used_bytes += nbytes
+
+    def release(self, nbytes):
+        with self._condition:
+            self.used_bytes = max(0, self.used_bytes - nbytes)
+            self._condition.notify_all()
+
+
+CapturePolicy = namedtuple("CapturePolicy", ["max_dpi", "max_pixels", "target_size"])
+CapturePolicy.__new__.__defaults__ = (300, CAPTURE_MAX_PIXELS, CAPTURE_TARGET_SIZE)
+
+
+def capture_dpi(clip, policy):
+    """根据截图策略确定裁剪区域的渲染DPI
+    
+    小区域按max_dpi渲染；长边超过target_size时降低DPI，使图片在卡片上的显示尺寸合适；
+    无论如何输出像素数不超过max_pixels。target_size或max_pixels为0表示不限制。
+    """
+    width_in, height_in = max(clip.width, 1) / 72, max(clip.height, 1) / 72
+    dpi = policy.max_dpi
+    if policy.target_size:
+        dpi = max(min(dpi, CAPTURE_MIN_DPI), min(dpi, policy.target_size / max(width_in, height_in)))
+    if policy.max_pixels:
+        dpi = min(dpi, (policy.max_pixels / (width_in * height_in)) ** 0.5)
+    return max(1, int(dpi))
+
+
+ImageEncodingSettings = namedtuple("ImageEncodingSettings", ["image_format", "quality", "colors"])
+ImageEncodingSettings.__new__.__defaults__ = ("PNG", 85, 0)
+
+IMAGE_EXTENSIONS = {"PNG": "png", "WEBP": "webp", "JPEG": "jpg"}
+
+
+def encode_image(img, settings):
+    """按编码设置将PIL图像编码为字节数据，返回(数据, 扩展名)"""
+    with tracer.span("encode_image", format=settings.image_format):
+        return _encode_image(img, settings)
+
+
+def _encode_image(img, settings):
+    image_format = settings.image_format.upper()
+    buffer = io.BytesIO()
+    if image_format == "PNG":
+        if settings.colors:
+            # 调色板量化可以大幅减小扫描页和文字截图的体积
+            img = img.quantize(colors=settings.colors, method=2)  # 2: FASTOCTREE
+        img.save(buffer, format="PNG", optimize=bool(settings.colors))
+    elif image_format == "WEBP":
+        img.save(buffer, format="WEBP", quality=settings.quality, method=4)
+    elif image_format == "JPEG":
+        img.convert("RGB").save(buffer, format="JPEG", quality=settings.quality, optimize=True)
+    else:
+        raise ValueError(f"不支持的图片格式: {settings.image_format}")
+    return buffer.getvalue(), IMAGE_EXTENSIONS[image_format]
+
+
+_digest_cache = {}
+_digest_lock = threading.Lock()
+
+
+def file_digest(path):
+    """计算文件内容的SHA-1，用作磁盘缓存的键；文件大小和修改时间不变时复用上次的结果"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        if key in _digest_cache:
+            return _digest_cache[key]
+    
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    with _digest_lock:
+        _digest_cache[key] = digest.hexdigest()
+    return _digest_cache[key]
+
+
+def render_clip(page, clip, dpi=300, band_pixels=CAPTURE_BAND_PIXELS):
+    """直接在原页面上按指定DPI渲染裁剪区域，返回PIL图像
+    
+    输出超过band_pixels像素时按水平条带分块渲染并拼接，不会同时持有完整的pixmap和PIL图像。
+    """
+    zoom = dpi / 72
+    matrix = fitz.Matrix(zoom, zoom)
+    bbox = (fitz.Rect(clip) * matrix).irect
+    if band_pixels and bbox.width * bbox.height > band_pixels:
+        return _render_clip_bands(page, matrix, bbox, max(1, band_pixels // max(1, bbox.width)))
+    
+    with tracer.span("mupdf.get_pixmap", dpi=dpi):
+        pix = page.get_pixmap(clip=clip, dpi=dpi, alpha=False)
+    with tracer.span("pil.frombytes"):
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    # PIL图像已复制像素数据，立即释放pixmap
+    del pix
+    release_mupdf_store()
+    return img
+
+
+def _render_clip_bands(page, matrix, bbox, band_height):
+    """按设备像素坐标把bbox切成高band_height的条带逐条渲染，粘贴到预先分配的图像中"""
+    img = Image.new("RGB", (bbox.width, bbox.height), "white")
+    inverse = ~matrix
+    with tracer.span("mupdf.get_pixmap_bands", width=bbox.width, height=bbox.height):
+        for top in range(bbox.y0, bbox.y1, band_height):
+            # 条带边界对齐到像素网格，相邻条带之间不会出现缝隙或重叠
+            band = fitz.Rect(bbox.x0, top, bbox.x1, min(top + band_height, bbox.y1)) * inverse
+            pix = page.get_pixmap(matrix=matrix, clip=band, alpha=False)
+            strip = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            img.paste(strip, (pix.x - bbox.x0, pix.y - bbox.y0))
+            del pix, strip
+            release_mupdf_store()
+    return img
+
+
+def render_tile(page, scale_factor, column, row, tile_size=512):
+    """按显示比例渲染页面的一个图块，图块按显示像素坐标以tile_size划分"""
+    step = tile_size / scale_factor
+    clip = fitz.Rect(column * step, row * step, (column + 1) * step, (row + 1) * step) & page.rect
+    with tracer.span("mupdf.get_pixmap", scale=scale_factor, tile=True):
+        pix = page.get_pixmap(matrix=fitz.Matrix(scale_factor, scale_factor), clip=clip, alpha=False)
+    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    del pix
+    release_mupdf_store()
+    return img
+
+
+def render_page(page, scale_factor, render_mode="matrix"):
+    """将PDF页面渲染为指定缩放比例的PIL图像"""
+    if render_mode == "matrix":
+        # 直接按显示比例光栅化，避免先以72 DPI渲染再放大
+        with tracer.span("mupdf.get_pixmap", scale=scale_factor):
+            pix = page.get_pixmap(matrix=fitz.Matrix(scale_factor, scale_factor), alpha=False)
+        with tracer.span("pil.frombytes"):
+            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        # PIL图像已复制像素数据，立即释放pixmap
+        del pix
+        release_mupdf_store()
+        return img
+    
+    pix = page.get_pixmap()
+    
+    # 计算缩放后的尺寸
+    display_width = int(pix.width * scale_factor)
+    display_height = int(pix.height * scale_factor)
+    
+    # 转换为PIL图像
+    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    
+    del pix
+    release_mupdf_store()
+    
+    # 如果需要，调整图像大小
+    if scale_factor != 1.0:
+        img = img.resize((display_width, display_height), Image.LANCZOS)
+    return img
+
+
+class PageRenderCache:
+    """页面渲染结果的内存缓存，按(文档, 页码, 缩放档位)索引，超出内存预算时按LRU淘汰"""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes  # 内存预算（字节）
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()  # 预取线程与界面线程共享缓存
+
+    @staticmethod
+    def zoom_bucket(scale_factor):
+        """将缩放比例量化为缓存档位"""
+        return int(round(scale_factor * 100))
+
+    @staticmethod
+    def image_bytes(img):
+        """估算PIL图像占用的内存"""
+        return img.width * img.height * len(img.getbands())
+
+    def set_max_bytes(self, max_bytes):
+        """调整内存预算，立即淘汰超出部分"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= self.image_bytes(evicted)
+
+    def make_key(self, doc_key, page_index, scale_factor):
+        """生成缓存键"""
+        return (doc_key, page_index, self.zoom_bucket(scale_factor))
+
+    def get(self, key):
+        """读取缓存，命中时将条目移到最近使用的位置"""
+        with self._lock:
+            img = self._entries.get(key)
+            if img is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return img
+
+    def contains(self, key):
+        """检查缓存中是否存在条目，不影响统计与LRU顺序"""
+        with self._lock:
+            return key in self._entries
+
+    def put(self, key, img):
+        """写入缓存，必要时淘汰最久未使用的条目"""
+        size = self.image_bytes(img)
+        if size > self.max_bytes:
+            # 单张图像已超出预算，不缓存
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= self.image_bytes(old)
+            self._entries[key] = img
+            self.current_bytes += size
+            self._evict()
+
+    def find_nearest(self, doc_key, page_index, scale_factor):
+        """查找同一页面最接近指定缩放比例的缓存图像，不计入命中统计"""
+        bucket = self.zoom_bucket(scale_factor)
+        best_key = None
+        best_distance = None
+        with self._lock:
+            for key in self._entries:
+                if key[0] != doc_key or key[1] != page_index:
+                    continue
+                # 优先选择分辨率较高的结果，缩小比放大更清晰
+                distance = abs(key[2] - bucket) * (1 if key[2] >= bucket else 2)
+                if best_key is None or distance < best_distance:
+                    best_key, best_distance = key, distance
+            return self._entries[best_key] if best_key is not None else None
+
+    def invalidate(self, doc_key):
+        """移除某个文档的全部缓存"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == doc_key]:
+                self.current_bytes -= self.image_bytes(self._entries.pop(key))
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class PageTileCache:
+    """页面图块缓存，按(文档, 页码, 缩放档位, 列, 行)索引；超出数量上限时，
+    先淘汰其他页面或缩放档位的图块，再淘汰离视口中心最远的图块"""
+
+    def __init__(self, tile_size=512, max_tiles=64):
+        self.tile_size = tile_size  # 图块边长（显示像素）
+        self.max_tiles = max_tiles
+        self._tiles = {}
+
+    def make_key(self, doc_key, page_index, scale_factor, column, row):
+        """生成缓存键"""
+        return (doc_key, page_index, PageRenderCache.zoom_bucket(scale_factor), column, row)
+
+    def get(self, key):
+        return self._tiles.get(key)
+
+    def put(self, key, img):
+        self._tiles[key] = img
+
+    def evict(self, doc_key, page_index, scale_factor, center):
+        """按与视口中心图块center的距离淘汰超出上限的图块"""
+        if len(self._tiles) <= self.max_tiles:
+            return
+        current = (doc_key, page_index, PageRenderCache.zoom_bucket(scale_factor))
+        
+        def priority(key):
+            distance = max(abs(key[3] - center[0]), abs(key[4] - center[1]))
+            return (key[:3] != current, distance)
+        
+        ordered = sorted(self._tiles, key=priority)
+        for key in ordered[self.max_tiles:]:
+            del self._tiles[key]
+
+    def invalidate(self, doc_key):
+        """移除某个文档的全部图块"""
+        for key in [k for k in self._tiles if k[0] == doc_key]:
+            del self._tiles[key]
+
+    def clear(self):
+        self._tiles.clear()
+
+    def __len__(self):
+        return len(self._tiles)
+
+
+class DiskRenderCache:
+    """跨会话的页面渲染磁盘缓存，按(文件内容哈希, 页码, 缩放档位, 渲染模式)索引
+
+    每个渲染结果保存为一个PNG文件，按需读取；以文件修改时间作为LRU顺序，
+    超出容量时删除最久未使用的文件。写入使用临时文件加原子替换，多个程序实例可以共用同一目录。
+    """
+
+    def __init__(self, cache_dir=RENDER_CACHE_DIR, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes  # 磁盘容量上限（字节）
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes = None  # 首次写入时扫描目录得到
+        self._lock = threading.Lock()
+        # 编码和写盘在后台线程中完成，不阻塞界面
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render-cache")
+
+    def path_for(self, digest, page_index, scale_factor, render_mode):
+        """返回缓存文件路径"""
+        bucket = PageRenderCache.zoom_bucket(scale_factor)
+        return os.path.join(self.cache_dir, digest, f"{page_index}_{bucket}_{render_mode}.png")
+
+    def get(self, digest, page_index, scale_factor, render_mode):
+        """读取缓存的渲染结果，未命中或文件损坏时返回None"""
+        path = self.path_for(digest, page_index, scale_factor, render_mode)
+        try:
+            with Image.open(path) as img:
+                img.load()
+                result = img if img.mode == "RGB" else img.convert("RGB")
+            # 更新修改时间，作为最近使用的标记
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except OSError:
+            # 文件损坏，删除后按未命中处理
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self._lock:
+                self.misses += 1
+            return None
+        
+        with self._lock:
+            self.hits += 1
+        return result
+
+    def put(self, digest, page_index, scale_factor, render_mode, img):
+        """在后台线程中把渲染结果写入磁盘"""
+        path = self.path_for(digest, page_index, scale_factor, render_mode)
+        self._executor.submit(self._write, path, img)
+
+    def _write(self, path, img):
+        if os.path.exists(path):
+            return
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            # 低压缩级别：文件比原始像素小得多，编码又足够快
+            img.save(tmp_path, format="PNG", compress_level=1)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        
+        if self._total_bytes is None:
+            self._total_bytes = self._scan()[1]
+        else:
+            self._total_bytes += size
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def _scan(self):
+        """扫描缓存目录，返回([(修改时间, 大小, 路径)], 总大小)"""
+        entries = []
+        total = 0
+        if not os.path.isdir(self.cache_dir):
+            return entries, total
+        for doc_dir in os.scandir(self.cache_dir):
+            if not doc_dir.is_dir():
+                continue
+            for entry in os.scandir(doc_dir.path):
+                if not entry.name.endswith(".png"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # 其他实例刚刚删除了该文件
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        return entries, total
+
+    def _evict(self):
+        """删除最久未使用的文件，直到降到容量上限的90%"""
+        # 重新扫描目录，其他实例写入或删除的文件也计算在内
+        entries, total = self._scan()
+        entries.sort()
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            total -= size
+        self._total_bytes = total
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def shutdown(self):
+        """等待尚未完成的写入"""
+        self._executor.shutdown(wait=True)
+
+
+class PageLayoutIndex:
+    """页面内容块（文字段落、图片、矢量图形）的均匀网格空间索引，坐标与页面显示方向一致"""
+
+    def __init__(self, rects, cell_size=36):
+        self.cell_size = cell_size
+        self.rects = [tuple(rect) for rect in rects]
+        self._grid = defaultdict(list)
+        for index, (x0, y0, x1, y1) in enumerate(self.rects):
+            for cx in range(int(x0 // cell_size), int(x1 // cell_size) + 1):
+                for cy in range(int(y0 // cell_size), int(y1 // cell_size) + 1):
+                    self._grid[(cx, cy)].append(index)
+
+    @staticmethod
+    def page_rects(page):
+        """提取页面上文字块、图片和矢量图形的边界框（显示坐标）"""
+        rects = [fitz.Rect(block[:4]) for block in page.get_text("blocks")]
+        rects.extend(fitz.Rect(info["bbox"]) for info in page.get_image_info())
+        if hasattr(page, "cluster_drawings"):
+            try:
+                # 将相邻的矢量图形（表格线、示意图）合并为整体
+                rects.extend(page.cluster_drawings())
+            except Exception:
+                pass
+        
+        # 文字和图形坐标基于未旋转的页面，需要转换为显示坐标
+        if page.rotation:
+            rects = [rect * page.rotation_matrix for rect in rects]
+        
+        # 忽略空白块和覆盖几乎整页的背景（例如扫描页的整页图片）
+        page_area = abs(page.rect)
+        return [
+            tuple(rect) for rect in rects
+            if not rect.is_empty and rect.width >= 2 and rect.height >= 2 and abs(rect) < page_area * 0.9
+        ]
+
+    def _candidates(self, x0, y0, x1, y1):
+        cs = self.cell_size
+        found = set()
+        for cx in range(int(x0 // cs), int(x1 // cs) + 1):
+            for cy in range(int(y0 // cs), int(y1 // cs) + 1):
+                found.update(self._grid.get((cx, cy), ()))
+        return found
+
+    def block_at(self, x, y):
+        """返回包含该点的最小内容块，没有时返回None"""
+        best = None
+        best_area = None
+        for index in self._grid.get((int(x // self.cell_size), int(y // self.cell_size)), ()):
+            x0, y0, x1, y1 = self.rects[index]
+            if x0 <= x <= x1 and y0 <= y <= y1:
+                area = (x1 - x0) * (y1 - y0)
+                if best is None or area < best_area:
+                    best, best_area = index, area
+        return fitz.Rect(self.rects[best]) if best is not None else None
+
+    def blocks_in(self, rect):
+        """返回与矩形相交的所有内容块"""
+        rx0, ry0, rx1, ry1 = rect
+        return [
+            fitz.Rect(self.rects[index])
+            for index in sorted(self._candidates(rx0, ry0, rx1, ry1))
+            if self.rects[index][0] < rx1 and self.rects[index][2] > rx0
+            and self.rects[index][1] < ry1 and self.rects[index][3] > ry0
+        ]
+
+    def snap(self, rect, min_overlap=0.3):
+        """将选择区域吸附到内容块边界：合并被选中面积超过min_overlap的内容块，没有时返回None"""
+        rect = fitz.Rect(rect)
+        snapped = None
+        for block in self.blocks_in(rect):
+            overlap = abs(block & rect)
+            if overlap >= abs(block) * min_overlap:
+                snapped = block if snapped is None else snapped | block
+        return snapped
+
+
+class TextSearchIndex:
+    """PDF全文倒排索引
+    
+    在后台线程中逐页提取文字行建立索引，建立过程中已处理的页面即可搜索；
+    结果按文件内容哈希保存到磁盘，再次打开同一文件时直接加载。
+    """
+
+    VERSION = 1
+    _WORD_RE = re.compile(r"[0-9a-z]+")
+    _CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uf900-\ufaff]+")
+
+    def __init__(self, pdf_path, cache_dir=TEXT_INDEX_DIR):
+        self.pdf_path = pdf_path
+        self.cache_dir = cache_dir
+        self.lines = []  # 每行为(页码, x0, y0, x1, y1, 文字)
+        self.postings = defaultdict(list)  # 词 -> 行号列表
+        self.page_count = 0
+        self.pages_done = 0
+        self.ready = False
+        self.from_cache = False
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    @staticmethod
+    def normalize(text):
+        """统一大小写并去除空白，用于匹配"""
+        return "".join(text.lower().split())
+
+    @classmethod
+    def tokenize(cls, text):
+        """拉丁文按相邻三个字母、中日文按相邻两字切分，查询不完整的单词时也能命中
+        
+        过短的查询切分不出词，此时搜索退化为逐行比较。
+        """
+        text = text.lower()
+        tokens = set()
+        for word in cls._WORD_RE.findall(text):
+            tokens.update(word[i:i + 3] for i in range(len(word) - 2))
+        for run in cls._CJK_RE.findall(text):
+            tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+        return tokens
+
+    def cancel(self):
+        """停止建立索引"""
+        self._cancelled.set()
+
+    def build(self, progress=None):
+        """后台线程：加载或建立索引，progress(已完成页数, 总页数)用于报告进度"""
+        digest = file_digest(self.pdf_path)
+        cache_path = os.path.join(self.cache_dir, f"{digest}.json.gz")
+        if self._load(cache_path):
+            self.from_cache = True
+        else:
+            with fitz.open(self.pdf_path) as doc:
+                self.page_count = len(doc)
+            for page_index, page in iter_pages(self.pdf_path):
+                if self._cancelled.is_set():
+                    return
+                self._add_page(page_index, page)
+                if progress is not None and (page_index % 20 == 0 or page_index == self.page_count - 1):
+                    progress(self.pages_done, self.page_count)
+            self._save(cache_path)
+        self.ready = True
+        if progress is not None:
+            progress(self.pages_done, self.page_count)
+
+    def _add_page(self, page_index, page):
+        """提取一页的文字行加入索引"""
+        grouped = OrderedDict()
+        for x0, y0, x1, y1, word, block_no, line_no, _ in page.get_text("words"):
+            grouped.setdefault((block_no, line_no), []).append((fitz.Rect(x0, y0, x1, y1), word))
+        
+        lines = []
+        for words in grouped.values():
+            bbox = fitz.Rect(words[0][0])
+            for rect, _ in words[1:]:
+                bbox |= rect
+            # 文字坐标基于未旋转的页面，转换为显示坐标
+            if page.rotation:
+                bbox = bbox * page.rotation_matrix
+            lines.append((page_index, bbox.x0, bbox.y0, bbox.x1, bbox.y1, " ".join(word for _, word in words)))
+        
+        with self._lock:
+            self._add_lines(lines)
+            self.pages_done = page_index + 1
+
+    def _add_lines(self, lines):
+        for line in lines:
+            line_id = len(self.lines)
+            self.lines.append(line)
+            for token in self.tokenize(line[5]):
+                self.postings[token].append(line_id)
+
+    def _load(self, cache_path):
+        try:
+            with gzip.open(cache_path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("version") != self.VERSION:
+            return False
+        with self._lock:
+            self.page_count = data["page_count"]
+            self._add_lines([tuple(line) for line in data["lines"]])
+            self.pages_done = self.page_count
+        return True
+
+    def _save(self, cache_path):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump({"version": self.VERSION, "page_count": self.page_count, "lines": self.lines},
+                          f, ensure_ascii=False)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # 保存失败只影响下次打开的速度
+            pass
+
+    def search(self, query, limit=500):
+        """搜索文字，返回[(页码, fitz.Rect)]，按页面顺序排列"""
+        needle = self.normalize(query)
+        if not needle:
+            return []
+        tokens = self.tokenize(query)
+        with self._lock:
+            if tokens:
+                posting_lists = sorted((self.postings.get(token, []) for token in tokens), key=len)
+                candidates = set(posting_lists[0])
+                for posting in posting_lists[1:]:
+                    candidates.intersection_update(posting)
+                candidates = sorted(candidates)
+            else:
+                candidates = range(len(self.lines))
+            
+            results = []
+            for line_id in candidates:
+                page_index, x0, y0, x1, y1, text = self.lines[line_id]
+                if needle in self.normalize(text):
+                    results.append((page_index, fitz.Rect(x0, y0, x1, y1)))
+                    if len(results) >= limit:
+                        break
+            return results
+
+
+class DocumentSegmenter:
+    """整本文档自动分题：分析每页的文字版面，为编号题目生成(问题, 答案区域)草稿
+    
+    页面按块分给多个工作进程并行分析。每页按从上到下的阅读顺序处理：编号题目开始一张草稿，
+    其后的正文、图片和图注直到下一个编号题目、标题或页面底部为答案区域；没有后续内容时答案区域为题目本身。
+    """
+
+    QUESTION_RE = re.compile(
+        r"^\s*(?:"
+        r"第\s*[0-9一二三四五六七八九十百]+\s*[题问]"
+        r"|(?:例题|习题|练习|问题|例|题)\s*[0-9]+(?:[.．-][0-9]+)*"
+        r"|[0-9]{1,3}(?:[.．][0-9]{1,3})*\s*[.．、)）](?![0-9])"
+        r"|[（(][0-9]{1,3}[)）]"
+        r"|(?:Q|Question|Exercise|Problem)\s*[0-9]+(?:\.[0-9]+)*\b"
+        r")",
+        re.IGNORECASE
+    )
+    CAPTION_RE = re.compile(r"^\s*(?:图|表|Fig(?:ure)?\.?|Table)\s*[0-9]+", re.IGNORECASE)
+    _CJK_RE = re.compile(r"[\u3000-\u30ff\u3400-\u9fff\uf900-\ufaff\uff00-\uffef]")
+    HEADING_SCALE = 1.25  # 字号超过正文该倍数的短文字块视为标题
+    MAX_QUESTION_CHARS = 200
+    PADDING = 3
+
+    def __init__(self, pdf_path, workers=None, chunk_size=16):
+        self.pdf_path = pdf_path
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.drafts = []  # 每项为{"page_index", "question", "clip"}
+        self.page_count = 0
+        self.pages_done = 0
+        self.ready = False
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """停止分析，已提交给工作进程但尚未开始的页面不再处理"""
+        self._cancelled.set()
+
+    def run(self, progress=None):
+        """后台线程：在进程池中分析所有页面，progress(已完成页数, 总页数)用于报告进度"""
+        with tracer.span("segment_document"):
+            with fitz.open(self.pdf_path) as doc:
+                self.page_count = len(doc)
+            chunks = [
+                list(range(start, min(start + self.chunk_size, self.page_count)))
+                for start in range(0, self.page_count, self.chunk_size)
+            ]
+            # 界面进程中有多个线程，使用spawn启动工作进程，避免fork时复制其他线程持有的锁
+            context = multiprocessing.get_context("spawn")
+            workers = max(1, min(self.workers or os.cpu_count() or 1, len(chunks)))
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                futures = {
+                    submit_traced(executor, _segment_pages, self.pdf_path, chunk): chunk for chunk in chunks
+                }
+                try:
+                    for future in as_completed(futures):
+                        if self._cancelled.is_set():
+                            return
+                        self.drafts.extend(future.result())
+                        self.pages_done += len(futures[future])
+                        if progress is not None:
+                            progress(self.pages_done, self.page_count)
+                finally:
+                    for future in futures:
+                        future.cancel()
+            self.drafts.sort(key=lambda draft: (draft["page_index"], draft["clip"][1], draft["clip"][0]))
+            self.ready = True
+
+    @classmethod
+    def _join_lines(cls, lines):
+        """拼接文字行，中日文行之间不插入空格"""
+        text = ""
+        for line in lines:
+            line = " ".join(line.split())
+            if text and line and not (cls._CJK_RE.match(text[-1]) and cls._CJK_RE.match(line[0])):
+                text += " "
+            text += line
+        return text
+
+    @classmethod
+    def segment_page(cls, page, page_index):
+        """分析一页的版面，返回该页的草稿列表"""
+        text_blocks = []
+        sizes = defaultdict(int)
+        for block in page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]:
+            lines = []
+            max_size = 0
+            for line in block.get("lines", ()):
+                lines.append("".join(span["text"] for span in line["spans"]))
+                for span in line["spans"]:
+                    # 按字符数统计各字号，出现最多的字号为正文字号
+                    sizes[round(span["size"] * 2) / 2] += len(span["text"].strip())
+                    max_size = max(max_size, span["size"])
+            text = cls._join_lines(lines)
+            if text:
+                text_blocks.append((fitz.Rect(block["bbox"]), text, max_size, len(lines)))
+        body_size = max(sizes, key=sizes.get) if sizes else 0
+        
+        items = []
+        for rect, text, size, line_count in text_blocks:
+            if cls.QUESTION_RE.match(text):
+                kind = "question"
+            elif cls.CAPTION_RE.match(text):
+                kind = "caption"
+            elif body_size and size >= body_size * cls.HEADING_SCALE and line_count <= 2:
+                kind = "heading"
+            else:
+                kind = "body"
+            items.append((kind, rect, text))
+        
+        # 图片和矢量图形（示意图、表格线）归入所在位置的答案区域，忽略整页背景
+        page_area = abs(page.rect)
+        figures = [fitz.Rect(info["bbox"]) for info in page.get_image_info()]
+        if hasattr(page, "cluster_drawings"):
+            try:
+                figures.extend(page.cluster_drawings())
+            except Exception:
+                pass
+        items.extend(
+            ("figure", rect, "") for rect in figures
+            if not rect.is_empty and rect.width >= 2 and rect.height >= 2 and abs(rect) < page_area * 0.9
+        )
+        
+        # 在未旋转的页面坐标中按文字方向排列阅读顺序
+        items.sort(key=lambda item: (item[1].y0, item[1].x0))
+        
+        segments = []
+        current = None
+        for kind, rect, text in items:
+            if kind == "question":
+                current = {"question": text, "question_rect": rect, "answer_rect": None}
+                segments.append(current)
+            elif kind == "heading":
+                current = None
+            elif current is not None:
+                current["answer_rect"] = rect if current["answer_rect"] is None else current["answer_rect"] | rect
+        
+        drafts = []
+        for segment in segments:
+            clip = fitz.Rect(segment["answer_rect"] or segment["question_rect"])
+            clip = fitz.Rect(clip.x0 - cls.PADDING, clip.y0 - cls.PADDING, clip.x1 + cls.PADDING, clip.y1 + cls.PADDING)
+            # 文字和图形坐标基于未旋转的页面，需要转换为显示坐标
+            if page.rotation:
+                clip = clip * page.rotation_matrix
+            clip &= page.rect
+            if clip.is_empty:
+                continue
+            question = segment["question"]
+            if len(question) > cls.MAX_QUESTION_CHARS:
+                question = question[:cls.MAX_QUESTION_CHARS] + "…"
+            drafts.append({"page_index": page_index, "question": question, "clip": tuple(clip)})
+        return drafts
+
+
+class ThumbnailGenerator:
+    """生成页面缩略图并缓存到磁盘（按文件内容哈希和页码），优先生成可见范围内的页面
+    
+    后台线程只负责调度，渲染和保存在render_pool（进程池）中逐页进行，不占用界面进程的GIL。
+    磁盘缓存以文档目录的修改时间作为LRU顺序，超出容量时删除最久未打开的文档的缩略图。
+    """
+
+    def __init__(self, pdf_path, page_count, render_pool, cache_dir=THUMBNAIL_DIR, size=(120, 160), on_ready=None,
+                 max_bytes=64 * 1024 * 1024):
+        self.pdf_path = pdf_path
+        self.page_count = page_count
+        self.render_pool = render_pool
+        self.cache_dir = cache_dir
+        self.size = size  # 缩略图最大宽高
+        self.on_ready = on_ready  # on_ready(页码)在后台线程中调用，页码为None表示磁盘缓存已就绪
+        self.max_bytes = max_bytes  # 缩略图目录的磁盘容量上限（字节）
+        self.directory = None
+        self._done = set()
+        self._failed = set()  # 生成失败的页面，不再重试
+        self._visible = (0, 0)
+        self._condition = threading.Condition()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="thumbnails", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def set_visible(self, first, last):
+        """设置当前可见的页码范围，之后优先生成这些页面"""
+        with self._condition:
+            self._visible = (first, last)
+            self._condition.notify_all()
+
+    def path_for(self, page_index):
+        """返回已生成的缩略图路径，尚未生成时返回None"""
+        with self._condition:
+            if page_index not in self._done:
+                return None
+        return os.path.join(self.directory, f"{page_index}.jpg")
+
+    def _next_page(self):
+        """从可见范围中心向外查找尚未生成的页面"""
+        first, last = self._visible
+        center = (first + last) // 2
+        for distance in range(self.page_count + 1):
+            for candidate in (center + distance, center - distance - 1):
+                if 0 <= candidate < self.page_count and candidate not in self._done and candidate not in self._failed:
+                    return candidate
+        return None
+
+    def _evict(self):
+        """缩略图总大小超出上限时删除最久未打开的其他文档的缩略图，直到降到上限的90%"""
+        # 扫描整个目录，其他实例生成或删除的缩略图也计算在内
+        entries = []
+        total = 0
+        for doc_dir in os.scandir(self.cache_dir):
+            if not doc_dir.is_dir():
+                continue
+            size = 0
+            try:
+                for entry in os.scandir(doc_dir.path):
+                    size += entry.stat().st_size
+                mtime = doc_dir.stat().st_mtime
+            except FileNotFoundError:
+                # 其他实例刚刚删除了该目录
+                continue
+            entries.append((mtime, size, doc_dir.path))
+            total += size
+        if total <= self.max_bytes:
+            return
+        
+        entries.sort()
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if total <= target:
+                break
+            if path == self.directory:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def _run(self):
+        self.directory = os.path.join(self.cache_dir, file_digest(self.pdf_path))
+        os.makedirs(self.directory, exist_ok=True)
+        # 更新目录的修改时间，作为最近使用的标记
+        os.utime(self.directory)
+        self._evict()
+        
+        # 之前会话中生成的缩略图直接可用
+        existing = set()
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            if ext == ".jpg" and stem.isdigit():
+                existing.add(int(stem))
+        with self._condition:
+            self._done.update(existing)
+        if self.on_ready is not None:
+            self.on_ready(None)
+        
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+                page_index = self._next_page()
+            if page_index is None:
+                # 本文档的缩略图已全部生成，按新的总大小再检查一次容量
+                self._evict()
+                return
+            
+            # 每次只提交一页，可见范围改变后下一页立即按新的优先级选择
+            path = os.path.join(self.directory, f"{page_index}.jpg")
+            try:
+                submit_traced(
+                    self.render_pool, save_thumbnail_in_worker, self.pdf_path, page_index, self.size, path
+                ).result()
+            except Exception:
+                # 单页失败（例如页面内容损坏）时跳过该页，继续生成其他页面，该页保持占位框
+                with self._condition:
+                    self._failed.add(page_index)
+                continue
+            
+            with self._condition:
+                self._done.add(page_index)
+            if self.on_ready is not None:
+                self.on_ready(page_index)
+
+
+class DocumentPool:
+    """打开的PDF文档池：最多同时保持max_open个MuPDF文档句柄，超出时关闭最久未使用的文档
+    
+    被关闭的文档再次使用时自动重新打开；on_evict(路径)在文档被关闭时调用，用于释放该文档的缓存。
+    """
+
+    def __init__(self, max_open=4, on_evict=None):
+        self.max_open = max_open
+        self.on_evict = on_evict
+        self._documents = OrderedDict()  # 路径 -> fitz文档
+
+    def get(self, path):
+        """返回已打开的文档，必要时打开，并标记为最近使用"""
+        doc = self._documents.get(path)
+        if doc is None:
+            doc = fitz.open(path)
+            self._documents[path] = doc
+        self._documents.move_to_end(path)
+        while len(self._documents) > self.max_open:
+            oldest = next(iter(self._documents))
+            self.close(oldest)
+        return doc
+
+    def close(self, path):
+        """关闭文档并释放MuPDF资源缓存"""
+        doc = self._documents.pop(path, None)
+        if doc is None:
+            return
+        doc.close()
+        release_mupdf_store(0)
+        if self.on_evict is not None:
+            self.on_evict(path)
+
+    def __contains__(self, path):
+        return path in self._documents
+
+    def __len__(self):
+        return len(self._documents)
+
+
+class PagePrefetcher:
+    """按当前缩放比例预渲染相邻页面，结果写入渲染缓存
+    
+    调度在后台线程中进行，渲染交给render_pool（进程池）：PyMuPDF渲染期间持有GIL，
+    在界面进程的线程中渲染仍会卡住界面。
+    """
+
+    def __init__(self, cache, render_pool, window=1, disk_cache=None):
+        self.cache = cache
+        self.render_pool = render_pool
+        self.disk_cache = disk_cache  # 可选的磁盘缓存，命中时不再渲染
+        self.window = window  # 预取当前页前后各多少页
+        self._generation = 0  # 缩放比例或文档改变时递增，旧的渲染结果据此丢弃
+        self._request = 0  # 每次重新调度时递增，尚未开始的旧任务据此跳过
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page-prefetch")
+
+    def schedule(self, doc_path, page_index, page_count, scale_factor, render_mode="matrix"):
+        """替换等待中的预取任务，按距离由近到远预取当前页附近的页面"""
+        pages = []
+        for distance in range(1, self.window + 1):
+            for candidate in (page_index + distance, page_index - distance):
+                if 0 <= candidate < page_count:
+                    pages.append(candidate)
+        
+        with self._lock:
+            self._request += 1
+            generation, request = self._generation, self._request
+        
+        for candidate in pages:
+            # 每页单独提交，保证取消后最多只浪费一页的渲染
+            self._executor.submit(
+                self._prefetch_page, generation, request,
+                doc_path, candidate, scale_factor, render_mode
+            )
+
+    def cancel(self):
+        """取消所有预取任务，并丢弃正在渲染的结果"""
+        with self._lock:
+            self._generation += 1
+
+    def _is_stale(self, generation, request=None):
+        with self._lock:
+            if generation != self._generation:
+                return True
+            return request is not None and request != self._request
+
+    def _prefetch_page(self, generation, request, doc_path, page_index, scale_factor, render_mode):
+        """后台线程：在工作进程中渲染单个页面并等待结果"""
+        if self._is_stale(generation, request):
+            return
+        
+        key = self.cache.make_key(doc_path, page_index, scale_factor)
+        if self.cache.contains(key):
+            return
+        
+        try:
+            img = None
+            if self.disk_cache is not None:
+                digest = file_digest(doc_path)
+                img = self.disk_cache.get(digest, page_index, scale_factor, render_mode)
+            if img is None:
+                img = submit_traced(
+                    self.render_pool, render_page_in_worker, doc_path, page_index, scale_factor, render_mode
+                ).result()
+                if self.disk_cache is not None:
+                    self.disk_cache.put(digest, page_index, scale_factor, render_mode, img)
+        except Exception:
+            # 预取失败不影响正常显示，界面线程会在需要时重新渲染
+            return
+        
+        # 渲染期间缩放或文档已改变时丢弃结果
+        if not self._is_stale(generation):
+            self.cache.put(key, img)
+
+    def shutdown(self):
+        """停止后台线程"""
+        self.cancel()
+        self._executor.shutdown(wait=False)
+
+
+class AnkiConnectError(Exception):
+    """AnkiConnect返回的错误"""
+
+
+class AnkiConnectClient:
+    """AnkiConnect客户端，复用持久连接，并在后台线程中执行请求"""
+
+    def __init__(self, root=None, url="http://localhost:8765", timeout=10,
+                 metadata_path=ANKI_METADATA_PATH):
+        self.root = root  # 用于把结果回调切换到Tk主线程
+        self.url = url
+        self.timeout = timeout
+        
+        # 卡片模型及字段信息缓存，metadata_path为None时不在多次运行之间保存
+        self.preferred_models = ["问答题", "Basic", "基本", "Cloze", "填空"]
+        self.metadata_path = metadata_path
+        self._metadata_lock = threading.Lock()
+        self._model_info = self._load_model_info()
+        
+        # Anki中已有的图片文件名，用于跳过重复上传
+        self._media_lock = threading.Lock()
+        self._known_media = None
+        
+        # 使用保持连接的会话，避免每次请求都重新建立TCP连接；首次请求时才创建，不在启动时导入requests
+        self._session = None
+        self._session_lock = threading.Lock()
+        
+        # 单个工作线程，保证卡片按提交顺序添加
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="anki-connect")
+        self._closed = False  # shutdown()之后完成的请求不再回调
+
+    @property
+    def session(self):
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    def invoke(self, action, **params):
+        """同步调用AnkiConnect接口，返回result字段"""
+        payload = {"action": action, "version": 6}
+        if params:
+            payload["params"] = params
+        
+        with tracer.span("anki.invoke", action=action):
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            result = response.json()
+        
+        if result.get("error") is not None:
+            raise AnkiConnectError(result["error"])
+        return result.get("result")
+
+    def submit(self, func, *args, on_success=None, on_error=None):
+        """在后台线程中执行func，完成后通过root.after在主线程中回调"""
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(lambda f: self._dispatch(f, on_success, on_error))
+        return future
+
+    def _dispatch(self, future, on_success, on_error):
+        error = future.exception()
+        callback, value = (on_error, error) if error is not None else (on_success, future.result())
+        if callback is None or self._closed:
+            return
+        if self.root is not None:
+            self.root.after(0, callback, value)
+        else:
+            callback(value)
+
+    def get_model_info(self, refresh=False):
+        """获取卡片模型及其字段，结果在会话内缓存，refresh=True时重新查询"""
+        with self._metadata_lock:
+            if self._model_info is None or refresh:
+                self._model_info = self._fetch_model_info()
+                self._save_model_info()
+            return self._model_info
+
+    def invalidate_model_info(self):
+        """丢弃缓存的模型信息，下次添加卡片时重新查询"""
+        with self._metadata_lock:
+            self._model_info = None
+
+    def _fetch_model_info(self):
+        """从Anki查询可用模型，并按preferred_models选择模型和字段"""
+        # 首先获取可用的模型名称
+        try:
+            available_models = self.invoke("modelNames") or []
+        except AnkiConnectError as e:
+            raise Exception(f"获取模型列表失败: {e}")
+        
+        # 尝试找到合适的模型
+        model_name = None
+        for preferred in self.preferred_models:
+            if preferred in available_models:
+                model_name = preferred
+                break
+        
+        if not model_name and available_models:
+            model_name = available_models[0]  # 使用第一个可用模型
+        
+        if not model_name:
+            raise Exception("Anki中没有找到可用的卡片模型")
+        
+        # 获取模型的字段信息
+        try:
+            field_names = self.invoke("modelFieldNames", modelName=model_name) or []
+        except AnkiConnectError as e:
+            raise Exception(f"获取字段信息失败: {e}")
+        
+        return {
+            "model_name": model_name,
+            "field_names": field_names,
+            "available_models": available_models,
+        }
+
+    def _load_model_info(self):
+        """读取上次运行保存的模型信息"""
+        if not self.metadata_path or not os.path.exists(self.metadata_path):
+            return None
+        try:
+            with open(self.metadata_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+            if info.get("url") != self.url or not info.get("model_name"):
+                return None
+            return info
+        except (OSError, ValueError):
+            return None
+
+    def _save_model_info(self):
+        """保存模型信息供下次运行使用"""
+        if not self.metadata_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.metadata_path), exist_ok=True)
+            with open(self.metadata_path, "w", encoding="utf-8") as f:
+                json.dump(dict(self._model_info, url=self.url), f, ensure_ascii=False)
+        except OSError:
+            # 保存失败只影响下次启动的速度
+            pass
+
+    @staticmethod
+    def build_note_fields(field_names, question, answer):
+        """根据模型字段确定问题和答案的字段映射"""
+        fields = {}
+        if len(field_names) >= 2:
+            # 如果有至少两个字段，使用前两个字段
+            fields[field_names[0]] = question
+            fields[field_names[1]] = answer
+        elif len(field_names) == 1:
+            # 如果只有一个字段，合并问题和答案
+            fields[field_names[0]] = f"{question}\n\n{answer}"
+        else:
+            raise Exception("模型没有可用的字段")
+        return fields
+
+    def add_image_notes(self, cards, deck_name="默认", tags=("PDF截取",), batch_size=50):
+        """通过multi批量上传图片并添加卡片
+        
+        cards为包含question、img_filename、img_data（可选deck、tags）的字典列表，返回与cards一一对应的结果列表，
+        每项为{"note_id": 卡片ID或None, "error": 错误信息或None}；图片上传失败的卡片不会添加，结果中retry为True，
+        可以稍后重新提交。
+        """
+        results = []
+        for start in range(0, len(cards), batch_size):
+            results.extend(self._add_image_notes_batch(cards[start:start + batch_size], deck_name, tags))
+        return results
+
+    def _add_image_notes_batch(self, cards, deck_name, tags):
+        """先通过一次multi请求上传一批卡片的图片，再用一次multi请求添加图片已就绪的卡片
+        
+        Anki中已有的图片不再上传，全部已有时只需一次请求。
+        """
+        model_info = self.get_model_info()
+        known_media = self.get_known_media()
+        
+        # 按文件名去重；文件名由内容哈希生成，同名即同内容
+        uploads = OrderedDict()
+        for card in cards:
+            if card["img_filename"] not in known_media:
+                uploads.setdefault(card["img_filename"], card["img_data"])
+        
+        with tracer.span("anki.base64", files=len(uploads)):
+            actions = [
+                {
+                    "action": "storeMediaFile",
+                    "params": {
+                        "filename": filename,
+                        "data": base64.b64encode(img_data).decode('utf-8')
+                    }
+                }
+                for filename, img_data in uploads.items()
+            ]
+        
+        media_errors = {}
+        if actions:
+            for filename, media in zip(uploads, self.invoke_multi(actions)):
+                if media.get("error") is not None:
+                    media_errors[filename] = media["error"]
+                else:
+                    self.remember_media(filename)
+        
+        # 图片上传失败的卡片不添加，否则Anki中会出现缺少图片的卡片
+        results = [
+            {"note_id": None, "error": f"添加图片失败: {media_errors[card['img_filename']]}", "retry": True}
+            if card["img_filename"] in media_errors else None
+            for card in cards
+        ]
+        ready = [index for index, result in enumerate(results) if result is None]
+        
+        # 每张卡片单独使用addNote，multi会分别返回每张卡片的结果；
+        # addNotes在部分失败时只返回一个合并的错误，无法区分哪些卡片已添加
+        note_responses = self.invoke_multi(
+            [self._note_action(model_info, cards[index], deck_name, tags) for index in ready]
+        ) if ready else []
+        retry = []
+        for index, note in zip(ready, note_responses):
+            if note.get("error") is not None:
+                if 'model was not found' in note["error"]:
+                    retry.append(index)
+                results[index] = {"note_id": None, "error": str(self._note_error(
+                    AnkiConnectError(note["error"]), model_info, cards[index]["question"], ""))}
+            else:
+                results[index] = {"note_id": note.get("result"), "error": None}
+        
+        # 模型已在Anki中被删除或改名时，刷新模型信息后重试这些卡片
+        if retry:
+            model_info = self.get_model_info(refresh=True)
+            responses = self.invoke_multi(
+                [self._note_action(model_info, cards[index], deck_name, tags) for index in retry]
+            )
+            for index, note in zip(retry, responses):
+                if note.get("error") is None:
+                    results[index] = {"note_id": note.get("result"), "error": None}
+        return results
+
+    def get_known_media(self):
+        """返回Anki中已有的本工具图片文件名，每个会话首次调用时从Anki读取"""
+        with self._media_lock:
+            if self._known_media is None:
+                names = self.invoke("getMediaFilesNames", pattern=f"{MEDIA_NAME_PREFIX}*") or []
+                self._known_media = set(names)
+            return set(self._known_media)
+
+    def remember_media(self, filename):
+        """记录已上传到Anki的图片"""
+        with self._media_lock:
+            if self._known_media is not None:
+                self._known_media.add(filename)
+
+    def invalidate_media_index(self):
+        """丢弃已知图片列表，下次上传前重新从Anki读取"""
+        with self._media_lock:
+            self._known_media = None
+
+    def invoke_multi(self, actions):
+        """通过multi在一次请求中执行多个操作，返回每个操作的{result, error}"""
+        for action in actions:
+            action.setdefault("version", 6)
+        responses = self.invoke("multi", actions=actions) or []
+        # 兼容旧版AnkiConnect直接返回结果而非{result, error}的情况
+        return [r if isinstance(r, dict) and "error" in r else {"result": r, "error": None} for r in responses]
+
+    def _note_action(self, model_info, card, deck_name, tags):
+        """生成addNote操作"""
+        answer = f'<img src="{card["img_filename"]}">'  # 使用HTML格式插入图片
+        return {
+            "action": "addNote",
+            "params": {
+                "note": {
+                    "deckName": card.get("deck", deck_name),
+                    "modelName": model_info["model_name"],
+                    "fields": self.build_note_fields(model_info["field_names"], card["question"], answer),
+                    "tags": list(card.get("tags", tags))
+                }
+            }
+        }
+
+    def _note_error(self, error, model_info, question, answer):
+        """将addNote返回的错误转换为带模型信息的提示"""
+        error_msg = str(error)
+        model_name = model_info["model_name"]
+        field_names = model_info["field_names"]
+        if 'model was not found' in error_msg:
+            return Exception(
+                f"添加卡片失败: {error_msg}\n\n"
+                f"使用的模型: {model_name}\n"
+                f"可用模型: {', '.join(model_info['available_models'])}\n\n"
+                "请确保Anki中存在正确的卡片模型。"
+            )
+        elif 'cannot create note because it is empty' in error_msg:
+            fields = self.build_note_fields(field_names, question, answer)
+            return Exception(
+                f"添加卡片失败: {error_msg}\n\n"
+                f"使用的模型: {model_name}\n"
+                f"字段映射: {fields}\n"
+                f"可用字段: {', '.join(field_names)}\n\n"
+                "请检查模型字段配置是否正确。"
+            )
+        else:
+            return Exception(f"添加卡片失败: {error_msg}\n\n使用的模型: {model_name}")
+
+    def shutdown(self):
+        """关闭后台线程和连接，之后不再回调"""
+        self._closed = True
+        self._executor.shutdown(wait=False)
+        if self._session is not None:
+            self._session.close()
+
+
+class OutboxRetryLater(Exception):
+    """Anki暂时无法处理请求（例如正在同步），稍后重试"""
+
+
+def try_lock_file(path):
+    """以非阻塞方式获得文件的独占锁，返回打开的锁文件；锁已被其他进程持有时返回None
+    
+    锁在关闭返回的文件或进程退出时释放。
+    """
+    lock_file = open(path, "a+")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+class CardOutbox:
+    """持久化的待发送卡片队列
+    
+    卡片以追加写入的JSONL日志和图片文件保存在本地，后台线程将其批量发送到Anki，
+    连接失败时按指数退避重试。每张卡片带有唯一ID标签，重发前先查询该标签，避免重复添加；
+    确认添加后再从Anki中删除该标签，不在用户的牌组中留下内部标签。
+    
+    队列目录由一个进程独占（锁文件）。目录已被其他进程（另一个界面实例或批量模式）使用时，
+    改用spare子目录下独立的备用队列；备用队列所属的进程退出后，由持有主队列的进程并入主队列。
+    """
+
+    ID_TAG_PREFIX = "pdfanki::"
+    # Anki正在同步或数据库被占用时返回的错误，属于暂时性错误
+    TRANSIENT_ERRORS = ("collection is not available", "database is locked")
+    LOCK_NAME = "outbox.lock"
+    ADOPT_INTERVAL = 60  # 主队列检查备用队列的间隔（秒）
+
+    def __init__(self, client, directory=OUTBOX_DIR, root=None, on_update=None,
+                 batch_size=50, base_delay=2.0, max_delay=300.0):
+        self.client = client
+        os.makedirs(directory, exist_ok=True)
+        self.spare_root = os.path.join(directory, "spare")
+        self._lock_file = try_lock_file(os.path.join(directory, self.LOCK_NAME))
+        self.primary = self._lock_file is not None
+        while self._lock_file is None:
+            # 新建的备用目录可能在加锁前被主队列当作无人使用而删除，此时换一个目录重试
+            directory = os.path.join(self.spare_root, uuid.uuid4().hex)
+            os.makedirs(directory)
+            try:
+                self._lock_file = try_lock_file(os.path.join(directory, self.LOCK_NAME))
+            except FileNotFoundError:
+                pass
+        self.directory = directory
+        self.media_dir = os.path.join(directory, "media")
+        self.journal_path = os.path.join(directory, "outbox.jsonl")
+        self.root = root
+        self.on_update = on_update  # 状态变化回调，通过root.after在主线程中执行
+        self.batch_size = batch_size
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pending = OrderedDict()  # 卡片ID -> 日志记录
+        self._unconfirmed = set()  # 已发送但未确认结果的卡片，重发前需要查重
+        self._untag = []  # 已确认添加、尚未从Anki中删除ID标签的(笔记ID, 标签)
+        self._thread = None
+        
+        os.makedirs(self.media_dir, exist_ok=True)
+        self._load()
+
+    @classmethod
+    def id_tag(cls, card_id):
+        """卡片唯一ID对应的Anki标签"""
+        return f"{cls.ID_TAG_PREFIX}{card_id}"
+
+    @staticmethod
+    def _media_name(record):
+        return f"{record['id']}_{record['img_filename']}"
+
+    @staticmethod
+    def _read_journal(journal_path):
+        """读取日志，返回尚未完成的卡片记录"""
+        records = OrderedDict()
+        if os.path.exists(journal_path):
+            with open(journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 程序异常退出时最后一行可能不完整
+                        continue
+                    if record.get("op") == "add":
+                        records[record["id"]] = record
+                    else:
+                        records.pop(record.get("id"), None)
+        return records
+
+    def _load(self):
+        """读取日志，恢复上次运行未发送的卡片，主队列同时并入已无人使用的备用队列"""
+        records = self._read_journal(self.journal_path)
+        self._pending = records
+        # 上次运行中这些卡片可能已发送但没有收到结果
+        self._unconfirmed = set(records)
+        self._compact()
+        if self.primary:
+            self._adopt_spares()
+
+    def _adopt_spares(self):
+        """把所属进程已退出的备用队列中的卡片并入主队列，返回并入的卡片数"""
+        if not os.path.isdir(self.spare_root):
+            return 0
+        adopted = 0
+        for name in os.listdir(self.spare_root):
+            path = os.path.join(self.spare_root, name)
+            try:
+                lock_file = try_lock_file(os.path.join(path, self.LOCK_NAME))
+            except OSError:
+                continue
+            if lock_file is None:
+                # 所属进程仍在运行，由它自己发送
+                continue
+            try:
+                for record in self._read_journal(os.path.join(path, "outbox.jsonl")).values():
+                    with self._lock:
+                        if record["id"] in self._pending:
+                            continue
+                        # 先移动图片再写日志；图片缺失的卡片发送时记为失败
+                        try:
+                            os.replace(
+                                os.path.join(path, "media", self._media_name(record)),
+                                os.path.join(self.media_dir, self._media_name(record))
+                            )
+                        except OSError:
+                            pass
+                        self._append(record)
+                        self._pending[record["id"]] = record
+                        # 备用队列可能已发送过这张卡片
+                        self._unconfirmed.add(record["id"])
+                    adopted += 1
+            finally:
+                lock_file.close()
+            shutil.rmtree(path, ignore_errors=True)
+        return adopted
+
+    def _compact(self):
+        """重写日志只保留待发送的卡片，并删除不再需要的图片"""
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in self._pending.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+        
+        keep = {self._media_name(record) for record in self._pending.values()}
+        for name in os.listdir(self.media_dir):
+            if name not in keep:
+                try:
+                    os.remove(os.path.join(self.media_dir, name))
+                except OSError:
+                    pass
+
+    def _append(self, record):
+        """向日志追加一条记录并立即落盘"""
+        with open(self.journal_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def put(self, question, img_filename, img_data, deck_name="默认", tags=("PDF截取",), card_id=None):
+        """保存一张待发送的卡片，返回卡片ID；同一ID重复提交时不会重复保存"""
+        with tracer.span("outbox.put"):
+            card_id = card_id or uuid.uuid4().hex
+            record = {
+                "op": "add",
+                "id": card_id,
+                "question": question,
+                "img_filename": img_filename,
+                "deck": deck_name,
+                "tags": list(tags),
+                "created": time.time(),
+            }
+            
+            with self._lock:
+                if card_id in self._pending:
+                    return card_id
+                
+                # 先写图片再写日志，日志中出现的卡片一定有对应的图片
+                media_path = os.path.join(self.media_dir, self._media_name(record))
+                with open(media_path + ".tmp", "wb") as f:
+                    f.write(img_data)
+                os.replace(media_path + ".tmp", media_path)
+                
+                self._append(record)
+                self._pending[card_id] = record
+            
+            self._wake.set()
+            return card_id
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def start(self):
+        """启动后台发送线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="card-outbox", daemon=True)
+            self._thread.start()
+            self._wake.set()
+
+    def stop(self):
+        """停止后台发送线程，未发送的卡片保留在本地"""
+        self._stop.set()
+        self._wake.set()
+
+    def close(self):
+        """停止发送并释放队列目录的锁，之后其他进程可以接管未发送的卡片"""
+        self.stop()
+        self._lock_file.close()
+
+    def _run(self):
+        """后台线程：发送队列中的卡片，失败时指数退避"""
+        failures = 0
+        while not self._stop.is_set():
+            if failures:
+                # 退避期间新加入的卡片不会触发重试，只有停止信号能打断等待
+                delay = min(self.max_delay, self.base_delay * 2 ** (failures - 1))
+                self._stop.wait(delay * random.uniform(0.8, 1.2))
+            else:
+                # 主队列定期醒来，并入其他进程退出后留下的备用队列
+                self._wake.wait(self.ADOPT_INTERVAL if self.primary else None)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            
+            try:
+                if self.primary:
+                    self._adopt_spares()
+                self.flush()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                offline = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                self._notify({
+                    "pending": self.pending_count(),
+                    "offline": offline,
+                    "error": str(e),
+                    "retry_in": min(self.max_delay, self.base_delay * 2 ** (failures - 1)),
+                })
+
+    def flush(self):
+        """在当前线程中发送队列中的全部卡片，连接失败或Anki暂时无法处理时抛出异常"""
+        while self._send_batch():
+            pass
+        if self._untag:
+            self._remove_id_tags([])
+
+    def _send_batch(self):
+        """发送一批卡片，没有待发送的卡片时返回False"""
+        with tracer.span("outbox.send_batch"):
+            with self._lock:
+                batch = list(self._pending.values())[:self.batch_size]
+                unconfirmed = [record for record in batch if record["id"] in self._unconfirmed]
+            if not batch:
+                return False
+            
+            # 之前发送过但结果未知的卡片，先按ID标签查询是否已经在Anki中
+            sent = 0
+            confirmed = []  # 本批确认添加的(卡片记录, 笔记ID)，之后删除其ID标签
+            if unconfirmed:
+                responses = self.client.invoke_multi([
+                    {"action": "findNotes", "params": {"query": f'"tag:{self.id_tag(record["id"])}"'}}
+                    for record in unconfirmed
+                ])
+                for record, response in zip(unconfirmed, responses):
+                    if response.get("error") is None and response.get("result"):
+                        self._finish(record, "done", note_id=response["result"][0])
+                        confirmed.append((record, response["result"][0]))
+                        sent += 1
+                with self._lock:
+                    batch = [record for record in batch if record["id"] in self._pending]
+            
+            cards = []
+            failures = []
+            for record in list(batch):
+                try:
+                    with open(os.path.join(self.media_dir, self._media_name(record)), "rb") as f:
+                        img_data = f.read()
+                except OSError as e:
+                    self._finish(record, "failed", error=f"图片文件丢失: {e}")
+                    failures.append((record["question"], f"图片文件丢失: {e}"))
+                    batch.remove(record)
+                    continue
+                cards.append({
+                    "question": record["question"],
+                    "img_filename": record["img_filename"],
+                    "img_data": img_data,
+                    "deck": record["deck"],
+                    "tags": record["tags"] + [self.id_tag(record["id"])],
+                })
+            
+            retry_later = None
+            if cards:
+                with self._lock:
+                    self._unconfirmed.update(record["id"] for record in batch)
+                results = self.client.add_image_notes(cards)
+                for record, result in zip(batch, results):
+                    error = result["error"]
+                    if error is None:
+                        self._finish(record, "done", note_id=result["note_id"])
+                        confirmed.append((record, result["note_id"]))
+                        sent += 1
+                    elif result.get("retry") or any(transient in error for transient in self.TRANSIENT_ERRORS):
+                        retry_later = error
+                    else:
+                        self._finish(record, "failed", error=error)
+                        failures.append((record["question"], error))
+            
+            if confirmed:
+                self._remove_id_tags([(note_id, self.id_tag(record["id"])) for record, note_id in confirmed])
+            with self._lock:
+                if not self._pending:
+                    self._compact()
+            self._notify({"pending": self.pending_count(), "sent": sent, "failures": failures, "offline": False})
+            
+            if retry_later is not None:
+                raise OutboxRetryLater(retry_later)
+            return True
+
+    def _remove_id_tags(self, tagged):
+        """从已确认添加的笔记中删除ID标签，tagged为(笔记ID, 标签)列表
+        
+        失败时留到下一次发送后重试；标签暂时留在Anki中不影响卡片本身。
+        """
+        self._untag.extend(tagged)
+        untag = self._untag[:self.batch_size * 4]
+        try:
+            # 从没有该标签的笔记中删除标签不会出错，所有笔记和标签可以合并为一次请求
+            self.client.invoke(
+                "removeTags", notes=[note_id for note_id, _ in untag], tags=" ".join(tag for _, tag in untag)
+            )
+        except Exception:
+            return
+        del self._untag[:len(untag)]
+
+    def _finish(self, record, status, **details):
+        """记录卡片的最终结果并移出待发送队列"""
+        with self._lock:
+            if self._pending.pop(record["id"], None) is None:
+                return
+            self._unconfirmed.discard(record["id"])
+            self._append(dict({"op": status, "id": record["id"]}, **details))
+            try:
+                os.remove(os.path.join(self.media_dir, self._media_name(record)))
+            except OSError:
+                pass
+
+    def _notify(self, update):
+        if self.on_update is None:
+            return
+        if self.root is not None:
+            self.root.after(0, self.on_update, update)
+        else:
+            self.on_update(update)
+
+
+class ApkgWriter:
+    """把卡片直接写入.apkg文件的后端，不需要运行Anki
+    
+    与AnkiConnectClient提供相同的add_image_notes接口。卡片按批写入临时的SQLite集合（每批一个事务），
+    图片在添加时直接写入zip；close()时写入集合和媒体映射，并原子地替换目标文件。
+    """
+
+    # 固定的模型ID，多次导入时复用同一个笔记类型
+    MODEL_ID = 1587300000000
+    MODEL_NAME = "问答题（PDF到Anki）"
+    FIELD_NAMES = ("正面", "背面")
+    SCHEMA = """
+        CREATE TABLE col (id integer primary key, crt integer not null, mod integer not null,
+            scm integer not null, ver integer not null, dty integer not null, usn integer not null,
+            ls integer not null, conf text not null, models text not null, decks text not null,
+            dconf text not null, tags text not null);
+        CREATE TABLE notes (id integer primary key, guid text not null, mid integer not null,
+            mod integer not null, usn integer not null, tags text not null, flds text not null,
+            sfld integer not null, csum integer not null, flags integer not null, data text not null);
+        CREATE TABLE cards (id integer primary key, nid integer not null, did integer not null,
+            ord integer not null, mod integer not null, usn integer not null, type integer not null,
+            queue integer not null, due integer not null, ivl integer not null, factor integer not null,
+            reps integer not null, lapses integer not null, left integer not null, odue integer not null,
+            odid integer not null, flags integer not null, data text not null);
+        CREATE TABLE revlog (id integer primary key, cid integer not null, usn integer not null,
+            ease integer not null, ivl integer not null, lastIvl integer not null, factor real not null,
+            time integer not null, type integer not null);
+        CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+        CREATE INDEX ix_notes_usn on notes (usn);
+        CREATE INDEX ix_cards_usn on cards (usn);
+        CREATE INDEX ix_revlog_usn on revlog (usn);
+        CREATE INDEX ix_cards_nid on cards (nid);
+        CREATE INDEX ix_cards_sched on cards (did, queue, due);
+        CREATE INDEX ix_revlog_cid on revlog (cid);
+        CREATE INDEX ix_notes_csum on notes (csum);
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._tmp_path = f"{path}.{os.getpid()}.tmp"
+        self._db_path = f"{path}.{os.getpid()}.anki2.tmp"
+        self._zip = zipfile.ZipFile(self._tmp_path, "w")
+        # 界面中在主线程创建，在后台线程写入和关闭；所有访问都持有self._lock
+        self._db = sqlite3.connect(self._db_path, check_same_thread=False)
+        self._db.executescript(self.SCHEMA)
+        self._media = OrderedDict()  # 文件名 -> zip中的条目名
+        self._decks = {}  # 牌组名 -> 牌组ID
+        self._next_id = int(time.time() * 1000)
+        self._lock = threading.Lock()
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    def _deck_id(self, name):
+        """牌组ID由名称生成，同名牌组多次导出得到相同的ID"""
+        if name not in self._decks:
+            self._decks[name] = 1 if name == "Default" else \
+                int(hashlib.sha1(name.encode("utf-8")).hexdigest()[:12], 16)
+        return self._decks[name]
+
+    @staticmethod
+    def _checksum(text):
+        return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+
+    def add_image_notes(self, cards, deck_name="默认", tags=("PDF截取",), batch_size=50):
+        """写入一批卡片，返回与cards一一对应的结果列表，格式与AnkiConnectClient相同"""
+        with self._lock, tracer.span("apkg.add_notes", cards=len(cards)):
+            now = int(time.time())
+            notes = []
+            card_rows = []
+            for card in cards:
+                filename = card["img_filename"]
+                if filename not in self._media:
+                    # 图片已压缩，不再用deflate压缩
+                    entry = str(len(self._media))
+                    self._zip.writestr(entry, card["img_data"], compress_type=zipfile.ZIP_STORED)
+                    self._media[filename] = entry
+                
+                question = card["question"]
+                answer = f'<img src="{filename}">'
+                note_id = self._new_id()
+                # GUID由内容生成，重复导出同一张卡片时Anki会更新而不是新增
+                guid = base64.b64encode(hashlib.sha1(f"{question}\x1f{filename}".encode("utf-8")).digest()[:9]).decode()
+                note_tags = " ".join(tag.replace(" ", "_") for tag in card.get("tags", tags))
+                notes.append((
+                    note_id, guid, self.MODEL_ID, now, -1, f" {note_tags} " if note_tags else "",
+                    f"{question}\x1f{answer}", question, self._checksum(question), 0, ""
+                ))
+                card_rows.append((
+                    self._new_id(), note_id, self._deck_id(card.get("deck", deck_name)), 0, now, -1,
+                    0, 0, self.count + len(card_rows) + 1, 0, 0, 0, 0, 0, 0, 0, 0, ""
+                ))
+            
+            with self._db:
+                self._db.executemany("INSERT INTO notes VALUES (?,?,?,?,?,?,?,?,?,?,?)", notes)
+                self._db.executemany("INSERT INTO cards VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", card_rows)
+            self.count += len(cards)
+            return [{"note_id": note[0], "error": None} for note in notes]
+
+    def _collection_json(self, now):
+        """生成col表中的模型、牌组和牌组设置"""
+        model = {
+            "id": self.MODEL_ID, "name": self.MODEL_NAME, "type": 0, "mod": now, "usn": -1,
+            "sortf": 0, "did": 1, "tags": [], "vers": [], "req": [[0, "any", [0]]],
+            "flds": [
+                {"name": name, "ord": index, "sticky": False, "rtl": False, "font": "Arial", "size": 20, "media": []}
+                for index, name in enumerate(self.FIELD_NAMES)
+            ],
+            "tmpls": [{
+                "name": "卡片1", "ord": 0, "did": None, "bqfmt": "", "bafmt": "",
+                "qfmt": "{{%s}}" % self.FIELD_NAMES[0],
+                "afmt": "{{FrontSide}}<hr id=answer>{{%s}}" % self.FIELD_NAMES[1],
+            }],
+            "css": ".card { font-family: arial; font-size: 20px; text-align: center; color: black; "
+                   "background-color: white; }\nimg { max-width: 100%; }",
+            "latexPre": "\\documentclass[12pt]{article}\n\\begin{document}\n",
+            "latexPost": "\\end{document}",
+        }
+        decks = {}
+        for name, deck_id in dict({"Default": 1}, **self._decks).items():
+            decks[str(deck_id)] = {
+                "id": deck_id, "name": name, "mod": now, "usn": -1,
+                "lrnToday": [0, 0], "revToday": [0, 0], "newToday": [0, 0], "timeToday": [0, 0],
+                "collapsed": False, "desc": "", "dyn": 0, "conf": 1, "extendNew": 10, "extendRev": 50,
+            }
+        dconf = {"1": {
+            "id": 1, "name": "Default", "mod": 0, "usn": 0, "maxTaken": 60, "autoplay": True, "timer": 0,
+            "replayq": True, "dyn": False,
+            "new": {"delays": [1, 10], "ints": [1, 4, 7], "initialFactor": 2500, "order": 1, "perDay": 20,
+                    "bury": True, "separate": True},
+            "rev": {"perDay": 200, "ease4": 1.3, "fuzz": 0.05, "maxIvl": 36500, "ivlFct": 1,
+                    "bury": True, "minSpace": 1},
+            "lapse": {"delays": [10], "mult": 0, "minInt": 1, "leechFails": 8, "leechAction": 0},
+        }}
+        conf = {"nextPos": self.count + 1, "curDeck": 1, "curModel": str(self.MODEL_ID), "sortType": "noteFld",
+                "sortBackwards": False, "activeDecks": [1], "newSpread": 0, "collapseTime": 1200,
+                "estTimes": True, "dueCounts": True, "timeLim": 0, "addToCur": True}
+        return conf, {str(self.MODEL_ID): model}, decks, dconf
+
+    def close(self):
+        """写入集合和媒体映射，生成最终的.apkg文件，返回导出的卡片数；失败时删除临时文件"""
+        try:
+            return self._close()
+        except Exception:
+            self.discard()
+            raise
+
+    def _close(self):
+        with self._lock, tracer.span("apkg.close", cards=self.count):
+            now = int(time.time())
+            conf, models, decks, dconf = self._collection_json(now)
+            with self._db:
+                self._db.execute(
+                    "INSERT INTO col VALUES (1,?,?,?,11,0,0,0,?,?,?,?,'{}')",
+                    (now, now * 1000, now * 1000, json.dumps(conf), json.dumps(models, ensure_ascii=False),
+                     json.dumps(decks, ensure_ascii=False), json.dumps(dconf))
+                )
+            self._db.close()
+            
+            self._zip.write(self._db_path, "collection.anki2", compress_type=zipfile.ZIP_DEFLATED)
+            media_map = {entry: filename for filename, entry in self._media.items()}
+            self._zip.writestr("media", json.dumps(media_map), compress_type=zipfile.ZIP_DEFLATED)
+            self._zip.close()
+            os.remove(self._db_path)
+            os.replace(self._tmp_path, self.path)
+            return self.count
+
+    def discard(self):
+        """放弃导出，删除临时文件"""
+        with self._lock:
+            for handle in (self._db, self._zip):
+                try:
+                    handle.close()
+                except Exception:
+                    pass
+            for path in (self._db_path, self._tmp_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+class InteractionScheduler:
+    """合并画布交互事件：每帧最多执行一次更新，耗时的重新渲染等输入停止后再执行，并记录输入到绘制的延迟"""
+
+    def __init__(self, root, frame_ms=16, history=200):
+        self.root = root
+        self.frame_ms = frame_ms  # 一帧的时长（毫秒）
+        self._pending = OrderedDict()  # 名称 -> 本帧要执行的回调，同名请求只保留最新的一个
+        self._input_times = {}  # 名称 -> 尚未绘制的最早输入时间
+        self._frame_job = None
+        self._debounce_jobs = {}
+        self._latencies = defaultdict(lambda: deque(maxlen=history))
+
+    def request(self, name, callback):
+        """在下一帧执行回调，同一帧内的同名请求合并为一次"""
+        self._input_times.setdefault(name, time.perf_counter())
+        self._pending[name] = callback
+        if self._frame_job is None:
+            self._frame_job = self.root.after(self.frame_ms, self._run_frame)
+
+    def debounce(self, name, delay_ms, callback):
+        """输入停止delay_ms毫秒后再执行回调，期间的新请求会推迟执行时间"""
+        self._input_times.setdefault(name, time.perf_counter())
+        job = self._debounce_jobs.pop(name, None)
+        if job is not None:
+            self.root.after_cancel(job)
+        self._debounce_jobs[name] = self.root.after(delay_ms, self._run_debounced, name, callback)
+
+    def cancel(self, name):
+        """取消尚未执行的同名请求"""
+        self._pending.pop(name, None)
+        self._input_times.pop(name, None)
+        job = self._debounce_jobs.pop(name, None)
+        if job is not None:
+            self.root.after_cancel(job)
+
+    def _run_frame(self):
+        self._frame_job = None
+        pending, self._pending = self._pending, OrderedDict()
+        for name, callback in pending.items():
+            callback()
+            self._schedule_paint_mark(name)
+
+    def _run_debounced(self, name, callback):
+        self._debounce_jobs.pop(name, None)
+        callback()
+        self._schedule_paint_mark(name)
+
+    def _schedule_paint_mark(self, name):
+        started = self._input_times.pop(name, None)
+        if started is not None:
+            # 画布的重绘也在空闲时执行，排在它之后的空闲回调可以视为绘制完成的时间
+            self.root.after_idle(self._record, name, started)
+
+    def _record(self, name, started):
+        self._latencies[name].append((time.perf_counter() - started) * 1000)
+
+    def latency_stats(self):
+        """返回各类交互的输入到绘制延迟统计（毫秒）"""
+        stats = {}
+        for name, samples in self._latencies.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            stats[name] = {
+                "count": len(ordered),
+                "mean": sum(ordered) / len(ordered),
+                "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                "max": ordered[-1],
+            }
+        return stats
+
 
 class PDFAnkiTool:
-    def __init__(self, root):
+    # 图片格式选项：显示名称 -> (编码格式, 调色板颜色数，0表示不量化)
+    IMAGE_FORMAT_PRESETS = OrderedDict([
+        ("PNG", ("PNG", 0)),
+        ("PNG(256色)", ("PNG", 256)),
+        ("WebP", ("WEBP", 0)),
+        ("JPEG", ("JPEG", 0)),
+    ])
+    
+    BACKEND_ANKICONNECT = "AnkiConnect"
+    BACKEND_APKG = "导出.apkg"
+    
+    def __init__(self, root, show_trace_summary=False):
         self.root = root
         self.root.title("PDF到Anki问答题工具")
         self.root.geometry("1000x700")
@@ -22,6 +2344,7 @@ class PDFAnkiTool:
         self.pdf_document = None
         self.current_page = 0
         self.scale_factor = 1.0
+        self.display_scale = 1.0  # 当前显示图像相对PDF坐标的实际缩放比例
         self.canvas_width = 800
         self.canvas_height = 600
         
@@ -32,10 +2355,21 @@ class PDFAnkiTool:
         self.is_selecting = False
         self.is_dragging = False
         self.drag_start = None
-        self.screenshot = None
-        self.screenshot_path = None
-        self.canvas_image = None
+        self.selection_pdf_rect = None  # 选择区域在PDF坐标系中的位置
+        self.preview_image = None
+        self.display_image = None  # 当前显示在画布上的PIL图像，分块显示时为None
+        self.canvas_image = None  # 页面左上角的画布元素，其坐标即页面在画布上的位置
         self.tk_image = None
+        self.display_size = (0, 0)  # 页面在画布上的显示尺寸
+        
+        # 分块显示：页面过大时只渲染视口及周围一圈的图块
+        self.tile_cache = PageTileCache()
+        self.tile_margin = 1  # 视口外额外预渲染的图块圈数
+        self.tile_threshold_pixels = 6 * 1000 * 1000  # 整页像素超过该值且远大于视口时改为分块显示
+        self.tiled = False
+        self.tile_items = {}  # (列, 行) -> (画布元素ID, PhotoImage)
+        self._tile_queue = []  # 等待渲染的视口外图块
+        self._tile_job = None
         
         # 右键拖动相关变量
         self.is_panning = False
@@ -50,9 +2384,94 @@ class PDFAnkiTool:
         self.save_image_var = tk.BooleanVar(value=False)
         self.save_image_locally = False  # 是否在本地保存图片，默认关闭
         
+        # 页面渲染缓存，默认内存预算256MB
+        self.render_cache_limit = 256 * 1024 * 1024
+        self.render_cache = PageRenderCache(max_bytes=self.render_cache_limit)
+        self.large_document_mode = False  # 大文档模式下使用更小的缓存和预取范围
+        
+        # 跨会话的磁盘渲染缓存，文件内容哈希在后台计算完成前不使用
+        self.disk_render_cache = DiskRenderCache()
+        self.pdf_digest = None
+        
+        # 页面内容块空间索引，用于吸附选择，按页缓存；索引在工作进程中建立，完成前不吸附
+        self.layout_indexes = OrderedDict()
+        self.layout_index_limit = 32
+        self._layout_requests = set()  # 正在工作进程中建立索引的(路径, 页码)
+        self.hover_block = None
+        
+        # 多文档工作区：每个标签页保存各自的页码、缩放、选择和搜索状态，文档句柄由文档池统一管理
+        self.document_pool = DocumentPool(max_open=4, on_evict=self.on_document_evicted)
+        self.tabs = OrderedDict()  # 路径 -> 标签页状态
+        self.active_tab_var = tk.StringVar()
+        
+        # 缩略图导航，只为可见范围内的页面创建画布元素和图像
+        self.thumbnail_generator = None
+        self.thumbnail_items = {}  # 页码 -> (画布元素ID列表, PhotoImage)
+        self.thumbnail_slot_height = 190
+        self._thumbnail_refresh_job = None
+        
+        # 全文索引，打开PDF后在后台建立
+        self.text_index = None
+        self.search_results = []
+        self.search_query = None
+        self.search_position = -1
+        
+        # 渲染模式："matrix"按目标缩放直接光栅化，"resample"按72 DPI渲染后缩放
+        self.render_mode = "matrix"
+        self.progressive_render = True  # 先显示低分辨率画面，再替换为清晰渲染
+        self.preview_ratio = 0.25  # 低分辨率画面相对目标分辨率的比例
+        self.preview_min_pixels = 600 * 800  # 小于该像素数的页面直接清晰渲染
+        self.refine_delay_ms = 120  # 连续缩放时合并清晰化渲染的延迟
+        self._refine_job = None
+        
+        self.trace_interval_ms = 1000  # 埋点开启时记录指标的间隔
+        
+        # 画布交互调度：拖动、平移和悬停每帧最多更新一次，缩放和窗口大小改变在输入停止后再重新渲染
+        self.interaction = InteractionScheduler(self.root)
+        self.rerender_delay_ms = 150
+        self._pan_delta = (0, 0)  # 尚未应用到画布上的平移距离
+        self._hover_point = None
+        self._last_canvas_size = None
+        
+        # 后台渲染使用的进程池：PyMuPDF渲染时持有GIL且不支持多线程使用，放在界面进程的线程中会卡住界面
+        # 工作进程在第一次提交任务时才启动，不影响窗口显示速度
+        self.render_pool = ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn"))
+        
+        # 相邻页面后台预取
+        self.default_prefetch_window = 1  # 预取当前页前后各多少页
+        self.prefetch_window = self.default_prefetch_window
+        self.prefetcher = PagePrefetcher(
+            self.render_cache, self.render_pool, window=self.prefetch_window, disk_cache=self.disk_render_cache
+        )
+        self._prefetch_context = None
+        
+        # AnkiConnect客户端，请求在后台线程中执行
+        self.anki_client = AnkiConnectClient(self.root)
+        self.pending_cards = 0  # 已提交但尚未完成的卡片数
+        self.staged_cards = []  # 待批量提交的卡片队列
+        
+        # 截图在提交时由工作进程渲染和编码
+        self.capture_policy = CapturePolicy()  # 小区域按300 DPI渲染，大区域自动降低DPI
+        
+        # 正在渲染和编码的截图总大小上限，编码设置由界面上的格式和质量控件决定
+        self.capture_budget = RasterBudget(CAPTURE_RASTER_LIMIT)
+        
+        # 持久化的发送队列，Anki未打开时卡片保存在本地，连接恢复后自动发送
+        self.outbox = CardOutbox(self.anki_client, root=self.root, on_update=self.on_outbox_update)
+        self.outbox.start()
+        self.apkg_writer = None  # 选择导出.apkg时，本次会话的卡片写入该文件
+        
+        # 自动分题：后台分析整本文档，生成的草稿在审阅窗口中确认后再提交
+        self.segmenter = None
+        self.drafts = []
+        self.draft_window = None
+        
         # 创建界面控件
         self.create_widgets()
         
+        # 左侧缩略图导航栏
+        self.create_thumbnail_panel()
+        
         # PDF显示区域
         self.canvas_frame = tk.Frame(self.root, relief=tk.SUNKEN, bd=2)
         self.canvas_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
@@ -64,10 +2483,15 @@ class PDFAnkiTool:
         self.canvas.bind("<ButtonPress-1>", self.on_mouse_down)
         self.canvas.bind("<B1-Motion>", self.on_mouse_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_mouse_up)
+        self.canvas.bind("<Motion>", self.on_mouse_move)
         self.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
         self.canvas.bind("<ButtonPress-3>", self.on_right_mouse_down)  # 右键按下
         self.canvas.bind("<B3-Motion>", self.on_right_mouse_drag)    # 右键拖动
         self.canvas.bind("<ButtonRelease-3>", self.on_right_mouse_up)  # 右键释放
+        self.canvas.bind("<Configure>", self.on_window_resize)
+        self.root.bind("<F9>", self.show_interaction_latency)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self._closing = False  # 正在关闭窗口，等待后台任务结束
         
         # 底部状态栏
         status_frame = tk.Frame(self.root)
@@ -79,6 +2503,25 @@ class PDFAnkiTool:
         # 清除选择按钮
         self.clear_btn = tk.Button(status_frame, text="清除选择", command=self.clear_selection)
         self.clear_btn.pack(side=tk.RIGHT, padx=5)
+        
+        # 选择区域预览（从屏幕图像裁剪）
+        self.preview_label = tk.Label(status_frame)
+        self.preview_label.pack(side=tk.RIGHT, padx=5)
+        
+        # 刷新Anki模型信息按钮（在Anki中修改了卡片模型后使用）
+        self.refresh_model_btn = tk.Button(status_frame, text="刷新模型", command=self.refresh_anki_models)
+        self.refresh_model_btn.pack(side=tk.RIGHT, padx=5)
+        
+        # 埋点开启时定期记录缓存和队列指标，并可在状态栏右侧显示耗时摘要
+        self.trace_label = None
+        if show_trace_summary and tracer.enabled:
+            self.trace_label = tk.Label(status_frame, bd=1, relief=tk.SUNKEN, anchor=tk.W)
+            self.trace_label.pack(side=tk.RIGHT, padx=5)
+        if tracer.enabled:
+            self.root.after(self.trace_interval_ms, self.record_trace_metrics)
+        
+        # 窗口显示后再在后台导入PyMuPDF、Pillow和requests
+        self.root.after(100, warm_up_imports)
     
     def create_widgets(self):
         """创建界面控件"""
@@ -86,6 +2529,42 @@ class PDFAnkiTool:
         control_frame = tk.Frame(self.root)
         control_frame.pack(fill=tk.X, padx=10, pady=5)
         
+        # 全文搜索栏
+        search_frame = tk.Frame(self.root)
+        search_frame.pack(fill=tk.X, padx=10)
+        
+        # 已打开文档的标签栏
+        self.tab_frame = tk.Frame(self.root)
+        self.tab_frame.pack(fill=tk.X, padx=10, pady=(5, 0))
+        self.root.bind("<Control-Tab>", self.next_tab)
+        
+        tk.Label(search_frame, text="搜索:").pack(side=tk.LEFT, padx=5)
+        self.search_entry = tk.Entry(search_frame, width=40)
+        self.search_entry.pack(side=tk.LEFT, padx=5)
+        self.search_entry.bind("<Return>", self.search_text)
+        
+        self.search_btn = tk.Button(search_frame, text="查找下一个", command=self.search_text)
+        self.search_btn.pack(side=tk.LEFT, padx=5)
+        
+        self.search_label = tk.Label(search_frame, text="")
+        self.search_label.pack(side=tk.LEFT, padx=5)
+        
+        self.segment_btn = tk.Button(search_frame, text="自动分题", command=self.start_segmentation)
+        self.segment_btn.pack(side=tk.LEFT, padx=5)
+        
+        # 卡片去向：通过AnkiConnect添加，或直接导出为.apkg文件（无需打开Anki）
+        self.finish_export_btn = tk.Button(search_frame, text="完成导出", command=self.finish_apkg_export)
+        self.finish_export_btn.pack(side=tk.RIGHT, padx=5)
+        self.finish_export_btn.config(state=tk.DISABLED)
+        
+        self.backend_var = tk.StringVar(value=self.BACKEND_ANKICONNECT)
+        self.backend_menu = tk.OptionMenu(
+            search_frame, self.backend_var, self.BACKEND_ANKICONNECT, self.BACKEND_APKG,
+            command=self.on_backend_change
+        )
+        self.backend_menu.pack(side=tk.RIGHT, padx=5)
+        tk.Label(search_frame, text="卡片去向:").pack(side=tk.RIGHT)
+        
         # 问题输入
         tk.Label(control_frame, text="问题:").pack(side=tk.LEFT, padx=5)
         self.question_entry = tk.Entry(control_frame, width=40)
@@ -137,6 +2616,26 @@ class PDFAnkiTool:
         )
         self.save_image_checkbox.pack(side=tk.RIGHT, padx=5)
         
+        # 吸附到内容块复选框
+        self.snap_var = tk.BooleanVar(value=False)
+        self.snap_checkbox = tk.Checkbutton(
+            control_frame, text="吸附", variable=self.snap_var, command=self.request_layout_index
+        )
+        self.snap_checkbox.pack(side=tk.RIGHT, padx=5)
+        
+        # 图片格式选择
+        self.image_format_var = tk.StringVar(value="PNG")
+        self.image_format_menu = tk.OptionMenu(control_frame, self.image_format_var, *self.IMAGE_FORMAT_PRESETS)
+        self.image_format_menu.pack(side=tk.RIGHT, padx=5)
+        
+        # JPEG/WebP质量，PNG格式忽略该设置
+        self.image_quality_var = tk.IntVar(value=85)
+        self.image_quality_spinbox = tk.Spinbox(
+            control_frame, from_=10, to=100, increment=5, width=4, textvariable=self.image_quality_var
+        )
+        self.image_quality_spinbox.pack(side=tk.RIGHT)
+        tk.Label(control_frame, text="质量:").pack(side=tk.RIGHT)
+        
         # 设置图片存储路径按钮
         self.set_path_btn = tk.Button(control_frame, text="设置路径", command=self.set_image_path)
         self.set_path_btn.pack(side=tk.RIGHT, padx=5)
@@ -145,12 +2644,68 @@ class PDFAnkiTool:
         self.add_to_anki_btn = tk.Button(control_frame, text="添加到Anki", command=self.add_to_anki)
         self.add_to_anki_btn.pack(side=tk.RIGHT, padx=5)
         self.add_to_anki_btn.config(state=tk.DISABLED)
+        
+        # 待提交队列：先在本地暂存卡片，再批量提交
+        self.flush_queue_btn = tk.Button(control_frame, text="提交队列(0)", command=self.flush_staged_cards)
+        self.flush_queue_btn.pack(side=tk.RIGHT, padx=5)
+        self.flush_queue_btn.config(state=tk.DISABLED)
+        
+        self.stage_card_btn = tk.Button(control_frame, text="加入队列", command=self.stage_card)
+        self.stage_card_btn.pack(side=tk.RIGHT, padx=5)
+        self.stage_card_btn.config(state=tk.DISABLED)
+        self.question_entry.bind("<Return>", self.stage_card)
     
     def on_window_resize(self, event):
-        """窗口大小改变时的处理"""
-        if event.widget == self.root:
-            # 延迟更新以避免频繁重绘
-            self.root.after(100, self.update_page_display)
+        """画布大小改变时的处理：等调整停止后再重新渲染一次"""
+        size = (event.width, event.height)
+        if size == self._last_canvas_size:
+            return
+        first_layout = self._last_canvas_size is None
+        self._last_canvas_size = size
+        if first_layout or not self.pdf_document:
+            return
+        self.interaction.debounce("resize", self.rerender_delay_ms, self.update_page_display)
+    
+    def record_trace_metrics(self):
+        """埋点开启时定期记录缓存和队列指标，并刷新状态栏摘要"""
+        memory = self.render_cache.stats()
+        tracer.counter("render_cache", hits=memory["hits"], misses=memory["misses"], bytes=memory["bytes"])
+        disk = self.disk_render_cache.stats()
+        tracer.counter("disk_render_cache", hits=disk["hits"], misses=disk["misses"], bytes=disk["bytes"] or 0)
+        tracer.counter("tile_cache", tiles=len(self.tile_cache))
+        tracer.counter(
+            "queues",
+            outbox=self.outbox.pending_count(), pending=self.pending_cards, staged=len(self.staged_cards)
+        )
+        
+        if self.trace_label is not None:
+            summary = tracer.summary()
+            names = [
+                ("update_page_display", "显示"), ("mupdf.get_pixmap", "渲染"), ("encode_image", "编码"),
+                ("anki.invoke", "Anki"),
+            ]
+            parts = [f"{label}{summary[name]['mean']:.0f}ms" for name, label in names if name in summary]
+            parts.append(f"缓存命中{memory['hit_rate'] * 100:.0f}%")
+            parts.append(f"待同步{self.outbox.pending_count()}")
+            self.trace_label.config(text=" ".join(parts))
+        
+        self.root.after(self.trace_interval_ms, self.record_trace_metrics)
+    
+    def show_interaction_latency(self, event=None):
+        """在状态栏显示输入到绘制的延迟统计"""
+        stats = self.interaction.latency_stats()
+        if not stats:
+            self.status_bar.config(text="暂无交互延迟数据")
+            return
+        names = {
+            "selection": "选择", "pan": "平移", "hover": "悬停",
+            "zoom": "缩放预览", "render": "缩放渲染", "resize": "窗口调整",
+        }
+        parts = [
+            f"{names.get(name, name)} 平均{item['mean']:.0f}ms/P95 {item['p95']:.0f}ms"
+            for name, item in stats.items()
+        ]
+        self.status_bar.config(text="输入到绘制延迟: " + "，".join(parts))
     
     def select_pdf(self):
         """选择PDF文件并加载"""
@@ -158,23 +2713,626 @@ class PDFAnkiTool:
             filetypes=[("PDF文件", "*.pdf"), ("所有文件", "*.*")]
         )
         
-        if file_path:
+        if not file_path:
+            return
+        file_path = os.path.normpath(file_path)
+        
+        # 已经打开的文档直接切换到对应的标签页
+        if file_path in self.tabs:
+            self.switch_to_tab(file_path)
+            return
+        
+        try:
+            self.save_tab_state()
+            self.deactivate_document()
+            # 新打开的文件可能已被修改，丢弃旧的渲染结果
+            self.render_cache.invalidate(file_path)
+            self.tile_cache.invalidate(file_path)
+            self.tabs[file_path] = {
+                "page": 0, "scale": 1.0, "selection": None, "digest": None,
+                "text_index": None, "search": (None, [], -1),
+            }
+            self.activate_tab(file_path)
+            self.status_bar.config(text=f"已加载PDF: {os.path.basename(self.pdf_path)}")
+        except Exception as e:
+            messagebox.showerror("错误", f"无法打开PDF文件: {str(e)}")
+            self.close_tab(file_path)
+    
+    def save_tab_state(self):
+        """把当前文档的浏览状态保存到它的标签页"""
+        tab = self.tabs.get(self.pdf_path)
+        if tab is None:
+            return
+        tab.update(
+            page=self.current_page,
+            scale=self.scale_factor,
+            selection=tuple(self.selection_pdf_rect) if self.selection_pdf_rect else None,
+            digest=self.pdf_digest,
+            text_index=self.text_index,
+            search=(self.search_query, self.search_results, self.search_position),
+        )
+    
+    def deactivate_document(self):
+        """离开当前文档：停止它的后台任务，文档本身留在文档池中"""
+        self.cancel_refine_render()
+        self.stop_thumbnails()
+        self.stop_tiles()
+        self.prefetcher.cancel()
+        self._prefetch_context = None
+        self.clear_selection()
+        # 全文索引保存在标签页中，继续在后台建立，不取消
+        self.text_index = None
+        self.search_results = []
+        self.search_query = None
+        self.search_position = -1
+        self.search_label.config(text="")
+    
+    def activate_tab(self, path):
+        """显示指定标签页的文档，恢复其页码、缩放、选择和搜索状态"""
+        tab = self.tabs[path]
+        self.pdf_path = path
+        self.pdf_document = self.document_pool.get(path)
+        self.apply_memory_profile()
+        self.current_page = min(tab["page"], len(self.pdf_document) - 1)
+        self.scale_factor = tab["scale"]
+        self.pdf_digest = tab["digest"]
+        self.active_tab_var.set(path)
+        
+        self.update_page_display()
+        self.update_page_controls()
+        if tab["selection"] is not None:
+            self.set_selection_from_pdf_rect(fitz.Rect(tab["selection"]))
+            self.capture_selected_area()
+        self.check_add_button_state()
+        
+        self.search_query, self.search_results, self.search_position = tab["search"]
+        self.text_index = tab["text_index"]
+        if self.text_index is None:
+            self.start_text_index()
+            tab["text_index"] = self.text_index
+        elif self.text_index.ready:
+            self.search_label.config(text="全文索引已就绪")
+        self.start_thumbnails()
+        if self.pdf_digest is None:
+            self.start_pdf_digest()
+        self.update_tab_bar()
+    
+    def switch_to_tab(self, path):
+        """切换到另一个已打开的文档"""
+        if path == self.pdf_path or path not in self.tabs:
+            self.active_tab_var.set(self.pdf_path or "")
+            return
+        self.save_tab_state()
+        self.deactivate_document()
+        try:
+            self.activate_tab(path)
+            self.status_bar.config(text=f"已切换到: {os.path.basename(path)}")
+        except Exception as e:
+            messagebox.showerror("错误", f"无法打开PDF文件: {str(e)}")
+            self.close_tab(path)
+    
+    def next_tab(self, event=None):
+        """切换到下一个标签页"""
+        paths = list(self.tabs)
+        if len(paths) > 1 and self.pdf_path in paths:
+            self.switch_to_tab(paths[(paths.index(self.pdf_path) + 1) % len(paths)])
+        return "break"
+    
+    def close_tab(self, path):
+        """关闭标签页和对应的文档"""
+        tab = self.tabs.pop(path, None)
+        if tab is not None and tab["text_index"] is not None:
+            tab["text_index"].cancel()
+        if path == self.pdf_path:
+            self.deactivate_document()
+            self.pdf_path = None
+            self.pdf_document = None
+        self.document_pool.close(path)
+        
+        if self.pdf_path is None:
+            if self.tabs:
+                self.activate_tab(next(reversed(self.tabs)))
+            else:
+                self.reset_pdf()
+        self.update_tab_bar()
+    
+    def on_document_evicted(self, path):
+        """文档池关闭了一个文档，释放它的渲染缓存和内容块索引"""
+        self.render_cache.invalidate(path)
+        self.tile_cache.invalidate(path)
+        for key in [k for k in self.layout_indexes if k[0] == path]:
+            del self.layout_indexes[key]
+    
+    def update_tab_bar(self):
+        """重建标签栏"""
+        for child in self.tab_frame.winfo_children():
+            child.destroy()
+        for path in self.tabs:
+            tab_button = tk.Radiobutton(
+                self.tab_frame, text=os.path.basename(path), variable=self.active_tab_var, value=path,
+                indicatoron=0, padx=8, command=lambda p=path: self.switch_to_tab(p)
+            )
+            tab_button.pack(side=tk.LEFT)
+            close_button = tk.Button(
+                self.tab_frame, text="×", relief=tk.FLAT, padx=2, pady=0,
+                command=lambda p=path: self.close_tab(p)
+            )
+            close_button.pack(side=tk.LEFT, padx=(0, 6))
+    
+    def create_thumbnail_panel(self):
+        """创建左侧缩略图导航栏"""
+        self.thumbnail_frame = tk.Frame(self.root)
+        self.thumbnail_frame.pack(side=tk.LEFT, fill=tk.Y, padx=(10, 0), pady=5)
+        
+        self.thumbnail_canvas = tk.Canvas(self.thumbnail_frame, width=150, bg="#e8e8e8", highlightthickness=0)
+        self.thumbnail_scrollbar = tk.Scrollbar(self.thumbnail_frame, orient=tk.VERTICAL,
+                                                command=self.on_thumbnail_scroll)
+        self.thumbnail_canvas.config(yscrollcommand=self.on_thumbnail_yview)
+        self.thumbnail_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.thumbnail_canvas.pack(side=tk.LEFT, fill=tk.Y)
+        
+        self.thumbnail_canvas.bind("<ButtonPress-1>", self.on_thumbnail_click)
+        self.thumbnail_canvas.bind("<MouseWheel>", self.on_thumbnail_wheel)
+        self.thumbnail_canvas.bind("<Configure>", lambda event: self.schedule_thumbnail_refresh())
+    
+    def start_thumbnails(self):
+        """为当前文档启动缩略图生成"""
+        self.stop_thumbnails()
+        page_count = len(self.pdf_document)
+        self.thumbnail_canvas.config(scrollregion=(0, 0, 150, page_count * self.thumbnail_slot_height))
+        self.thumbnail_canvas.yview_moveto(0)
+        
+        generator = ThumbnailGenerator(
+            self.pdf_path, page_count, self.render_pool,
+            on_ready=lambda page_index: self.root.after(0, self.on_thumbnail_ready, generator, page_index)
+        )
+        self.thumbnail_generator = generator
+        generator.start()
+        self.schedule_thumbnail_refresh()
+    
+    def stop_thumbnails(self):
+        """停止缩略图生成并清空导航栏"""
+        if self.thumbnail_generator is not None:
+            self.thumbnail_generator.stop()
+        self.thumbnail_generator = None
+        self.thumbnail_items = {}
+        self.thumbnail_canvas.delete("all")
+        self.thumbnail_canvas.config(scrollregion=(0, 0, 150, 0))
+    
+    def on_thumbnail_scroll(self, *args):
+        """滚动条拖动"""
+        self.thumbnail_canvas.yview(*args)
+    
+    def on_thumbnail_wheel(self, event):
+        """鼠标滚轮滚动缩略图"""
+        self.thumbnail_canvas.yview_scroll(-1 if event.delta > 0 else 1, "units")
+    
+    def on_thumbnail_yview(self, first, last):
+        """缩略图视图位置改变时更新滚动条，并刷新可见的缩略图"""
+        self.thumbnail_scrollbar.set(first, last)
+        self.schedule_thumbnail_refresh()
+    
+    def schedule_thumbnail_refresh(self):
+        """合并连续的滚动事件，空闲时再刷新可见的缩略图"""
+        if self._thumbnail_refresh_job is None:
+            self._thumbnail_refresh_job = self.root.after_idle(self.refresh_visible_thumbnails)
+    
+    def visible_thumbnail_range(self):
+        """返回当前可见的页码范围（包含两端）"""
+        top = self.thumbnail_canvas.canvasy(0)
+        bottom = self.thumbnail_canvas.canvasy(self.thumbnail_canvas.winfo_height())
+        last_page = len(self.pdf_document) - 1
+        first = max(0, int(top // self.thumbnail_slot_height))
+        last = min(last_page, int(bottom // self.thumbnail_slot_height))
+        return first, last
+    
+    def refresh_visible_thumbnails(self):
+        """只为可见页面创建画布元素，离开可见范围的页面立即释放"""
+        self._thumbnail_refresh_job = None
+        generator = self.thumbnail_generator
+        if generator is None or not self.pdf_document:
+            return
+        
+        first, last = self.visible_thumbnail_range()
+        generator.set_visible(first, last)
+        
+        for page_index in [p for p in self.thumbnail_items if p < first or p > last]:
+            item_ids, _ = self.thumbnail_items.pop(page_index)
+            for item_id in item_ids:
+                self.thumbnail_canvas.delete(item_id)
+        
+        for page_index in range(first, last + 1):
+            entry = self.thumbnail_items.get(page_index)
+            if entry is None or entry[1] is None:
+                self.draw_thumbnail(page_index)
+        self.highlight_current_thumbnail()
+    
+    def draw_thumbnail(self, page_index):
+        """绘制一个缩略图槽位：已生成时显示图像，否则显示占位框"""
+        old = self.thumbnail_items.pop(page_index, None)
+        if old is not None:
+            for item_id in old[0]:
+                self.thumbnail_canvas.delete(item_id)
+        
+        top = page_index * self.thumbnail_slot_height
+        photo = None
+        path = self.thumbnail_generator.path_for(page_index)
+        if path is not None:
+            try:
+                with Image.open(path) as img:
+                    photo = ImageTk.PhotoImage(image=img)
+            except OSError:
+                photo = None
+        
+        if photo is not None:
+            x = 75 - photo.width() // 2
+            body = self.thumbnail_canvas.create_image(x, top + 6, anchor=tk.NW, image=photo)
+        else:
+            body = self.thumbnail_canvas.create_rectangle(15, top + 6, 135, top + 166, outline="#b0b0b0", fill="white")
+        label = self.thumbnail_canvas.create_text(75, top + 176, text=str(page_index + 1))
+        frame = self.thumbnail_canvas.create_rectangle(
+            12, top + 3, 138, top + 169, outline="", width=2, tags=("thumb_frame", f"thumb_frame_{page_index}")
+        )
+        self.thumbnail_items[page_index] = ([body, label, frame], photo)
+    
+    def on_thumbnail_ready(self, generator, page_index):
+        """缩略图生成完成的回调（界面线程）"""
+        if generator is not self.thumbnail_generator:
+            return
+        if page_index is None:
+            self.schedule_thumbnail_refresh()
+        elif page_index in self.thumbnail_items:
+            self.draw_thumbnail(page_index)
+            self.highlight_current_thumbnail()
+    
+    def highlight_current_thumbnail(self):
+        """高亮当前页的缩略图"""
+        self.thumbnail_canvas.itemconfig("thumb_frame", outline="")
+        self.thumbnail_canvas.itemconfig(f"thumb_frame_{self.current_page}", outline="blue")
+    
+    def scroll_thumbnail_into_view(self):
+        """确保当前页的缩略图在可见范围内"""
+        if self.thumbnail_generator is None or not self.pdf_document:
+            return
+        first, last = self.visible_thumbnail_range()
+        if first <= self.current_page <= last:
+            self.highlight_current_thumbnail()
+            return
+        total = len(self.pdf_document) * self.thumbnail_slot_height
+        self.thumbnail_canvas.yview_moveto(self.current_page * self.thumbnail_slot_height / total)
+    
+    def on_thumbnail_click(self, event):
+        """点击缩略图跳转到对应页面"""
+        if not self.pdf_document:
+            return
+        page_index = int(self.thumbnail_canvas.canvasy(event.y) // self.thumbnail_slot_height)
+        if 0 <= page_index < len(self.pdf_document) and page_index != self.current_page:
+            self.current_page = page_index
+            self.clear_selection()
+            self.update_page_display()
+            self.update_page_controls()
+    
+    def start_pdf_digest(self):
+        """在后台计算当前文档的内容哈希，完成后启用磁盘渲染缓存"""
+        self.pdf_digest = None
+        pdf_path = self.pdf_path
+        
+        def worker():
             try:
-                self.pdf_path = file_path
-                self.pdf_document = fitz.open(self.pdf_path)
-                self.current_page = 0
-                self.scale_factor = 1.0
-                self.clear_selection()
-                self.update_page_display()
-                self.update_page_controls()
-                self.status_bar.config(text=f"已加载PDF: {os.path.basename(self.pdf_path)}")
-                self.check_add_button_state()
+                digest = file_digest(pdf_path)
+            except OSError:
+                return
+            self.root.after(0, self.on_pdf_digest_ready, pdf_path, digest)
+        
+        threading.Thread(target=worker, name="pdf-digest", daemon=True).start()
+    
+    def on_pdf_digest_ready(self, pdf_path, digest):
+        """内容哈希计算完成（界面线程）"""
+        tab = self.tabs.get(pdf_path)
+        if tab is not None:
+            tab["digest"] = digest
+        if pdf_path == self.pdf_path:
+            self.pdf_digest = digest
+    
+    def render_and_cache_page(self, page_index, scale_factor, cache_key):
+        """用MuPDF渲染页面，结果写入内存缓存和磁盘缓存"""
+        img = self.render_page_image(page_index, scale_factor)
+        self.render_cache.put(cache_key, img)
+        if self.pdf_digest is not None:
+            self.disk_render_cache.put(self.pdf_digest, page_index, scale_factor, self.render_mode, img)
+        return img
+    
+    def start_text_index(self):
+        """在后台建立当前文档的全文索引"""
+        self.stop_text_index()
+        index = TextSearchIndex(self.pdf_path)
+        self.text_index = index
+        
+        def report(done, total):
+            self.root.after(0, self.on_text_index_progress, index, done, total)
+        
+        def build():
+            try:
+                index.build(progress=report)
             except Exception as e:
-                messagebox.showerror("错误", f"无法打开PDF文件: {str(e)}")
-                self.reset_pdf()
+                self.root.after(0, self.on_text_index_error, index, str(e))
+        
+        threading.Thread(target=build, name="text-index", daemon=True).start()
+    
+    def stop_text_index(self):
+        """停止建立索引并清除搜索结果"""
+        if self.text_index is not None:
+            self.text_index.cancel()
+        self.text_index = None
+        self.search_results = []
+        self.search_query = None
+        self.search_position = -1
+        self.search_label.config(text="")
+    
+    def on_text_index_progress(self, index, done, total):
+        """全文索引进度回调（界面线程）"""
+        if index is not self.text_index:
+            return
+        if index.ready:
+            source = "已从缓存加载" if index.from_cache else "已建立"
+            self.search_label.config(text=f"全文索引{source}（{total}页）")
+        else:
+            self.search_label.config(text=f"正在建立全文索引: {done}/{total}页")
+    
+    def on_text_index_error(self, index, message):
+        """建立全文索引失败的回调（界面线程）"""
+        if index is not self.text_index:
+            return
+        self.search_label.config(text=f"索引失败: {message}")
+    
+    def search_text(self, event=None):
+        """搜索文字并跳转到下一个结果，命中区域预先选中为答案"""
+        query = self.search_entry.get().strip()
+        if not query or self.text_index is None:
+            return
+        
+        # 查询变化或索引仍在建立时重新搜索，否则跳到下一个结果
+        if query != self.search_query or not self.text_index.ready:
+            position = self.search_position if query == self.search_query else -1
+            self.search_results = self.text_index.search(query)
+            self.search_query = query
+            self.search_position = position
+        
+        if not self.search_results:
+            pending = "" if self.text_index.ready else "（索引尚未完成）"
+            self.search_label.config(text=f"未找到{pending}")
+            return
+        
+        self.search_position = (self.search_position + 1) % len(self.search_results)
+        page_index, rect = self.search_results[self.search_position]
+        self.search_label.config(text=f"第{self.search_position + 1}/{len(self.search_results)}个结果")
+        self.show_search_result(page_index, rect)
+    
+    def show_search_result(self, page_index, rect):
+        """跳转到搜索结果所在页面，并选中包含结果的内容块"""
+        if page_index != self.current_page:
+            self.current_page = page_index
+            self.clear_selection()
+            self.update_page_display()
+            self.update_page_controls()
+        
+        # 优先选中包含命中文字的最小内容块（段落），否则选中命中的文字行
+        # 索引尚未建立完成时直接选中文字行
+        region = None
+        try:
+            index = self.get_layout_index()
+            blocks = [block for block in index.blocks_in(rect) if block.contains(rect)] if index else []
+            if blocks:
+                region = min(blocks, key=abs)
+        except Exception:
+            pass
+        if region is None:
+            region = fitz.Rect(rect.x0 - 2, rect.y0 - 2, rect.x1 + 2, rect.y1 + 2)
+        
+        self.set_selection_from_pdf_rect(region)
+        self.capture_selected_area()
+        self.check_add_button_state()
+    
+    def start_segmentation(self):
+        """在后台多进程分析整本文档，为编号题目生成分题草稿"""
+        if not self.pdf_document:
+            messagebox.showwarning("警告", "请先选择PDF文件")
+            return
+        if self.segmenter is not None and not self.segmenter.ready:
+            self.status_bar.config(text="正在自动分题，请稍候")
+            return
+        
+        segmenter = DocumentSegmenter(self.pdf_path)
+        self.segmenter = segmenter
+        self.segment_btn.config(state=tk.DISABLED)
+        self.status_bar.config(text=f"正在分析版面: {os.path.basename(self.pdf_path)}")
+        
+        def report(done, total):
+            self.root.after(0, lambda: self.status_bar.config(text=f"正在分析版面: {done}/{total}页"))
+        
+        def run():
+            try:
+                segmenter.run(progress=report)
+                self.root.after(0, self.on_segmentation_done, segmenter)
+            except Exception as e:
+                self.root.after(0, self.on_segmentation_error, segmenter, e)
+        
+        threading.Thread(target=run, name="segmenter", daemon=True).start()
+    
+    def on_segmentation_done(self, segmenter):
+        """自动分题完成的回调（界面线程），草稿加入审阅列表"""
+        if segmenter is not self.segmenter:
+            return
+        self.segment_btn.config(state=tk.NORMAL)
+        if not segmenter.ready:
+            return
+        for draft in segmenter.drafts:
+            draft["pdf_path"] = segmenter.pdf_path
+        # 重新分析同一文档时替换该文档尚未处理的草稿
+        self.drafts = [draft for draft in self.drafts if draft["pdf_path"] != segmenter.pdf_path]
+        self.drafts.extend(segmenter.drafts)
+        self.status_bar.config(text=f"自动分题完成: {segmenter.page_count}页中找到{len(segmenter.drafts)}道题")
+        if segmenter.drafts:
+            self.show_draft_review()
+    
+    def on_segmentation_error(self, segmenter, error):
+        """自动分题失败的回调（界面线程）"""
+        if segmenter is not self.segmenter:
+            return
+        self.segmenter = None
+        self.segment_btn.config(state=tk.NORMAL)
+        messagebox.showerror("错误", f"自动分题时出错: {str(error)}")
+    
+    def show_draft_review(self):
+        """显示分题草稿审阅窗口：可以修改问题、定位到原文、删除，确认后再提交"""
+        if self.draft_window is not None:
+            self.refresh_draft_list()
+            self.draft_window.lift()
+            return
+        
+        window = tk.Toplevel(self.root)
+        window.title("分题草稿")
+        window.geometry("640x480")
+        window.protocol("WM_DELETE_WINDOW", self.close_draft_review)
+        self.draft_window = window
+        
+        list_frame = tk.Frame(window)
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=(10, 5))
+        scrollbar = tk.Scrollbar(list_frame)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.draft_listbox = tk.Listbox(list_frame, selectmode=tk.EXTENDED, yscrollcommand=scrollbar.set)
+        self.draft_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.config(command=self.draft_listbox.yview)
+        self.draft_listbox.bind("<<ListboxSelect>>", self.on_draft_select)
+        self.draft_listbox.bind("<Double-Button-1>", self.show_selected_draft)
+        
+        # 修改选中草稿的问题
+        edit_frame = tk.Frame(window)
+        edit_frame.pack(fill=tk.X, padx=10)
+        tk.Label(edit_frame, text="问题:").pack(side=tk.LEFT)
+        self.draft_question_entry = tk.Entry(edit_frame)
+        self.draft_question_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.draft_question_entry.bind("<Return>", self.update_draft_question)
+        tk.Button(edit_frame, text="修改", command=self.update_draft_question).pack(side=tk.LEFT)
+        
+        button_frame = tk.Frame(window)
+        button_frame.pack(fill=tk.X, padx=10, pady=10)
+        tk.Button(button_frame, text="定位", command=self.show_selected_draft).pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="删除", command=self.delete_selected_drafts).pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="全部接受", command=lambda: self.accept_drafts(all_drafts=True)).pack(
+            side=tk.RIGHT, padx=5
+        )
+        tk.Button(button_frame, text="接受所选", command=self.accept_drafts).pack(side=tk.RIGHT, padx=5)
+        
+        self.refresh_draft_list()
+    
+    def refresh_draft_list(self):
+        """按草稿列表重新填充审阅窗口"""
+        self.draft_window.title(f"分题草稿（{len(self.drafts)}道）")
+        self.draft_listbox.delete(0, tk.END)
+        for draft in self.drafts:
+            self.draft_listbox.insert(
+                tk.END, f"{os.path.basename(draft['pdf_path'])} 第{draft['page_index'] + 1}页  {draft['question']}"
+            )
+    
+    def close_draft_review(self):
+        """关闭审阅窗口，未处理的草稿保留，下次自动分题时一并显示"""
+        if self.draft_window is not None:
+            self.draft_window.destroy()
+        self.draft_window = None
+    
+    def selected_draft_indices(self):
+        """返回审阅列表中选中的草稿序号"""
+        return [int(index) for index in self.draft_listbox.curselection()]
+    
+    def on_draft_select(self, event=None):
+        """选中草稿时在编辑框中显示其问题"""
+        indices = self.selected_draft_indices()
+        self.draft_question_entry.delete(0, tk.END)
+        if len(indices) == 1:
+            self.draft_question_entry.insert(0, self.drafts[indices[0]]["question"])
+    
+    def update_draft_question(self, event=None):
+        """用编辑框中的文字替换选中草稿的问题"""
+        indices = self.selected_draft_indices()
+        question = self.draft_question_entry.get().strip()
+        if len(indices) != 1 or not question:
+            return
+        self.drafts[indices[0]]["question"] = question
+        self.refresh_draft_list()
+        self.draft_listbox.selection_set(indices[0])
+        self.draft_listbox.see(indices[0])
+    
+    def show_selected_draft(self, event=None):
+        """跳转到选中草稿所在页面，选中其答案区域并填入问题，可以在主窗口中调整后手动添加"""
+        indices = self.selected_draft_indices()
+        if not indices:
+            return
+        draft = self.drafts[indices[0]]
+        if draft["pdf_path"] != self.pdf_path:
+            if draft["pdf_path"] not in self.tabs:
+                self.status_bar.config(text="草稿所在的文档已关闭")
+                return
+            self.switch_to_tab(draft["pdf_path"])
+        if draft["page_index"] != self.current_page:
+            self.current_page = draft["page_index"]
+            self.clear_selection()
+            self.update_page_display()
+            self.update_page_controls()
+        
+        self.set_selection_from_pdf_rect(fitz.Rect(draft["clip"]))
+        self.capture_selected_area()
+        self.question_entry.delete(0, tk.END)
+        self.question_entry.insert(0, draft["question"])
+        self.check_add_button_state()
+    
+    def delete_selected_drafts(self):
+        """删除选中的草稿"""
+        indices = set(self.selected_draft_indices())
+        self.drafts = [draft for index, draft in enumerate(self.drafts) if index not in indices]
+        self.refresh_draft_list()
+    
+    def accept_drafts(self, all_drafts=False):
+        """将选中（或全部）草稿按与添加到Anki相同的流程截图并提交"""
+        indices = set(range(len(self.drafts)) if all_drafts else self.selected_draft_indices())
+        if not indices:
+            return
+        accepted = [draft for index, draft in enumerate(self.drafts) if index in indices]
+        try:
+            cards = [
+                self.make_region_card(draft["question"], draft["pdf_path"], draft["page_index"], draft["clip"])
+                for draft in accepted
+            ]
+            self.submit_cards(cards)
+        except Exception as e:
+            messagebox.showerror("错误", f"提交草稿时出错: {str(e)}")
+            return
+        
+        self.drafts = [draft for index, draft in enumerate(self.drafts) if index not in indices]
+        self.refresh_draft_list()
+        self.status_bar.config(text=f"正在提交{len(cards)}张分题卡片...")
+    
+    def apply_memory_profile(self):
+        """根据文档规模调整渲染缓存和预取范围，大文档使用更小的内存预算"""
+        large = (
+            len(self.pdf_document) > LARGE_DOCUMENT_PAGES
+            or os.path.getsize(self.pdf_path) > LARGE_DOCUMENT_BYTES
+        )
+        self.large_document_mode = large
+        self.render_cache.set_max_bytes(96 * 1024 * 1024 if large else self.render_cache_limit)
+        # 大文档不预取相邻页面，渲染缓存中只保留实际看过的页面
+        self.prefetch_window = 0 if large else self.default_prefetch_window
     
     def reset_pdf(self):
         """重置PDF相关状态"""
+        self.cancel_refine_render()
+        self.stop_text_index()
+        self.stop_thumbnails()
+        self.prefetcher.cancel()
+        self._prefetch_context = None
+        self.pdf_digest = None
+        self.stop_tiles()
+        self.tile_cache.clear()
         self.pdf_path = None
         self.pdf_document = None
         self.current_page = 0
@@ -190,6 +3348,7 @@ class PDFAnkiTool:
         if self.pdf_document:
             total_pages = len(self.pdf_document)
             self.page_label.config(text=f"页码: {self.current_page + 1}/{total_pages}")
+            self.scroll_thumbnail_into_view()
             self.prev_page_btn.config(state=tk.NORMAL if self.current_page > 0 else tk.DISABLED)
             self.next_page_btn.config(state=tk.NORMAL if self.current_page < total_pages - 1 else tk.DISABLED)
             self.zoom_in_btn.config(state=tk.NORMAL)
@@ -205,16 +3364,61 @@ class PDFAnkiTool:
     
     def update_page_display(self):
         """更新当前页面显示"""
-        if not self.pdf_document:
-            return
-        
-        try:
+        with tracer.span("update_page_display", page=self.current_page, scale=self.scale_factor):
+            if not self.pdf_document:
+                return
+            
+            # 取消尚未执行的清晰化渲染，避免渲染过期的缩放比例
+            self.cancel_refine_render()
+            
+            # 缩放比例或文档改变时，丢弃所有过期的预取任务
+            prefetch_context = (self.pdf_path, PageRenderCache.zoom_bucket(self.scale_factor))
+            if prefetch_context != self._prefetch_context:
+                self.prefetcher.cancel()
+                self._prefetch_context = prefetch_context
+            
+            # 开启吸附时提前在工作进程中建立内容块索引，鼠标悬停时不必等待
+            self.request_layout_index()
+            
+            try:
+                if self.should_tile():
+                    self.show_tiled_page()
+                    return
+            
+                # 优先使用缓存的渲染结果，只有未命中时才重新渲染
+                cache_key = self.render_cache.make_key(self.pdf_path, self.current_page, self.scale_factor)
+                img = self.render_cache.get(cache_key)
+                if img is None and self.pdf_digest is not None:
+                    # 内存未命中时再查磁盘缓存，之前会话渲染过的页面不必重新光栅化
+                    img = self.disk_render_cache.get(
+                        self.pdf_digest, self.current_page, self.scale_factor, self.render_mode
+                    )
+                    if img is not None:
+                        self.render_cache.put(cache_key, img)
+                if img is None:
+                    preview = None
+                    if self.progressive_render:
+                        preview = self.render_preview_image(self.current_page, self.scale_factor)
+                    if preview is not None:
+                        # 先显示低分辨率画面，稍后再换上清晰渲染
+                        img = preview
+                        self._refine_job = self.root.after(self.refine_delay_ms, self.refine_page_display)
+                    else:
+                        img = self.render_and_cache_page(self.current_page, self.scale_factor, cache_key)
+            
+                self.show_page_image(img)
+                if self._refine_job is None:
+                    self.schedule_prefetch()
+            
+            except Exception as e:
+                self.status_bar.config(text=f"更新页面显示时出错: {str(e)}")
+    
+    def show_page_image(self, img):
+        """在画布上显示页面图像"""
+        with tracer.span("show_page_image"):
             # 清除画布
             self.canvas.delete("all")
-            
-            # 获取当前页并渲染为图片
-            page = self.pdf_document[self.current_page]
-            pix = page.get_pixmap()
+            self.stop_tiles()
             
             # 获取画布实际大小
             self.canvas.update_idletasks()
@@ -225,18 +3429,16 @@ class PDFAnkiTool:
                 canvas_width = 800
                 canvas_height = 600
             
-            # 计算缩放后的尺寸
-            display_width = int(pix.width * self.scale_factor)
-            display_height = int(pix.height * self.scale_factor)
-            
-            # 转换为PIL图像
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            display_width, display_height = img.width, img.height
+            self.display_size = (display_width, display_height)
+            page_rect = self.pdf_document[self.current_page].rect
+            self.display_scale = display_width / page_rect.width if page_rect.width else self.scale_factor
             
-            # 如果需要，调整图像大小
-            if self.scale_factor != 1.0:
-                img = img.resize((display_width, display_height), Image.LANCZOS)
+            # 画布已清空，悬停高亮需要重新绘制
+            self.hover_block = None
             
             # 创建photoimage对象
+            self.display_image = img
             self.tk_image = ImageTk.PhotoImage(image=img)
             
             # 重置画布偏移量
@@ -249,7 +3451,7 @@ class PDFAnkiTool:
             
             # 在画布上显示图像
             self.canvas_image = self.canvas.create_image(
-                x_offset, y_offset, anchor=tk.NW, image=self.tk_image
+                x_offset, y_offset, anchor=tk.NW, image=self.tk_image, tags="page"
             )
             
             # 更新缩放标签
@@ -258,18 +3460,206 @@ class PDFAnkiTool:
             # 重新绘制选择区域（如果存在）
             if self.selection_start and self.selection_end:
                 self.draw_selection_rect()
-            
+    
+    def page_display_size(self, scale_factor):
+        """页面按指定比例显示时的像素尺寸"""
+        page_rect = self.pdf_document[self.current_page].rect
+        return (
+            max(1, int(round(page_rect.width * scale_factor))),
+            max(1, int(round(page_rect.height * scale_factor))),
+        )
+    
+    def should_tile(self):
+        """整页图像过大且远大于视口时改为分块显示"""
+        width, height = self.page_display_size(self.scale_factor)
+        canvas_pixels = max(1, self.canvas.winfo_width()) * max(1, self.canvas.winfo_height())
+        return width * height > max(self.tile_threshold_pixels, 3 * canvas_pixels)
+    
+    def show_tiled_page(self):
+        """分块显示当前页面：只放置页面锚点，图块按视口按需渲染"""
+        self.canvas.delete("all")
+        self.stop_tiles()
+        self.hover_block = None
+        self.display_image = None
+        self.tk_image = None
+        self.tiled = True
+        
+        self.canvas.update_idletasks()
+        canvas_width = max(1, self.canvas.winfo_width())
+        canvas_height = max(1, self.canvas.winfo_height())
+        
+        # 图块按显示比例直接光栅化，坐标换算使用同一个比例
+        self.display_scale = self.scale_factor
+        self.display_size = self.page_display_size(self.scale_factor)
+        self.canvas_offset_x = 0
+        self.canvas_offset_y = 0
+        
+        x_offset = max(0, (canvas_width - self.display_size[0]) // 2)
+        y_offset = max(0, (canvas_height - self.display_size[1]) // 2)
+        self.canvas_image = self.canvas.create_image(x_offset, y_offset, anchor=tk.NW, tags="page")
+        
+        self.zoom_label.config(text=f"{int(self.scale_factor * 100)}%")
+        self.update_tiles()
+        
+        if self.selection_start and self.selection_end:
+            self.draw_selection_rect()
+    
+    def stop_tiles(self):
+        """退出分块显示，释放画布上的图块"""
+        if self._tile_job is not None:
+            self.root.after_cancel(self._tile_job)
+            self._tile_job = None
+        self._tile_queue = []
+        self.canvas.delete("tile")
+        self.tile_items = {}
+        self.tiled = False
+    
+    def update_tiles(self):
+        """按当前视口放置图块：可见图块立即渲染，视口外一圈的图块空闲时再渲染"""
+        if not self.tiled or not self.canvas_image:
+            return
+        
+        tile_size = self.tile_cache.tile_size
+        img_x, img_y = self.canvas.coords(self.canvas_image)
+        view_x0 = max(0, -img_x)
+        view_y0 = max(0, -img_y)
+        view_x1 = min(self.display_size[0], self.canvas.winfo_width() - img_x)
+        view_y1 = min(self.display_size[1], self.canvas.winfo_height() - img_y)
+        if view_x1 <= view_x0 or view_y1 <= view_y0:
+            return
+        
+        columns = (self.display_size[0] - 1) // tile_size
+        rows = (self.display_size[1] - 1) // tile_size
+        first_col, last_col = int(view_x0 // tile_size), int((view_x1 - 1) // tile_size)
+        first_row, last_row = int(view_y0 // tile_size), int((view_y1 - 1) // tile_size)
+        visible = {(c, r) for c in range(first_col, last_col + 1) for r in range(first_row, last_row + 1)}
+        wanted = {
+            (c, r)
+            for c in range(max(0, first_col - self.tile_margin), min(columns, last_col + self.tile_margin) + 1)
+            for r in range(max(0, first_row - self.tile_margin), min(rows, last_row + self.tile_margin) + 1)
+        }
+        
+        # 离开视口范围的图块立即从画布移除
+        for tile in [t for t in self.tile_items if t not in wanted]:
+            item_id, _ = self.tile_items.pop(tile)
+            self.canvas.delete(item_id)
+        
+        center = ((first_col + last_col) // 2, (first_row + last_row) // 2)
+        for tile in sorted(visible, key=lambda t: abs(t[0] - center[0]) + abs(t[1] - center[1])):
+            if tile not in self.tile_items:
+                self.place_tile(tile)
+        
+        self._tile_queue = sorted(
+            (t for t in wanted if t not in self.tile_items),
+            key=lambda t: abs(t[0] - center[0]) + abs(t[1] - center[1])
+        )
+        if self._tile_queue and self._tile_job is None:
+            self._tile_job = self.root.after(1, self.render_queued_tile)
+        
+        self.tile_cache.evict(self.pdf_path, self.current_page, self.scale_factor, center)
+        self.canvas.tag_raise("selection")
+        self.canvas.tag_raise("hover")
+    
+    def render_queued_tile(self):
+        """每次只渲染一个视口外的图块，避免阻塞输入"""
+        self._tile_job = None
+        while self._tile_queue:
+            tile = self._tile_queue.pop(0)
+            if tile not in self.tile_items:
+                self.place_tile(tile)
+                break
+        if self._tile_queue:
+            self._tile_job = self.root.after(1, self.render_queued_tile)
+    
+    def place_tile(self, tile):
+        """渲染（或从缓存读取）一个图块并放到画布上"""
+        column, row = tile
+        key = self.tile_cache.make_key(self.pdf_path, self.current_page, self.scale_factor, column, row)
+        img = self.tile_cache.get(key)
+        if img is None:
+            img = render_tile(
+                self.pdf_document[self.current_page], self.scale_factor,
+                column, row, self.tile_cache.tile_size
+            )
+            self.tile_cache.put(key, img)
+        
+        photo = ImageTk.PhotoImage(image=img)
+        img_x, img_y = self.canvas.coords(self.canvas_image)
+        item_id = self.canvas.create_image(
+            img_x + column * self.tile_cache.tile_size, img_y + row * self.tile_cache.tile_size,
+            anchor=tk.NW, image=photo, tags=("page", "tile")
+        )
+        self.canvas.tag_lower(item_id)
+        self.tile_items[tile] = (item_id, photo)
+    
+    def refine_page_display(self):
+        """渲染当前缩放比例下的清晰图像并替换低分辨率画面"""
+        self._refine_job = None
+        if not self.pdf_document:
+            return
+        
+        try:
+            cache_key = self.render_cache.make_key(self.pdf_path, self.current_page, self.scale_factor)
+            img = self.render_and_cache_page(self.current_page, self.scale_factor, cache_key)
+            self.show_page_image(img)
+            self.schedule_prefetch()
         except Exception as e:
             self.status_bar.config(text=f"更新页面显示时出错: {str(e)}")
     
+    def schedule_prefetch(self):
+        """在后台预取当前页附近的页面"""
+        if not self.pdf_document or self.prefetch_window <= 0 or self.tiled:
+            return
+        self.prefetcher.window = self.prefetch_window
+        self.prefetcher.schedule(
+            self.pdf_path, self.current_page, len(self.pdf_document),
+            self.scale_factor, self.render_mode
+        )
+    
+    def cancel_refine_render(self):
+        """取消等待中的清晰化渲染"""
+        if self._refine_job is not None:
+            self.root.after_cancel(self._refine_job)
+            self._refine_job = None
+    
+    def render_page_image(self, page_index, scale_factor):
+        """将指定页面渲染为缩放后的PIL图像"""
+        return render_page(self.pdf_document[page_index], scale_factor, self.render_mode)
+    
+    def render_preview_image(self, page_index, scale_factor):
+        """生成用于立即显示的低分辨率画面，页面较小时返回None直接清晰渲染"""
+        page = self.pdf_document[page_index]
+        if self.render_mode == "matrix":
+            target = (page.rect * fitz.Matrix(scale_factor, scale_factor)).irect
+            target_size = (max(1, target.width), max(1, target.height))
+        else:
+            target_size = (
+                max(1, int(page.rect.width * scale_factor)),
+                max(1, int(page.rect.height * scale_factor)),
+            )
+        
+        if target_size[0] * target_size[1] <= self.preview_min_pixels:
+            return None
+        
+        # 如果缓存中有该页其他缩放比例的渲染结果，直接缩放使用
+        nearby = self.render_cache.find_nearest(self.pdf_path, page_index, scale_factor)
+        if nearby is not None:
+            return nearby.resize(target_size, Image.BILINEAR)
+        
+        # 否则以较低分辨率快速渲染后放大
+        low_scale = max(0.1, scale_factor * self.preview_ratio)
+        pix = page.get_pixmap(matrix=fitz.Matrix(low_scale, low_scale), alpha=False)
+        low = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        return low.resize(target_size, Image.NEAREST)
+    
     def fit_to_page(self):
         """适应页面大小"""
         if not self.pdf_document:
             return
         
         try:
-            page = self.pdf_document[self.current_page]
-            pix = page.get_pixmap()
+            # 只需要页面尺寸，无需渲染
+            page_rect = self.pdf_document[self.current_page].rect
             
             self.canvas.update_idletasks()
             canvas_width = self.canvas.winfo_width()
@@ -279,8 +3669,8 @@ class PDFAnkiTool:
                 return
             
             # 计算适应缩放比例
-            scale_x = canvas_width / pix.width
-            scale_y = canvas_height / pix.height
+            scale_x = canvas_width / page_rect.width
+            scale_y = canvas_height / page_rect.height
             self.scale_factor = min(scale_x, scale_y) * 0.95  # 留5%边距
             
             self.update_page_display()
@@ -301,15 +3691,38 @@ class PDFAnkiTool:
             self.update_page_display()
     
     def on_mouse_wheel(self, event):
-        """鼠标滚轮缩放"""
+        """鼠标滚轮缩放：每帧先缩放已有画面，滚动停止后再重新渲染"""
         if not self.pdf_document:
             return
         
         # 根据滚轮方向调整缩放
         if event.delta > 0:
-            self.zoom_in()
+            if self.scale_factor >= 3.0:
+                return
+            self.scale_factor *= 1.2
         else:
-            self.zoom_out()
+            if self.scale_factor <= 0.2:
+                return
+            self.scale_factor /= 1.2
+        
+        self.cancel_refine_render()
+        self.interaction.request("zoom", self.preview_zoom)
+        self.interaction.debounce("render", self.rerender_delay_ms, self.update_page_display)
+    
+    def preview_zoom(self):
+        """将已渲染的画面缩放到当前比例显示，不调用MuPDF"""
+        if not self.pdf_document:
+            return
+        # 从缓存中最接近的清晰渲染缩放，避免对已缩放的画面反复缩放导致模糊
+        if self.should_tile():
+            # 分块显示时不生成整页的预览，等输入停止后直接渲染可见图块
+            return
+        base = self.render_cache.find_nearest(self.pdf_path, self.current_page, self.scale_factor)
+        if base is None:
+            base = self.display_image
+        if base is None:
+            return
+        self.show_page_image(base.resize(self.page_display_size(self.scale_factor), Image.BILINEAR))
     
     def prev_page(self):
         """显示上一页"""
@@ -332,6 +3745,9 @@ class PDFAnkiTool:
         if not self.pdf_document:
             return
         
+        self.canvas.delete("hover")
+        self.hover_block = None
+        
         # 检查是否点击在现有选择区域内
         if self.selection_start and self.selection_end:
             x1, y1 = self.selection_start
@@ -370,12 +3786,12 @@ class PDFAnkiTool:
                 self.selection_start = (self.selection_start[0] + dx, self.selection_start[1] + dy)
                 self.selection_end = (self.selection_end[0] + dx, self.selection_end[1] + dy)
                 self.drag_start = (event.x, event.y)
-                self.draw_selection_rect()
+                self.interaction.request("selection", self.draw_selection_rect)
                 
         elif self.is_selecting:
             # 更新选择区域
             self.selection_end = (event.x, event.y)
-            self.draw_selection_rect()
+            self.interaction.request("selection", self.draw_selection_rect)
     
     def on_mouse_up(self, event):
         """鼠标释放事件"""
@@ -386,10 +3802,18 @@ class PDFAnkiTool:
                 x1, y1 = self.selection_start
                 x2, y2 = self.selection_end
                 
-                # 如果选择区域太小，清除选择
+                # 如果选择区域太小，视为单击：开启吸附时选中光标下的内容块，否则清除选择
                 if abs(x2 - x1) < 5 or abs(y2 - y1) < 5:
-                    self.clear_selection()
+                    block = self.block_at_canvas(event.x, event.y) if self.snap_var.get() else None
+                    if block is not None:
+                        self.set_selection_from_pdf_rect(block)
+                        self.capture_selected_area()
+                        self.status_bar.config(text="已选中内容块，右键或点击'清除选择'可重新选择")
+                    else:
+                        self.clear_selection()
                 else:
+                    if self.snap_var.get():
+                        self.snap_selection()
                     self.capture_selected_area()
                     self.status_bar.config(text="已选择区域，右键或点击'清除选择'可重新选择")
         
@@ -402,6 +3826,119 @@ class PDFAnkiTool:
         
         self.check_add_button_state()
     
+    def on_mouse_move(self, event):
+        """鼠标移动事件：开启吸附时高亮光标下的内容块，每帧最多查询一次"""
+        self._hover_point = (event.x, event.y)
+        self.interaction.request("hover", self.update_hover)
+    
+    def update_hover(self):
+        """按最近一次的光标位置更新悬停高亮"""
+        if not self.pdf_document or not self.snap_var.get() or self.is_selecting or self.is_dragging:
+            if self.hover_block is not None:
+                self.hover_block = None
+                self.canvas.delete("hover")
+            return
+        
+        block = self.block_at_canvas(*self._hover_point)
+        if block == self.hover_block:
+            return
+        self.hover_block = block
+        if block is None:
+            self.canvas.delete("hover")
+            return
+        
+        x0, y0 = self.pdf_to_canvas(block.x0, block.y0)
+        x1, y1 = self.pdf_to_canvas(block.x1, block.y1)
+        if self.canvas.find_withtag("hover"):
+            self.canvas.coords("hover", x0, y0, x1, y1)
+        else:
+            self.canvas.create_rectangle(x0, y0, x1, y1, outline="orange", dash=(4, 2), tags="hover")
+    
+    def get_layout_index(self):
+        """获取当前页面的内容块索引，尚未建立完成时返回None并在后台开始建立"""
+        key = (self.pdf_path, self.current_page)
+        index = self.layout_indexes.get(key)
+        if index is None:
+            self.request_layout_index(force=True)
+        else:
+            self.layout_indexes.move_to_end(key)
+        return index
+    
+    def request_layout_index(self, force=False):
+        """在工作进程中建立当前页面的内容块索引
+        
+        提取文字块和聚合矢量图形（cluster_drawings）在复杂页面上需要较长时间，不在界面线程中进行。
+        未开启吸附时只有force=True（例如跳转到搜索结果）才建立。
+        """
+        if not self.pdf_document or not (force or self.snap_var.get()):
+            return
+        key = (self.pdf_path, self.current_page)
+        if key in self.layout_indexes or key in self._layout_requests:
+            return
+        self._layout_requests.add(key)
+        future = submit_traced(self.render_pool, layout_rects_in_worker, *key)
+        future.add_done_callback(lambda f: self.root.after(0, self.on_layout_index_ready, key, f))
+    
+    def on_layout_index_ready(self, key, future):
+        """内容块索引建立完成的回调（界面线程）"""
+        self._layout_requests.discard(key)
+        try:
+            rects = future.result()
+        except Exception:
+            # 建立失败时该页不吸附，下次显示该页时重试
+            return
+        self.layout_indexes[key] = PageLayoutIndex(rects)
+        while len(self.layout_indexes) > self.layout_index_limit:
+            self.layout_indexes.popitem(last=False)
+        # 光标停在该页上时立即显示悬停高亮
+        if key == (self.pdf_path, self.current_page) and self._hover_point is not None:
+            self.update_hover()
+    
+    def canvas_to_pdf(self, x, y):
+        """画布坐标转换为PDF页面坐标"""
+        img_x, img_y = self.canvas.coords(self.canvas_image)
+        return (x - img_x) / self.display_scale, (y - img_y) / self.display_scale
+    
+    def pdf_to_canvas(self, x, y):
+        """PDF页面坐标转换为画布坐标"""
+        img_x, img_y = self.canvas.coords(self.canvas_image)
+        return img_x + x * self.display_scale, img_y + y * self.display_scale
+    
+    def block_at_canvas(self, x, y):
+        """返回画布坐标处的内容块（PDF坐标），没有时返回None"""
+        if not self.canvas_image:
+            return None
+        index = self.get_layout_index()
+        if index is None:
+            return None
+        try:
+            return index.block_at(*self.canvas_to_pdf(x, y))
+        except Exception:
+            return None
+    
+    def set_selection_from_pdf_rect(self, rect):
+        """按PDF坐标设置选择区域"""
+        self.selection_start = self.pdf_to_canvas(rect.x0, rect.y0)
+        self.selection_end = self.pdf_to_canvas(rect.x1, rect.y1)
+        self.draw_selection_rect()
+    
+    def snap_selection(self):
+        """将当前选择区域吸附到内容块边界"""
+        if not self.canvas_image or not self.selection_start or not self.selection_end:
+            return
+        x0, y0 = self.canvas_to_pdf(*self.selection_start)
+        x1, y1 = self.canvas_to_pdf(*self.selection_end)
+        index = self.get_layout_index()
+        if index is None:
+            # 索引尚未建立完成，保留原选择区域
+            return
+        try:
+            snapped = index.snap(fitz.Rect(x0, y0, x1, y1).normalize())
+        except Exception:
+            return
+        if snapped is not None:
+            self.set_selection_from_pdf_rect(snapped)
+    
     def on_right_mouse_down(self, event):
         """右键按下事件"""
         if not self.pdf_document:
@@ -418,26 +3955,39 @@ class PDFAnkiTool:
         if not self.is_panning or not self.pan_start:
             return
         
-        # 计算移动距离
+        # 累计移动距离，下一帧统一移动
         dx = event.x - self.pan_start[0]
         dy = event.y - self.pan_start[1]
-        
-        # 移动画布上的图像
-        if self.canvas_image:
-            self.canvas.move(self.canvas_image, dx, dy)
-            # 更新偏移量
-            self.canvas_offset_x += dx
-            self.canvas_offset_y += dy
-            
-            # 如果有选择区域，也一起移动
-            if self.selection_start and self.selection_end:
-                self.selection_start = (self.selection_start[0] + dx, self.selection_start[1] + dy)
-                self.selection_end = (self.selection_end[0] + dx, self.selection_end[1] + dy)
-                self.draw_selection_rect()
+        self._pan_delta = (self._pan_delta[0] + dx, self._pan_delta[1] + dy)
+        self.interaction.request("pan", self.apply_pan)
         
         # 更新拖动起点
         self.pan_start = (event.x, event.y)
     
+    def apply_pan(self):
+        """把累计的平移距离应用到画布元素上"""
+        dx, dy = self._pan_delta
+        self._pan_delta = (0, 0)
+        if not self.canvas_image or (dx == 0 and dy == 0):
+            return
+        
+        # 移动画布上的图像（分块显示时包括全部图块）
+        self.canvas.move("page", dx, dy)
+        # 更新偏移量
+        self.canvas_offset_x += dx
+        self.canvas_offset_y += dy
+        
+        # 如果有选择区域，也一起移动
+        if self.selection_start and self.selection_end:
+            self.selection_start = (self.selection_start[0] + dx, self.selection_start[1] + dy)
+            self.selection_end = (self.selection_end[0] + dx, self.selection_end[1] + dy)
+            self.canvas.move("selection", dx, dy)
+        self.canvas.move("hover", dx, dy)
+        
+        # 分块显示时补上新露出的图块
+        if self.tiled:
+            self.update_tiles()
+    
     def on_right_mouse_up(self, event):
         """右键释放事件"""
         if self.is_panning:
@@ -451,24 +4001,27 @@ class PDFAnkiTool:
         if not self.selection_start or not self.selection_end:
             return
         
-        # 删除旧的选择矩形
-        self.canvas.delete("selection")
-        
         x1, y1 = self.selection_start
         x2, y2 = self.selection_end
         
+        # 选择矩形已存在时只更新坐标，不重新创建
+        if self.canvas.find_withtag("selection"):
+            self.canvas.coords("selection_fill", x1, y1, x2, y2)
+            self.canvas.coords("selection_border", x1, y1, x2, y2)
+            return
+        
         # 绘制半透明填充
         self.canvas.create_rectangle(
             x1, y1, x2, y2,
             fill="lightblue", stipple="gray25",
-            tags="selection"
+            tags=("selection", "selection_fill")
         )
         
         # 绘制边框
         self.canvas.create_rectangle(
             x1, y1, x2, y2,
             outline="blue", width=2,
-            tags="selection"
+            tags=("selection", "selection_border")
         )
         
         # 确保选择矩形在最上层
@@ -481,11 +4034,14 @@ class PDFAnkiTool:
         self.is_selecting = False
         self.is_dragging = False
         self.drag_start = None
-        self.screenshot = None
-        self.screenshot_path = None
+        self.selection_pdf_rect = None
+        self.preview_image = None
+        self.preview_label.config(image="")
         # 重置右键拖动状态
         self.is_panning = False
         self.pan_start = None
+        self._pan_delta = (0, 0)
+        self.interaction.cancel("pan")
         self.canvas_offset_x = 0
         self.canvas_offset_y = 0
         self.canvas.delete("selection")
@@ -494,114 +4050,133 @@ class PDFAnkiTool:
         self.check_add_button_state()
     
     def capture_selected_area(self):
-        """截取选中的PDF区域并保存到本地"""
-        if not self.selection_start or not self.selection_end or not self.pdf_document:
-            return
+        """记录选中区域在PDF坐标系中的位置，并从屏幕图像中裁剪预览
         
-        try:
-            # 获取画布上的图像位置
-            if not self.canvas_image:
+        高分辨率图像不在这里渲染，而是在卡片提交时由后台线程直接在原页面上裁剪渲染。
+        """
+        with tracer.span("capture_selected_area"):
+            if not self.selection_start or not self.selection_end or not self.pdf_document:
                 return
             
-            canvas_coords = self.canvas.coords(self.canvas_image)
-            if not canvas_coords:
-                return
-            
-            img_x, img_y = canvas_coords
-            
-            # 转换为相对于图像的坐标
-            x1, y1 = self.selection_start
-            x2, y2 = self.selection_end
-            
-            # 确保坐标在图像范围内
-            x1 = max(img_x, min(x1, img_x + self.tk_image.width()))
-            y1 = max(img_y, min(y1, img_y + self.tk_image.height()))
-            x2 = max(img_x, min(x2, img_x + self.tk_image.width()))
-            y2 = max(img_y, min(y2, img_y + self.tk_image.height()))
-            
-            # 转换为相对于图像的坐标
-            rel_x1 = (x1 - img_x) / self.scale_factor
-            rel_y1 = (y1 - img_y) / self.scale_factor
-            rel_x2 = (x2 - img_x) / self.scale_factor
-            rel_y2 = (y2 - img_y) / self.scale_factor
+            try:
+                # 获取画布上的图像位置
+                if not self.canvas_image:
+                    return
             
-            # 确保坐标有序
-            min_x, max_x = min(rel_x1, rel_x2), max(rel_x1, rel_x2)
-            min_y, max_y = min(rel_y1, rel_y2), max(rel_y1, rel_y2)
+                canvas_coords = self.canvas.coords(self.canvas_image)
+                if not canvas_coords:
+                    return
             
-            # 检查选择区域是否有效
-            if max_x - min_x < 1 or max_y - min_y < 1:
-                self.status_bar.config(text="选择区域太小")
-                return
+                img_x, img_y = canvas_coords
             
-            # 获取PDF页面
-            page = self.pdf_document[self.current_page]
+                # 转换为相对于图像的坐标
+                x1, y1 = self.selection_start
+                x2, y2 = self.selection_end
             
-            # 创建裁剪区域
-            clip_rect = fitz.Rect(min_x, min_y, max_x, max_y)
+                # 确保坐标在图像范围内
+                display_width, display_height = self.display_size
+                x1 = max(img_x, min(x1, img_x + display_width))
+                y1 = max(img_y, min(y1, img_y + display_height))
+                x2 = max(img_x, min(x2, img_x + display_width))
+                y2 = max(img_y, min(y2, img_y + display_height))
             
-            # 创建新页面并裁剪
-            new_page = fitz.open()
-            new_page.new_page(width=clip_rect.width, height=clip_rect.height)
-            new_page[0].show_pdf_page(
-                fitz.Rect(0, 0, clip_rect.width, clip_rect.height),
-                self.pdf_document, self.current_page, clip=clip_rect
-            )
+                # 转换为相对于图像的坐标
+                rel_x1 = (x1 - img_x) / self.display_scale
+                rel_y1 = (y1 - img_y) / self.display_scale
+                rel_x2 = (x2 - img_x) / self.display_scale
+                rel_y2 = (y2 - img_y) / self.display_scale
             
-            # 渲染为图像，使用高DPI提升清晰度
-            pix = new_page[0].get_pixmap(dpi=300)  # 使用300 DPI提高图像质量
-            self.screenshot = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+                # 确保坐标有序
+                min_x, max_x = min(rel_x1, rel_x2), max(rel_x1, rel_x2)
+                min_y, max_y = min(rel_y1, rel_y2), max(rel_y1, rel_y2)
             
-            new_page.close()
+                # 检查选择区域是否有效
+                if max_x - min_x < 1 or max_y - min_y < 1:
+                    self.status_bar.config(text="选择区域太小")
+                    self.selection_pdf_rect = None
+                    return
             
-            # 确定图片存储路径
-            if self.custom_image_path:
-                # 使用自定义路径
-                images_dir = self.custom_image_path
-            else:
-                # 使用默认路径：PDF所在目录下的images文件夹
-                images_dir = os.path.join(os.path.dirname(self.pdf_path), "images")
+                # 选择区域保存为PDF坐标，提交时再按capture_policy确定的DPI渲染
+                self.selection_pdf_rect = fitz.Rect(min_x, min_y, max_x, max_y)
             
-            # 创建文件夹（如果不存在）
-            os.makedirs(images_dir, exist_ok=True)
+                if self.display_image is not None:
+                    # 预览直接从屏幕上已显示的图像中裁剪
+                    preview = self.display_image.crop((
+                        int(min(x1, x2) - img_x), int(min(y1, y2) - img_y),
+                        int(max(x1, x2) - img_x), int(max(y1, y2) - img_y)
+                    ))
+                else:
+                    # 分块显示时没有整页图像，按预览尺寸单独渲染
+                    preview_dpi = 72 * min(160 / (max_x - min_x), 48 / (max_y - min_y))
+                    preview = render_clip(
+                        self.pdf_document[self.current_page], self.selection_pdf_rect, dpi=max(1, preview_dpi)
+                    )
+                preview.thumbnail((160, 48))
+                self.preview_image = ImageTk.PhotoImage(image=preview)
+                self.preview_label.config(image=self.preview_image)
             
-            # 生成图片文件名：PDF文件名 + 时间戳
-            pdf_name = os.path.splitext(os.path.basename(self.pdf_path))[0]
-            import time
-            timestamp = time.strftime("%Y%m%d_%H%M%S")
-            img_filename = f"{pdf_name}_{timestamp}.png"
-            img_path = os.path.join(images_dir, img_filename)
-            
-            # 根据用户设置决定是否保存图片到本地
-            if self.save_image_locally:
-                # 保存图片到本地
-                self.screenshot.save(img_path, "PNG")
-                self.screenshot_path = img_path  # 保存图片路径
-                
-                # 显示保存路径信息
-                path_info = f"自定义路径: {self.custom_image_path}" if self.custom_image_path else f"默认路径"
-                self.status_bar.config(text=f"已截取区域并保存: {int(clip_rect.width)}x{int(clip_rect.height)} 像素 -> {img_filename} ({path_info})")
-            else:
-                # 不保存图片到本地，但保留截图数据用于Anki
-                self.screenshot_path = None
-                self.status_bar.config(text=f"已截取区域: {int(clip_rect.width)}x{int(clip_rect.height)} 像素 (未保存到本地)")
+                clip_rect = self.selection_pdf_rect
+                dpi = capture_dpi(clip_rect, self.capture_policy)
+                save_info = "将保存到本地" if self.save_image_locally else "未保存到本地"
+                self.status_bar.config(
+                    text=f"已选择区域: {int(clip_rect.width)}x{int(clip_rect.height)} 像素，"
+                         f"截图 {int(clip_rect.width * dpi / 72)}x{int(clip_rect.height * dpi / 72)} @ {dpi} DPI ({save_info})"
+                )
             
-        except Exception as e:
-            self.status_bar.config(text=f"截取区域时出错: {str(e)}")
-            self.screenshot = None
-            self.screenshot_path = None
+            except Exception as e:
+                self.status_bar.config(text=f"截取区域时出错: {str(e)}")
+                self.selection_pdf_rect = None
+    
+    def get_images_dir(self, pdf_path=None):
+        """返回本地图片的保存目录，pdf_path默认为当前文档"""
+        if self.custom_image_path:
+            # 使用自定义路径
+            return self.custom_image_path
+        # 使用默认路径：PDF所在目录下的images文件夹
+        return os.path.join(os.path.dirname(pdf_path or self.pdf_path), "images")
+    
+    def make_card(self):
+        """根据当前问题和选择区域生成待提交的卡片"""
+        return self.make_region_card(
+            self.question_entry.get().strip(), self.pdf_path, self.current_page, self.selection_pdf_rect
+        )
+    
+    def make_region_card(self, question, pdf_path, page_index, clip):
+        """根据问题和指定文档页面上的区域生成待提交的卡片"""
+        clip = fitz.Rect(clip)
+        return {
+            "question": question,
+            "pdf_path": pdf_path,
+            "page_index": page_index,
+            "clip": tuple(clip),
+            "dpi": capture_dpi(clip, self.capture_policy),
+            "images_dir": self.get_images_dir(pdf_path) if self.save_image_locally else None,
+            "encoding": self.get_encoding_settings(),
+        }
+    
+    def get_encoding_settings(self):
+        """返回当前的图片编码设置"""
+        image_format, colors = self.IMAGE_FORMAT_PRESETS[self.image_format_var.get()]
+        try:
+            quality = min(100, max(10, self.image_quality_var.get()))
+        except (tk.TclError, ValueError):
+            # 输入框中不是有效数字时使用默认质量
+            quality = 85
+        return ImageEncodingSettings(image_format, quality, colors)
     
     def check_add_button_state(self, event=None):
         """检查添加到Anki按钮的状态"""
         has_pdf = self.pdf_document is not None
         has_selection = self.selection_start is not None and self.selection_end is not None
         has_question = self.question_entry.get().strip() != ""
-        has_screenshot = self.screenshot is not None  # 只要有截图数据即可，不要求必须保存到本地
+        has_region = self.selection_pdf_rect is not None  # 高分辨率图像在提交时才渲染
         
-        if has_pdf and has_selection and has_question and has_screenshot:
+        if has_pdf and has_selection and has_question and has_region:
             self.add_to_anki_btn.config(state=tk.NORMAL)
+            self.stage_card_btn.config(state=tk.NORMAL)
         else:
             self.add_to_anki_btn.config(state=tk.DISABLED)
+            self.stage_card_btn.config(state=tk.DISABLED)
     
     def toggle_save_image(self):
         """切换图片保存状态"""
@@ -627,181 +4202,260 @@ class PDFAnkiTool:
             self.status_bar.config(text="使用默认图片存储路径")
     
     def add_to_anki(self):
-        """将问题和截取的PDF区域添加到Anki"""
-        if not self.screenshot or not self.question_entry.get().strip():
-            messagebox.showwarning("警告", "请输入问题并选择PDF区域")
-            return
-        
-        try:
-            # 根据是否保存到本地来处理图片数据
-            if self.save_image_locally and self.screenshot_path:
-                # 检查本地图片文件是否存在
-                if not os.path.exists(self.screenshot_path):
-                    raise Exception(f"本地图片文件不存在: {self.screenshot_path}")
-                
-                # 读取本地图片文件
-                with open(self.screenshot_path, 'rb') as img_file:
-                    img_data = img_file.read()
-                
-                # 获取图片文件名
-                img_filename = os.path.basename(self.screenshot_path)
-            else:
-                # 直接使用内存中的截图数据
-                import io
-                img_buffer = io.BytesIO()
-                self.screenshot.save(img_buffer, format="PNG")
-                img_data = img_buffer.getvalue()
-                
-                # 生成唯一的文件名
-                import uuid
-                img_filename = f"screenshot_{uuid.uuid4().hex[:8]}.png"
-            
-            # 首先通过AnkiConnect添加图片
-            import base64
-            response = requests.post(
-                "http://localhost:8765",
-                json={
-                    "action": "storeMediaFile",
-                    "version": 6,
-                    "params": {
-                        "filename": img_filename,
-                        "data": base64.b64encode(img_data).decode('utf-8')
-                    }
-                },
-                timeout=10
-            )
-            
-            response.raise_for_status()
-            result = response.json()
-            
-            if result.get("error") is not None:
-                raise Exception(f"添加图片失败: {result['error']}")
-            
-            # 然后创建Anki卡片
-            question = self.question_entry.get().strip()
-            answer = f'<img src="{img_filename}">'  # 使用HTML格式插入图片
-            
-            # 验证问题和答案不为空
-            if not question:
-                raise Exception("问题不能为空")
-            if not answer:
-                raise Exception("答案不能为空")
-
-            # 首先获取可用的模型名称
-            response = requests.post(
-                "http://localhost:8765",
-                json={
-                    "action": "modelNames",
-                    "version": 6
-                },
-                timeout=10
-            )
-            response.raise_for_status()
-            models_result = response.json()
-            
-            if models_result.get("error") is not None:
-                raise Exception(f"获取模型列表失败: {models_result['error']}")
-            
-            available_models = models_result.get("result", [])
+        """将问题和截取的PDF区域加入发送队列，界面不等待请求完成"""
+        with tracer.span("add_to_anki"):
+            if not self.selection_pdf_rect or not self.question_entry.get().strip():
+                messagebox.showwarning("警告", "请输入问题并选择PDF区域")
+                return
             
-            # 尝试找到合适的模型
-            model_name = None
-            preferred_models = ["问答题", "Basic", "基本", "Cloze", "填空"]
+            try:
+                self.submit_cards([self.make_card()])
             
-            for preferred in preferred_models:
-                if preferred in available_models:
-                    model_name = preferred
-                    break
+                # 清除问题输入和选择区域，让用户可以继续框选
+                self.question_entry.delete(0, tk.END)
+                self.clear_selection()
+                self.status_bar.config(text="正在添加卡片，可以继续框选新区域")
             
-            if not model_name and available_models:
-                model_name = available_models[0]  # 使用第一个可用模型
+            except Exception as e:
+                messagebox.showerror("错误", f"添加到Anki时出错: {str(e)}")
+    
+    def submit_cards(self, cards):
+        """在后台编码图片并写入本地发送队列（由发送队列负责同步到Anki）或.apkg文件"""
+        self.pending_cards += len(cards)
+        # 提交时确定去向，之后切换后端不影响已提交的卡片
+        writer = self.apkg_writer
+        self.anki_client.submit(
+            self.enqueue_cards, cards, writer,
+            on_success=self.on_cards_enqueued if writer is None else self.on_cards_exported,
+            on_error=lambda error: self.on_enqueue_error(cards, error)
+        )
+    
+    def enqueue_cards(self, cards, writer=None):
+        """后台线程：渲染并编码图片，持久化到发送队列或写入.apkg文件，返回卡片数"""
+        with tracer.span("enqueue_cards", cards=len(cards)):
+            # 渲染和编码在工作进程中进行，多张卡片同时提交，由进程池并行处理；
+            # 正在渲染的区域总大小受capture_budget限制，批量提交时工作进程的内存不会无限增长
+            futures = []
+            for card in cards:
+                cost = RasterBudget.estimate(fitz.Rect(card["clip"]), card["dpi"])
+                self.capture_budget.acquire(cost)
+                try:
+                    future = submit_traced(
+                        self.render_pool, render_and_encode_clip,
+                        card["pdf_path"], card["page_index"], card["clip"], card["dpi"], card["encoding"]
+                    )
+                except Exception:
+                    self.capture_budget.release(cost)
+                    raise
+                future.add_done_callback(lambda _, cost=cost: self.capture_budget.release(cost))
+                futures.append(future)
             
-            if not model_name:
-                raise Exception("Anki中没有找到可用的卡片模型")
+            exported = []
+            for card, future in zip(cards, futures):
+                with tracer.span("wait_capture"):
+                    img_data, extension = future.result()
+                img_filename = self.store_card_image(card, img_data, extension)
+                if writer is None:
+                    self.outbox.put(card["question"], img_filename, img_data)
+                else:
+                    exported.append({"question": card["question"], "img_filename": img_filename, "img_data": img_data})
+            if exported:
+                # 同一次提交的卡片在一个事务中写入
+                writer.add_image_notes(exported)
+            return len(cards)
+    
+    def store_card_image(self, card, img_data, extension):
+        """后台线程：根据内容哈希确定图片文件名，按需将编码后的数据保存到本地"""
+        img_filename = media_filename(img_data, extension)
+        
+        # 根据用户设置决定是否保存图片到本地，保存的文件与上传到Anki的数据相同
+        images_dir = card["images_dir"]
+        if images_dir:
+            # 创建文件夹（如果不存在）
+            os.makedirs(images_dir, exist_ok=True)
             
-            # 获取模型的字段信息
-            response = requests.post(
-                "http://localhost:8765",
-                json={
-                    "action": "modelFieldNames",
-                    "version": 6,
-                    "params": {
-                        "modelName": model_name
-                    }
-                },
-                timeout=10
+            # 本地文件名：PDF文件名 + 内容哈希，相同内容不会重复保存，不同内容不会互相覆盖
+            pdf_name = os.path.splitext(os.path.basename(card["pdf_path"]))[0]
+            local_path = os.path.join(images_dir, f"{pdf_name}_{img_filename[len(MEDIA_NAME_PREFIX):]}")
+            if not os.path.exists(local_path):
+                with open(local_path, "wb") as img_file:
+                    img_file.write(img_data)
+        
+        return img_filename
+    
+    def stage_card(self, event=None):
+        """将当前问题和截取区域加入待提交队列"""
+        if not self.selection_pdf_rect or not self.question_entry.get().strip():
+            messagebox.showwarning("警告", "请输入问题并选择PDF区域")
+            return
+        
+        self.staged_cards.append(self.make_card())
+        
+        # 清除问题输入和选择区域，让用户可以继续框选
+        self.question_entry.delete(0, tk.END)
+        self.clear_selection()
+        self.update_queue_controls()
+        self.status_bar.config(text=f"已加入队列（共{len(self.staged_cards)}张），可以继续框选新区域")
+    
+    def flush_staged_cards(self):
+        """将队列中的卡片一次性批量提交到Anki"""
+        if not self.staged_cards:
+            return
+        
+        cards = self.staged_cards
+        self.staged_cards = []
+        self.update_queue_controls()
+        self.submit_cards(cards)
+        self.status_bar.config(text=f"正在批量提交{len(cards)}张卡片...")
+    
+    def on_cards_enqueued(self, count):
+        """卡片已写入发送队列的回调（界面线程）"""
+        self.pending_cards = max(0, self.pending_cards - count)
+        self.status_bar.config(text=f"已保存{count}张卡片，待同步到Anki: {self.outbox.pending_count()}张")
+    
+    def on_cards_exported(self, count):
+        """卡片已写入.apkg文件的回调（界面线程）"""
+        self.pending_cards = max(0, self.pending_cards - count)
+        writer = self.apkg_writer
+        total = f"，本次共{writer.count}张" if writer is not None else ""
+        self.status_bar.config(text=f"已导出{count}张卡片{total}，点击'完成导出'生成.apkg文件")
+    
+    def on_backend_change(self, choice):
+        """切换卡片去向"""
+        if choice == self.BACKEND_APKG:
+            if self.apkg_writer is not None:
+                return
+            path = filedialog.asksaveasfilename(
+                defaultextension=".apkg", filetypes=[("Anki牌组包", "*.apkg"), ("所有文件", "*.*")]
             )
-            response.raise_for_status()
-            fields_result = response.json()
-            
-            if fields_result.get("error") is not None:
-                raise Exception(f"获取字段信息失败: {fields_result['error']}")
-            
-            field_names = fields_result.get("result", [])
-            
-            # 根据可用字段确定字段映射
-            fields = {}
-            if len(field_names) >= 2:
-                # 如果有至少两个字段，使用前两个字段
-                fields[field_names[0]] = question
-                fields[field_names[1]] = answer
-            elif len(field_names) == 1:
-                # 如果只有一个字段，合并问题和答案
-                fields[field_names[0]] = f"{question}\n\n{answer}"
+            if not path:
+                self.backend_var.set(self.BACKEND_ANKICONNECT)
+                return
+            try:
+                self.apkg_writer = ApkgWriter(path)
+            except Exception as e:
+                self.backend_var.set(self.BACKEND_ANKICONNECT)
+                messagebox.showerror("错误", f"无法创建导出文件: {str(e)}")
+                return
+            self.finish_export_btn.config(state=tk.NORMAL)
+            self.status_bar.config(text=f"卡片将导出到: {path}，完成后点击'完成导出'")
+        else:
+            self.finish_apkg_export()
+    
+    def finish_apkg_export(self):
+        """在已提交的卡片写完后生成.apkg文件，并切换回AnkiConnect"""
+        writer = self.apkg_writer
+        if writer is None:
+            return
+        self.apkg_writer = None
+        self.backend_var.set(self.BACKEND_ANKICONNECT)
+        self.finish_export_btn.config(state=tk.DISABLED)
+        self.status_bar.config(text="正在生成.apkg文件...")
+        # 与卡片编码在同一个后台线程中排队，保证之前提交的卡片都已写入
+        return self.anki_client.submit(
+            writer.close,
+            on_success=lambda count: self.status_bar.config(text=f"已导出{count}张卡片到: {writer.path}"),
+            on_error=lambda error: self.on_apkg_export_error(writer, error)
+        )
+    
+    def on_apkg_export_error(self, writer, error):
+        """生成.apkg文件失败的回调（界面线程），删除临时文件"""
+        writer.discard()
+        messagebox.showerror("错误", f"生成.apkg文件时出错: {str(error)}")
+    
+    def on_close(self):
+        """关闭窗口：停止后台任务，完成尚未结束的卡片提交和导出后再销毁窗口
+        
+        等待在单独的线程中进行，界面线程继续处理事件：后台线程通过root.after切换到界面线程的回调
+        需要界面线程处理，界面线程阻塞等待或提前销毁窗口都会让这些线程卡住，导致程序无法退出。
+        """
+        if self._closing:
+            return
+        self._closing = True
+        self.root.withdraw()
+        
+        if self.segmenter is not None:
+            self.segmenter.cancel()
+        self.stop_thumbnails()
+        self.prefetcher.shutdown()
+        # 停止发送，未发送的卡片保留在本地，下次启动时继续发送
+        self.outbox.stop()
+        self.finish_apkg_export()
+        
+        closer = threading.Thread(target=self.shutdown_background_work, name="shutdown", daemon=True)
+        closer.start()
+        self.root.after(50, self.finish_close, closer)
+    
+    def shutdown_background_work(self):
+        """后台线程：等待已提交的卡片和导出完成，然后关闭工作线程和进程池"""
+        # AnkiConnect客户端只有一个工作线程，最后提交的空任务完成时，之前的编码、写入和导出都已完成，
+        # 它们的回调也已经交给界面线程
+        try:
+            self.anki_client.submit(lambda: None).result(timeout=60)
+        except Exception:
+            pass
+        self.anki_client.shutdown()
+        # 等待进程池的管理线程结束，之后不会再有渲染结果的回调
+        self.render_pool.shutdown(wait=True, cancel_futures=True)
+        self.disk_render_cache.shutdown()
+    
+    def finish_close(self, closer):
+        """后台任务全部结束后销毁窗口（界面线程）"""
+        if closer.is_alive():
+            self.root.after(50, self.finish_close, closer)
+            return
+        self.root.destroy()
+    
+    def on_enqueue_error(self, cards, error):
+        """写入发送队列失败的回调（界面线程），卡片放回待提交队列"""
+        self.pending_cards = max(0, self.pending_cards - len(cards))
+        self.staged_cards = cards + self.staged_cards
+        self.update_queue_controls()
+        messagebox.showerror("错误", f"保存卡片时出错（卡片已放回队列）: {str(error)}")
+    
+    def on_outbox_update(self, update):
+        """发送队列状态变化的回调（界面线程）"""
+        pending = update["pending"]
+        if "error" in update:
+            if update["offline"]:
+                self.status_bar.config(
+                    text=f"无法连接到AnkiConnect，{pending}张卡片已保存在本地，{int(update['retry_in'])}秒后自动重试"
+                )
             else:
-                raise Exception("模型没有可用的字段")
-            
-            # 使用找到的模型添加卡片
-            response = requests.post(
-                "http://localhost:8765",
-                json={
-                    "action": "addNote",
-                    "version": 6,
-                    "params": {
-                        "note": {
-                            "deckName": "默认",
-                            "modelName": model_name,
-                            "fields": fields,
-                            "tags": ["PDF截取"]
-                        }
-                    }
-                },
-                timeout=10
-            )
-            
-            response.raise_for_status()
-            result = response.json()
-            
-            if result.get("error") is not None:
-                error_msg = result['error']
-                if 'model was not found' in error_msg:
-                    raise Exception(
-                        f"添加卡片失败: {error_msg}\n\n"
-                        f"使用的模型: {model_name}\n"
-                        f"可用模型: {', '.join(available_models)}\n\n"
-                        "请确保Anki中存在正确的卡片模型。"
-                    )
-                elif 'cannot create note because it is empty' in error_msg:
-                    raise Exception(
-                        f"添加卡片失败: {error_msg}\n\n"
-                        f"使用的模型: {model_name}\n"
-                        f"字段映射: {fields}\n"
-                        f"可用字段: {', '.join(field_names)}\n\n"
-                        "请检查模型字段配置是否正确。"
-                    )
-                else:
-                    raise Exception(f"添加卡片失败: {error_msg}\n\n使用的模型: {model_name}")
-            
-            # 成功添加卡片
-            save_path_info = f"图片已保存到: {self.screenshot_path}" if self.screenshot_path else "图片未保存到本地"
-            messagebox.showinfo("成功", f"卡片已成功添加到Anki!\n使用的模型: {model_name}\n{save_path_info}")
-            
-            # 清除问题输入和选择区域，让用户可以继续框选
-            self.question_entry.delete(0, tk.END)
-            self.clear_selection()
-            self.status_bar.config(text="卡片添加成功，可以继续框选新区域")
-            
-        except requests.exceptions.ConnectionError:
+                self.status_bar.config(
+                    text=f"同步到Anki时出错: {update['error']}，{int(update['retry_in'])}秒后自动重试"
+                )
+            return
+        
+        failures = update["failures"]
+        self.status_bar.config(
+            text=f"已同步到Anki: {update['sent']}张，失败{len(failures)}张，待同步{pending}张"
+        )
+        if failures:
+            details = "\n".join(f"- {question}: {error}" for question, error in failures[:10])
+            more = f"\n... 另有{len(failures) - 10}张" if len(failures) > 10 else ""
+            messagebox.showerror("部分卡片添加失败", f"以下卡片无法添加到Anki:\n\n{details}{more}")
+    
+    def update_queue_controls(self):
+        """更新待提交队列按钮状态"""
+        count = len(self.staged_cards)
+        self.flush_queue_btn.config(text=f"提交队列({count})", state=tk.NORMAL if count else tk.DISABLED)
+    
+    def refresh_anki_models(self):
+        """重新查询Anki中的卡片模型和字段"""
+        self.status_bar.config(text="正在刷新Anki模型信息...")
+        self.anki_client.invalidate_media_index()
+        self.anki_client.submit(
+            self.anki_client.get_model_info, True,
+            on_success=lambda info: self.status_bar.config(
+                text=f"模型信息已刷新: {info['model_name']}（字段: {', '.join(info['field_names'])}）"
+            ),
+            on_error=self.show_anki_error
+        )
+    
+    def show_anki_error(self, error):
+        """显示AnkiConnect相关的错误信息"""
+        if isinstance(error, requests.exceptions.ConnectionError):
             messagebox.showerror(
                 "连接错误",
                 "无法连接到AnkiConnect。\n\n"
@@ -810,10 +4464,343 @@ class PDFAnkiTool:
                 "2. AnkiConnect插件已安装并启用\n"
                 "3. AnkiConnect运行在localhost:8765"
             )
-        except requests.exceptions.Timeout:
+        elif isinstance(error, requests.exceptions.Timeout):
             messagebox.showerror("超时错误", "连接AnkiConnect超时，请重试。")
-        except Exception as e:
-            messagebox.showerror("错误", f"添加到Anki时出错: {str(e)}")
+        else:
+            messagebox.showerror("错误", f"添加到Anki时出错: {str(error)}")
+
+# ---------------------------------------------------------------------------
+# 无界面批量模式：根据清单文件批量生成卡片
+# ---------------------------------------------------------------------------
+
+def load_manifest(manifest_path, default_pdf=None):
+    """读取JSON或CSV清单，返回卡片任务列表
+    
+    每个条目包含pdf（可省略，使用default_pdf或清单顶层的pdf）、page（从1开始的页码）、
+    rect（PDF坐标系中的[x0, y0, x1, y1]）、question，以及可选的deck和tags。
+    CSV清单的列为pdf,page,x0,y0,x1,y1,question,deck,tags，tags以分号分隔。
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    
+    if manifest_path.lower().endswith(".csv"):
+        with open(manifest_path, "r", encoding="utf-8-sig", newline="") as f:
+            entries = []
+            for row in csv.DictReader(f):
+                entry = dict(row)
+                entry["rect"] = [row["x0"], row["y0"], row["x1"], row["y1"]]
+                if row.get("tags"):
+                    entry["tags"] = [tag for tag in row["tags"].split(";") if tag]
+                entries.append(entry)
+    else:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            default_pdf = default_pdf or data.get("pdf")
+            entries = data.get("cards", [])
+        else:
+            entries = data
+    
+    tasks = []
+    for number, entry in enumerate(entries, 1):
+        pdf_path = entry.get("pdf") or default_pdf
+        if not pdf_path:
+            raise ValueError(f"第{number}条记录没有指定PDF文件")
+        if not os.path.isabs(pdf_path):
+            pdf_path = os.path.join(base_dir, pdf_path)
+        
+        question = (entry.get("question") or "").strip()
+        if not question:
+            raise ValueError(f"第{number}条记录的问题为空")
+        
+        page = int(entry["page"])
+        if page < 1:
+            raise ValueError(f"第{number}条记录的页码无效: {entry['page']}")
+        
+        x0, y0, x1, y1 = (float(value) for value in entry["rect"])
+        if x1 - x0 < 1 or y1 - y0 < 1:
+            raise ValueError(f"第{number}条记录的区域无效: {entry['rect']}")
+        
+        tasks.append({
+            "pdf_path": pdf_path,
+            "page_index": page - 1,
+            "clip": (x0, y0, x1, y1),
+            "question": question,
+            "deck": entry.get("deck") or None,
+            "tags": entry.get("tags") or None,
+        })
+    return tasks
+
+
+def _traced_call(func, args):
+    """工作进程：开启埋点执行func，返回(结果, 时间原点, 期间记录的事件)"""
+    tracer.enable()
+    try:
+        result = func(*args)
+    finally:
+        tracer.enabled = False
+    origin, events = tracer.drain()
+    return result, origin, events
+
+
+def submit_traced(executor, func, *args):
+    """提交任务到进程池，返回future；开启埋点时工作进程中记录的span随结果返回，合并到本进程的记录中
+    
+    工作进程重新导入本模块，埋点默认关闭，不经过这里提交的任务在trace中只能看到主进程的等待时间。
+    """
+    if not tracer.enabled:
+        return executor.submit(func, *args)
+    inner = executor.submit(_traced_call, func, args)
+    outer = Future()
+    # 取消返回的future时取消进程池中的任务
+    outer.cancel = inner.cancel
+    
+    def unwrap(done):
+        if done.cancelled():
+            Future.cancel(outer)
+            return
+        error = done.exception()
+        if error is not None:
+            outer.set_exception(error)
+            return
+        result, origin, events = done.result()
+        tracer.merge(origin, events)
+        outer.set_result(result)
+    
+    inner.add_done_callback(unwrap)
+    return outer
+
+
+# 工作进程（批量模式、自动分题和界面的后台渲染）中打开的文档，每个进程只保留一个
+_worker_document = {"key": None, "doc": None}
+
+
+def _open_worker_document(pdf_path):
+    """工作进程：返回指定文件的文档句柄，切换文件或文件被修改后重新打开"""
+    stat = os.stat(pdf_path)
+    key = (pdf_path, stat.st_size, stat.st_mtime_ns)
+    if _worker_document["key"] != key:
+        if _worker_document["doc"] is not None:
+            _worker_document["doc"].close()
+        _worker_document["doc"] = fitz.open(pdf_path)
+        _worker_document["key"] = key
+    return _worker_document["doc"]
+
+
+def render_page_in_worker(pdf_path, page_index, scale_factor, render_mode="matrix"):
+    """工作进程：渲染整个页面，返回PIL图像"""
+    return render_page(_open_worker_document(pdf_path)[page_index], scale_factor, render_mode)
+
+
+def layout_rects_in_worker(pdf_path, page_index):
+    """工作进程：提取页面内容块的边界框，界面进程据此建立PageLayoutIndex"""
+    return PageLayoutIndex.page_rects(_open_worker_document(pdf_path)[page_index])
+
+
+def save_thumbnail_in_worker(pdf_path, page_index, size, path):
+    """工作进程：渲染不超过size的缩略图，原子地保存为JPEG"""
+    page = _open_worker_document(pdf_path)[page_index]
+    scale = min(size[0] / page.rect.width, size[1] / page.rect.height)
+    img = render_page(page, scale)
+    del page
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    img.save(tmp_path, format="JPEG", quality=75)
+    os.replace(tmp_path, path)
+
+
+def render_and_encode_clip(pdf_path, page_index, clip, dpi, settings):
+    """工作进程：直接在原页面上渲染裁剪区域并按编码设置编码，返回(数据, 扩展名)"""
+    img = render_clip(_open_worker_document(pdf_path)[page_index], fitz.Rect(clip), dpi)
+    try:
+        return encode_image(img, settings)
+    finally:
+        img.close()
+
+
+def _segment_pages(pdf_path, page_indices):
+    """工作进程：分析一组页面的版面，返回这些页面的分题草稿"""
+    doc = _open_worker_document(pdf_path)
+    drafts = []
+    for page_index in page_indices:
+        page = doc[page_index]
+        drafts.extend(DocumentSegmenter.segment_page(page, page_index))
+        del page
+        release_mupdf_store()
+    return drafts
+
+
+def bounded_map(executor, func, tasks, budget, cost):
+    """按任务顺序提交到进程池，已提交未取回的任务总成本不超过budget，按完成顺序返回(任务, 已完成的future)
+    
+    与executor.map一次提交全部任务不同，这里任务清单按需读取，结果取走后才提交新任务，
+    处理超大文档时内存占用保持平稳。返回future而不是结果，单个任务出错不会中断其余任务。
+    """
+    pending = {}
+    tasks = iter(tasks)
+    next_task = next(tasks, None)
+    while next_task is not None or pending:
+        # 在预算允许的范围内尽量多提交任务
+        while next_task is not None and budget.try_acquire(cost(next_task)):
+            future = submit_traced(executor, func, next_task)
+            pending[future] = next_task
+            next_task = next(tasks, None)
+        
+        with tracer.span("wait_results", pending=len(pending)):
+            done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+        for future in done:
+            task = pending.pop(future)
+            budget.release(cost(task))
+            yield task, future
+
+
+def _render_batch_task(task):
+    """工作进程：渲染批量模式的一个任务"""
+    return render_and_encode_clip(task["pdf_path"], task["page_index"], task["clip"], task["dpi"], task["settings"])
+
+
+def run_batch(manifest_path, pdf_path=None, deck_name="默认", tags=("PDF截取",),
+              settings=None, policy=None, workers=None, batch_size=50, url="http://localhost:8765",
+              max_raster_bytes=CAPTURE_RASTER_LIMIT, apkg_path=None):
+    """根据清单批量生成卡片：多进程渲染编码，按批次通过发送队列提交到AnkiConnect，或写入apkg_path指定的.apkg文件
+    
+    卡片先写入本地发送队列再发送，与界面使用相同的ID标签查重，中断或超时后重新发送不会重复添加。
+    Anki无法连接时，剩余的卡片留在发送队列中，下次启动界面时自动同步；队列中之前未发送的卡片也会一起发送。
+    每个区域的DPI由截图策略policy确定，正在渲染的区域总大小不超过max_raster_bytes。
+    单个区域渲染失败只记为失败，不影响其余卡片。返回统计信息。
+    """
+    settings = settings or ImageEncodingSettings()
+    policy = policy or CapturePolicy()
+    tasks = load_manifest(manifest_path, default_pdf=pdf_path)
+    total = len(tasks)
+    stats = {"total": total, "added": 0, "failed": 0, "queued": 0, "bytes": 0}
+    failures = []
+    started = time.perf_counter()
+    
+    def on_update(update):
+        """发送队列的状态回调（当前线程）"""
+        stats["added"] += update.get("sent", 0)
+        for question, error in update.get("failures", ()):
+            stats["failed"] += 1
+            failures.append((question, error))
+    
+    writer = ApkgWriter(apkg_path) if apkg_path else None
+    outbox = None
+    if writer is None:
+        outbox = CardOutbox(AnkiConnectClient(url=url), on_update=on_update, batch_size=batch_size)
+    offline = False
+    
+    def submit(batch):
+        nonlocal offline
+        if writer is not None:
+            results = writer.add_image_notes(batch, deck_name=deck_name, tags=tags, batch_size=batch_size)
+            for card, result in zip(batch, results):
+                if result["error"] is None:
+                    stats["added"] += 1
+                else:
+                    stats["failed"] += 1
+                    failures.append((card["question"], result["error"]))
+            return
+        
+        for card in batch:
+            outbox.put(card["question"], card["img_filename"], card["img_data"],
+                       deck_name=card["deck"], tags=card["tags"])
+        if offline:
+            return
+        try:
+            outbox.flush()
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, OutboxRetryLater) as e:
+            # 之后的卡片只写入发送队列，不再尝试连接
+            print(f"\n无法提交到Anki（{e}），剩余卡片将保存在本地发送队列")
+            offline = True
+    
+    # 按文件和页码排序，同一工作进程连续渲染同一页面时可以复用MuPDF的缓存
+    for task in tasks:
+        task["dpi"] = capture_dpi(fitz.Rect(task["clip"]), policy)
+        task["settings"] = settings
+    ordered = sorted(tasks, key=lambda task: (task["pdf_path"], task["page_index"]))
+    budget = RasterBudget(max_raster_bytes)
+    batch = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = bounded_map(
+                executor, _render_batch_task, ordered, budget,
+                cost=lambda task: RasterBudget.estimate(fitz.Rect(task["clip"]), task["dpi"])
+            )
+            for done, (task, future) in enumerate(results, 1):
+                try:
+                    img_data, extension = future.result()
+                except Exception as e:
+                    stats["failed"] += 1
+                    failures.append((task["question"], f"第{task['page_index'] + 1}页渲染失败: {e}"))
+                else:
+                    stats["bytes"] += len(img_data)
+                    batch.append({
+                        "question": task["question"],
+                        "img_filename": media_filename(img_data, extension),
+                        "img_data": img_data,
+                        "deck": task["deck"] or deck_name,
+                        "tags": task["tags"] or list(tags),
+                    })
+                if len(batch) >= batch_size:
+                    submit(batch)
+                    batch = []
+                elapsed = time.perf_counter() - started
+                print(f"\r[{done}/{total}] 已渲染，{done / elapsed:.1f} 张/秒", end="", flush=True)
+        if batch:
+            submit(batch)
+    except BaseException:
+        # 中途失败或被中断时不留下半成品的临时文件；已写入发送队列的卡片保留，下次继续发送
+        if writer is not None:
+            writer.discard()
+        raise
+    finally:
+        if outbox is not None:
+            stats["queued"] = outbox.pending_count()
+            outbox.close()
+            outbox.client.shutdown()
+    if writer is not None:
+        writer.close()
+    
+    stats["seconds"] = time.perf_counter() - started
+    stats["cards_per_second"] = total / stats["seconds"] if stats["seconds"] else 0.0
+    print()
+    print(
+        f"完成: 共{total}张，添加{stats['added']}张，失败{stats['failed']}张，"
+        f"发送队列中待同步{stats['queued']}张；用时{stats['seconds']:.1f}秒，"
+        f"{stats['cards_per_second']:.1f} 张/秒，图片共{stats['bytes'] / 1024 / 1024:.1f} MB"
+    )
+    if apkg_path:
+        print(f"已导出到: {apkg_path}")
+    for question, error in failures[:20]:
+        print(f"  失败: {question}: {error}")
+    stats["failures"] = failures
+    return stats
+
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="PDF到Anki问答题工具")
+    parser.add_argument("--batch", metavar="MANIFEST", help="无界面批量模式：根据JSON/CSV清单生成卡片")
+    parser.add_argument("--pdf", help="清单条目未指定pdf时使用的PDF文件")
+    parser.add_argument("--deck", default="默认", help="牌组名称（默认: 默认）")
+    parser.add_argument("--format", default="PNG", choices=sorted(IMAGE_EXTENSIONS), help="图片格式")
+    parser.add_argument("--quality", type=int, default=85, help="JPEG/WebP质量")
+    parser.add_argument("--colors", type=int, default=0, help="PNG调色板颜色数，0表示不量化")
+    parser.add_argument("--dpi", type=int, default=300, help="截图渲染DPI上限")
+    parser.add_argument("--max-megapixels", type=float, default=CAPTURE_MAX_PIXELS / 1e6,
+                        help="单张截图的像素上限（百万像素），超出时自动降低DPI，0表示不限制")
+    parser.add_argument("--target-size", type=int, default=CAPTURE_TARGET_SIZE,
+                        help="截图长边的目标像素数，超出时自动降低DPI，0表示不限制")
+    parser.add_argument("--workers", type=int, default=None, help="渲染进程数（默认: CPU核数）")
+    parser.add_argument("--batch-size", type=int, default=50, help="每次提交到Anki的卡片数")
+    parser.add_argument("--url", default="http://localhost:8765", help="AnkiConnect地址")
+    parser.add_argument("--apkg", metavar="PATH", help="不连接Anki，直接把卡片导出为.apkg文件")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="开启性能埋点，退出时导出到PATH（.json为Chrome trace格式，其他为JSON Lines）")
+    parser.add_argument("--trace-status", action="store_true", help="在状态栏显示埋点耗时摘要")
+    parser.add_argument("--max-raster-mb", type=int, default=CAPTURE_RASTER_LIMIT // (1024 * 1024),
+                        help="同时渲染中的图像内存上限（MB）")
+    return parser.parse_args(argv)
+
 
 if __name__ == "__main__":
     # 检查是否安装了必要的库
@@ -823,16 +4810,30 @@ if __name__ == "__main__":
         "PIL": "Pillow"
     }
     
-    missing_libraries = []
-    for lib, package in required_libraries.items():
-        try:
-            __import__(lib)
-        except ImportError:
-            missing_libraries.append(package)
+    # 只检查是否安装，不执行导入；真正的导入推迟到窗口显示之后
+    missing_libraries = [
+        package for lib, package in required_libraries.items()
+        if importlib.util.find_spec(lib) is None
+    ]
+    
+    args = parse_args()
+    if args.trace:
+        tracer.enable(args.trace)
     
     if missing_libraries:
         print(f"请先安装以下缺失的库: {' '.join([f'pip install {lib}' for lib in missing_libraries])}")
+    elif args.batch:
+        result = run_batch(
+            args.batch, pdf_path=args.pdf, deck_name=args.deck,
+            settings=ImageEncodingSettings(args.format, args.quality, args.colors),
+            policy=CapturePolicy(args.dpi, int(args.max_megapixels * 1e6), args.target_size),
+            workers=args.workers, batch_size=args.batch_size, url=args.url,
+            max_raster_bytes=args.max_raster_mb * 1024 * 1024, apkg_path=args.apkg
+        )
+        sys.exit(1 if result["failed"] else 0)
     else:
         root = tk.Tk()
-        app = PDFAnkiTool(root)
+        app = PDFAnkiTool(
+            root, show_trace_summary=args.trace_status or bool(os.environ.get("PDFANKI_TRACE_STATUS"))
+        )
         root.mainloop()
@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# 测试直接导入仓库根目录下的main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def display():
+    """需要真实显示的测试在没有显示（例如无图形界面的CI）时跳过"""
+    import tkinter as tk
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        pytest.skip("没有可用的显示")
+    root.destroy()
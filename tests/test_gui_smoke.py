@@ -0,0 +1,75 @@
+"""界面冒烟测试：创建主窗口，打开PDF并完成翻页、缩放和框选"""
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在独立的进程中运行，HOME指向临时目录，缓存和发送队列不会写入用户目录
+SMOKE_SCRIPT = textwrap.dedent("""
+    import sys
+    import time
+    import tkinter as tk
+    import fitz
+    import main
+
+    def pump(root, seconds=0.5):
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            root.update()
+            time.sleep(0.01)
+
+    pdf_path = sys.argv[1]
+    doc = fitz.open()
+    for index in range(3):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Page {index + 1}")
+    doc.save(pdf_path)
+
+    root = tk.Tk()
+    app = main.PDFAnkiTool(root)
+    pump(root)
+
+    main.filedialog.askopenfilename = lambda **kwargs: pdf_path
+    app.select_pdf()
+    pump(root)
+    assert app.pdf_document is not None
+
+    app.next_page()
+    app.zoom_in()
+    pump(root)
+    assert app.current_page == 1
+
+    app.set_selection_from_pdf_rect(fitz.Rect(60, 50, 200, 90))
+    app.capture_selected_area()
+    assert app.selection_pdf_rect is not None
+    app.clear_selection()
+    assert app.selection_pdf_rect is None
+
+    # 关闭时界面线程继续处理事件，后台任务结束后窗口才被销毁
+    app.on_close()
+    deadline = time.perf_counter() + 60
+    while time.perf_counter() < deadline:
+        try:
+            root.update()
+        except tk.TclError:
+            break
+        time.sleep(0.01)
+    else:
+        raise AssertionError("window was not destroyed")
+    print("ok")
+""")
+
+
+def test_main_window_smoke(display, tmp_path):
+    pytest.importorskip("fitz")
+    env = dict(os.environ, HOME=str(tmp_path), USERPROFILE=str(tmp_path))
+    result = subprocess.run(
+        [sys.executable, "-c", SMOKE_SCRIPT, str(tmp_path / "smoke.pdf")],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip().endswith("ok")
@@ -0,0 +1,51 @@
+"""大文档模式：页数超过阈值时缩小渲染缓存并关闭相邻页面预取"""
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import main
+
+
+class RecordingPool:
+    """记录预取提交的页面，不实际渲染"""
+
+    def __init__(self):
+        self.pages = []
+
+    def submit(self, func, pdf_path, page_index, *args):
+        self.pages.append(page_index)
+        future = Future()
+        future.set_exception(RuntimeError("not rendered"))
+        return future
+
+
+def open_document(tmp_path, page_count):
+    """模拟打开一个page_count页的文档，应用内存配置后调度预取，返回(界面状态, 预取提交的页面)"""
+    pdf_path = tmp_path / "doc.pdf"
+    pdf_path.write_bytes(b"%PDF-1.4\n")
+    pool = RecordingPool()
+    render_cache = main.PageRenderCache()
+    app = SimpleNamespace(
+        pdf_document=[None] * page_count, pdf_path=str(pdf_path), current_page=5, scale_factor=1.0,
+        render_mode="matrix", tiled=False, render_cache=render_cache, render_cache_limit=256 * 1024 * 1024,
+        default_prefetch_window=1, prefetch_window=1,
+        prefetcher=main.PagePrefetcher(render_cache, pool, window=1),
+    )
+    main.PDFAnkiTool.apply_memory_profile(app)
+    main.PDFAnkiTool.schedule_prefetch(app)
+    # 等待预取线程处理完已提交的任务
+    app.prefetcher._executor.shutdown(wait=True)
+    return app, pool.pages
+
+
+def test_small_document_prefetches_neighbours(tmp_path):
+    app, pages = open_document(tmp_path, 20)
+    assert not app.large_document_mode
+    assert sorted(pages) == [4, 6]
+
+
+def test_large_document_disables_prefetch(tmp_path):
+    app, pages = open_document(tmp_path, main.LARGE_DOCUMENT_PAGES + 1)
+    assert app.large_document_mode
+    assert app.prefetch_window == 0
+    assert pages == []
+    assert app.render_cache.max_bytes < app.render_cache_limit
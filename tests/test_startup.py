@@ -0,0 +1,36 @@
+"""启动时间：导入main时不加载重型依赖，主窗口在目标时间内完成首次绘制"""
+import json
+import os
+import subprocess
+import sys
+
+from benchmark import HEAVY_MODULES, STARTUP_PROBE, STARTUP_TARGET_MS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_probe(tmp_path):
+    """在新的解释器中运行启动探针，HOME指向临时目录"""
+    env = dict(os.environ, HOME=str(tmp_path), USERPROFILE=str(tmp_path))
+    result = subprocess.run(
+        [sys.executable, "-c", STARTUP_PROBE], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_defers_heavy_modules(tmp_path):
+    code = "import sys, main; print([m for m in %r if m in sys.modules])" % (HEAVY_MODULES,)
+    env = dict(os.environ, HOME=str(tmp_path), USERPROFILE=str(tmp_path))
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "[]"
+
+
+def test_window_first_paint_within_target(display, tmp_path):
+    probe = run_probe(tmp_path)
+    assert "first_paint_ms" in probe, probe.get("first_paint_skipped")
+    assert probe["heavy_modules_at_import"] == []
+    assert probe["first_paint_ms"] <= STARTUP_TARGET_MS